@@ -8,9 +8,25 @@
 # A simple api to communicate with lollms-webui and its models.
 ######
 from flask import request
+from flask_socketio import join_room
 from datetime import datetime
-from api.db import DiscussionsDB, Discussion
+from api.db import DiscussionsDB, Discussion, Message
 from api.helpers import compare_lists
+from api.scheduler import GenerationScheduler, CancellationToken, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from api.batching import BatchedGenerator, BatchRequest, supports_batching
+from api.prefix_cache import PrefixStateCache
+from api.completion_cache import CompletionCache
+from api.model_host import ModelHostProxy
+from api.model_pool import ModelPool, model_file_size
+from api.speculative import SpeculativeDecoder, supports_verification, supports_drafting
+from api.telemetry import GenerationTrace, GenerationTelemetry
+from api.response_cache import ResponseCache
+from api.emit_queue import EmitQueues, TokenBucket
+from api.summarizer import DiscussionSummarizer
+from api.context_index import ContextIndex, select_context, TEXT_EXTENSIONS
+from api.server_mode import get_patched_mode, run_native, wrap_model
+from api.streaming import negotiate_protocol, update_payload, MessageStream, text_checksum
+from collections import OrderedDict
 from pathlib import Path
 import importlib
 from lollms.config import InstallOption
@@ -31,24 +47,11 @@ import sys
 from lollms.terminal import MainMenu
 import urllib
 import gc
-import ctypes
 from functools import partial
 import json
-
-def terminate_thread(thread):
-    if thread:
-        if not thread.is_alive():
-            ASCIIColors.yellow("Thread not alive")
-            return
-
-        thread_id = thread.ident
-        exc = ctypes.py_object(SystemExit)
-        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, exc)
-        if res > 1:
-            ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, None)
-            raise SystemError("Failed to terminate the thread.")
-        else:
-            ASCIIColors.yellow("Canceled successfully")
+import copy
+import zlib
+import uuid
 
 __author__ = "parisneo"
 __github__ = "https://github.com/ParisNeo/lollms-webui"
@@ -112,13 +115,24 @@ def parse_requirements_file(requirements_path):
 class LoLLMsAPPI(LollmsApplication):
     def __init__(self, config:LOLLMSConfig, socketio, config_file_path:str, lollms_paths: LollmsPaths) -> None:
 
-        super().__init__("Lollms_webui",config, lollms_paths, callback=self.process_chunk)
+        # Loaded models kept in memory, filled by load_model while the application is built.
+        # Its lock is the model lock of the generations, so that no model is unloaded while generating
+        self.init_model_state(config)
+        load_now = not config["load_model_in_background"]
+        super().__init__("Lollms_webui",config, lollms_paths, load_binding=load_now, load_model=load_now, callback=self.process_chunk)
         self.is_ready = True
         
         
         self.socketio = socketio
         self.config_file_path = config_file_path
-        self.cancel_gen = False
+        # Events sent from the generations go through one queue per client so that a slow client doesn't block them
+        self.emit_queues = EmitQueues(self.socketio.emit, self.socketio.start_background_task, max_size=config["emit_queue_size"])
+        if load_now:
+            self.set_loading_status("ready", 100)
+            self.model_loaded.set()
+        else:
+            # Personalities are mounted without model and pointed to it once it is loaded
+            self.socketio.start_background_task(self.load_binding_and_model)
 
         # Keeping track of current discussion and message
         self._current_user_message_id = 0
@@ -141,38 +155,39 @@ class LoLLMsAPPI(LollmsApplication):
 
         # This is used to keep track of messages 
         self.download_infos={}
-        
-        self.connections = {0:{
-                "current_discussion":None,
-                "generated_text":"",
-                "cancel_generation": False,          
-                "generation_thread": None,
-                "processing":False,
-                "schedule_for_deletion":False
-            }
-        }
-        
+
+        self.init_generation_state()
+
         # =========================================================================================
         # Socket IO stuff    
         # =========================================================================================
         @socketio.on('connect')
-        def connect():
+        def connect(auth=None):
+            # Streaming protocol requested in the auth data or the query string
+            requested = auth.get("protocol") if isinstance(auth, dict) else None
+            protocol = negotiate_protocol(requested if requested is not None else request.args.get("protocol"))
+            # Stable across reconnections: the messages are streamed to the room of the session
+            session = auth.get("session") if isinstance(auth, dict) and auth.get("session") else request.args.get("session") or uuid.uuid4().hex
+            join_room(session)
             #Create a new connection information
-            self.connections[request.sid] = {
-                "current_discussion":None,
-                "generated_text":"",
-                "cancel_generation": False,          
-                "generation_thread": None,
-                "processing":False,
-                "schedule_for_deletion":False
-            }
-            self.socketio.emit('connected', room=request.sid) 
+            self.connections[request.sid] = self.new_connection(protocol, session)
+            self.socketio.emit('connected', {"protocol": protocol, "session": session}, room=request.sid) 
+            if not self.model_loaded.is_set():
+                self.socketio.emit('loading_progress', self.loading_status, room=request.sid)
             ASCIIColors.success(f'Client {request.sid} connected')
 
         @socketio.on('disconnect')
         def disconnect():
             try:
                 self.socketio.emit('disconnected', room=request.sid) 
+                for key in [key for key in self.rate_limits if key[0]==request.sid]:
+                    del self.rate_limits[key]
+                if self.config["stream_resume_timeout"]>0:
+                    # The generations go on for a while in case the client comes back with the same session
+                    self.connections[request.sid]["schedule_for_deletion"]=True
+                    self.socketio.start_background_task(self.release_disconnected_client, request.sid)
+                    return
+                self.generation_scheduler.cancel(client_id=request.sid)
                 if self.connections[request.sid]["processing"]:
                     self.connections[request.sid]["schedule_for_deletion"]=True
                 else:
@@ -182,6 +197,42 @@ class LoLLMsAPPI(LollmsApplication):
             
             ASCIIColors.error(f'Client {request.sid} disconnected')
 
+        @socketio.on('resync_message')
+        def resync_message(data):
+            # Sent by clients that missed updates of a message (gap in the sequence numbers or wrong checksum)
+            self.send_message_resync(request.sid, int(data["id"]))
+
+        @socketio.on('resume_stream')
+        def resume_stream(data):
+            # Sent after reconnecting with the session of a previous connection: replays the updates following seq
+            client_id = request.sid
+            message_id = int(data["id"])
+            stream = self.message_streams.get(message_id) or self.closed_streams.get(message_id)
+            if stream is None or stream.session != self.connections[client_id]["session"]:
+                self.send_message_resync(client_id, message_id)
+                return
+            protocol = self.connections[client_id]["protocol"]
+            with stream.lock:
+                updates = stream.replay(int(data.get("seq", 0)))
+                if updates is None:
+                    # Too old for the replay buffer
+                    self.send_message_resync(client_id, message_id)
+                    return
+                # Through the queue of the session, to stay in order with the live updates
+                for seq, message_type, chunk, metadata in updates:
+                    self.emit_queued('update_message', update_payload(protocol, stream.sender, stream.discussion_id, message_id, seq, message_type, chunk, metadata), stream.session)
+                if stream.close_payload is not None:
+                    payload = dict(stream.close_payload)
+                    if protocol == "compact":
+                        del payload["content"]
+                    self.emit_queued('close_message', payload, stream.session)
+            ASCIIColors.info(f"Client {client_id} resumed message {message_id} with {len(updates)} updates")
+
+        @socketio.on('server_ping')
+        def server_ping(data=None):
+            # Acknowledged round trip, used to measure the event latency (see tests/load_tests)
+            return {"time": time.time()}
+
         
         @socketio.on('cancel_install')
         def cancel_install(data):
@@ -467,16 +518,20 @@ class LoLLMsAPPI(LollmsApplication):
         @socketio.on('cancel_generation')
         def cancel_generation():
             client_id = request.sid
-            self.cancel_gen = True
-            #kill thread
             ASCIIColors.error(f'Client {request.sid} requested cancelling generation')
-            terminate_thread(self.connections[client_id]['generation_thread'])
-            ASCIIColors.error(f'Client {request.sid} canceled generation')
-            self.cancel_gen = False
+            canceled = []
+            # Including the generations started before a reconnection
+            for session_client_id in self.get_session_clients(self.connections[client_id]["session"]) or [client_id]:
+                canceled += self.generation_scheduler.cancel(client_id=session_client_id)
+            if any(job.status=="canceled" for job in canceled):
+                self.notify("Queued generation canceled", True, client_id)
+            ASCIIColors.error(f'Client {request.sid} canceled {len(canceled)} generation(s)')
 
         @socketio.on('send_file')
         def send_file(data):
             client_id = request.sid
+            if not self.check_rate_limit(client_id, "send_file"):
+                return
             self.connections[client_id]["generated_text"]       = ""
             self.connections[client_id]["cancel_generation"]    = False
             
@@ -490,6 +545,8 @@ class LoLLMsAPPI(LollmsApplication):
                 File64BitsManager.b642file(data["fileData"],file_path)
                 if self.personality.processor:
                     self.personality.processor.add_file(file_path, partial(self.process_chunk, client_id=client_id))
+                if self.config["context_retrieval"] and self.connections[client_id]["current_discussion"] is not None:
+                    self.index_document(self.connections[client_id]["current_discussion"], file_path)
                     
                 self.socketio.emit('file_received',
                         {
@@ -509,11 +566,11 @@ class LoLLMsAPPI(LollmsApplication):
         @socketio.on('generate_msg')
         def generate_msg(data):
             client_id = request.sid
-            self.connections[client_id]["generated_text"]=""
-            self.connections[client_id]["cancel_generation"]=False
-            
-            if not self.model:
-                self.notify("Model not selected. Please select a model", False, client_id)
+            if not self.check_rate_limit(client_id, "generate_msg"):
+                return
+            # The generated text is reset when the job starts: a previous generation of the client may still be running
+            if not self.model and self.model_loaded.is_set():
+                self.notify(self.get_missing_model_error(), False, client_id)
                 return
  
             if self.is_ready:
@@ -534,14 +591,17 @@ class LoLLMsAPPI(LollmsApplication):
                     parent_message_id=self.message_id
                 )
 
-                ASCIIColors.green("Starting message generation by "+self.personality.name)
-                self.connections[client_id]['generation_thread'] = threading.Thread(target=self.start_message_generation, args=(message, message.id, client_id))
-                self.connections[client_id]['generation_thread'].start()
-                
-                self.socketio.sleep(0.01)
-                ASCIIColors.info("Started generation task")
-                #tpe = threading.Thread(target=self.start_message_generation, args=(message, message_id, client_id))
-                #tpe.start()
+                if data.get("personalities"):
+                    # Answered by several mounted personalities at once
+                    ASCIIColors.green("Starting message generation by "+", ".join(data["personalities"]))
+                    if self.schedule_personalities_generation(message, client_id, data["personalities"]):
+                        self.socketio.sleep(0.01)
+                        ASCIIColors.info("Queued generation tasks")
+                else:
+                    ASCIIColors.green("Starting message generation by "+self.personality.name)
+                    if self.schedule_generation(message, client_id, use_cache=data.get("use_cache", True)):
+                        self.socketio.sleep(0.01)
+                        ASCIIColors.info("Queued generation task")
             else:
                 self.notify("I am buzzy. Come back later.", False, client_id)
 
@@ -559,8 +619,7 @@ class LoLLMsAPPI(LollmsApplication):
                 message = self.connections[client_id]["current_discussion"].select_message(id_)
             if message is None:
                 return            
-            self.connections[client_id]['generation_thread'] = threading.Thread(target=self.start_message_generation, args=(message, message.id, client_id))
-            self.connections[client_id]['generation_thread'].start()
+            self.schedule_generation(message, client_id, use_cache=data.get("use_cache", True))
 
         # generation status
         self.generating=False
@@ -581,8 +640,7 @@ class LoLLMsAPPI(LollmsApplication):
             else:
                 message = self.connections[client_id]["current_discussion"].select_message(id_)
 
-            self.connections[client_id]['generation_thread'] = threading.Thread(target=self.start_message_generation, args=(message, message.id, client_id, True))
-            self.connections[client_id]['generation_thread'].start()
+            self.schedule_generation(message, client_id, is_continue=True, use_cache=data.get("use_cache", True))
 
         # generation status
         self.generating=False
@@ -590,6 +648,171 @@ class LoLLMsAPPI(LollmsApplication):
         ASCIIColors.green(f"{self.lollms_paths.personal_path}")
 
 
+    def init_model_state(self, config):
+        """
+        Sets up the model pool, the loading state and the speculative decoder, used while the binding and the model are loaded
+        """
+        self.model_pool = ModelPool(max_memory = config["model_pool_max_memory_mb"]*1024*1024, in_use_lock = threading.Lock())
+        # Answers of the read-heavy endpoints, built again when the configuration, the personalities or the binding change
+        self.response_cache = ResponseCache()
+        # Set once the binding and the model are loaded (or failed to load)
+        self.model_loaded = threading.Event()
+        self.loading_status = {"status":"loading", "step":"binding", "progress":0, "error":None}
+        # Built by load_speculative_decoder from the speculative_* settings when they or the model change
+        self.speculative_decoder = None
+        self.speculative_decoder_key = None
+        self.speculative_decoder_lock = threading.Lock()
+
+    def init_generation_state(self):
+        """
+        Sets up the scheduler, the caches and the connections used by the generations. Needs the configuration and the database
+        """
+        # Performance measures of the last generations
+        self.telemetry = GenerationTelemetry(
+                                        max_records = self.config["telemetry_max_records"],
+                                        db          = self.db if self.config["telemetry_in_db"] else None
+                                    )
+
+        # Every generation goes through this queue so that clients share the model fairly
+        self.generation_scheduler = GenerationScheduler(
+                                        max_queue_size              = self.config["generation_queue_size"],
+                                        max_concurrency             = self.config["max_concurrent_generations"],
+                                        bindings_max_concurrency    = self.config["bindings_max_concurrency"],
+                                        on_queue_update             = self.notify_queue_position
+                                    )
+        # Model states after the personality conditioning and discussion history, for bindings that can save them
+        self.prefix_cache = PrefixStateCache(max_memory = self.config["prefix_cache_max_memory_mb"]*1024*1024) if self.config["prefix_cache_max_memory_mb"]>0 else None
+        self.completion_cache = CompletionCache(
+                                        self.lollms_paths.personal_path/"cache"/"completions.db",
+                                        max_size = self.config["completion_cache_max_size_mb"]*1024*1024
+                                    ) if self.config["completion_cache_max_size_mb"]>0 else None
+        # Discussions whose summary is being generated
+        self.summaries_in_progress = set()
+        self.summaries_lock = threading.Lock()
+        # Serializes the writes of the generation jobs to the discussions
+        self.discussion_lock = threading.Lock()
+        # Relevance indexes of the recently used discussions
+        self.context_indexes = OrderedDict()
+        self.context_indexes_lock = threading.Lock()
+        # Sequence numbers and content of the messages being streamed, by message id
+        self.message_streams = {}
+        # Recently finished streams, kept for the clients resuming them
+        self.closed_streams = OrderedDict()
+        # Groups the prompts of concurrent generations for bindings that support batching
+        self.batched_generator = BatchedGenerator(
+                                        batch_window    = self.config["batch_generation_window_ms"]/1000,
+                                        max_batch_size  = self.config["max_batch_size"],
+                                        prefix_cache    = self.prefix_cache,
+                                        model_lock      = self.model_pool.in_use_lock
+                                    )
+        # Token buckets of the rate limited requests, by client and request
+        self.rate_limits = {}
+        self.connections = {0:self.new_connection()}
+
+    def new_connection(self, protocol="json", session=None):
+        """
+        Returns the information kept about a client connection
+        """
+        return {
+            "protocol": protocol,
+            "session": session,
+            "current_discussion":None,
+            "generated_text":"",
+            "cancel_generation": False,
+            "generation_job": None,
+            "nb_received_tokens": 0,
+            "processing":False,
+            "schedule_for_deletion":False
+        }
+
+    def set_loading_status(self, step, progress, error=None):
+        self.loading_status = {
+            "status":   "failed" if error is not None else ("ready" if step=="ready" else "loading"),
+            "step":     step,
+            "progress": progress,
+            "error":    error
+        }
+        self.socketio.emit('loading_progress', self.loading_status)
+
+    def load_binding_and_model(self):
+        """
+        Loads the binding and the model after the server has started.
+        Generation requests received meanwhile wait for model_loaded.
+        """
+        try:
+            if self.config.binding_name is not None:
+                self.set_loading_status("binding", 0)
+                self.binding = self.load_binding()
+                if self.binding is None:
+                    raise Exception(f"Couldn't load the binding {self.config.binding_name}")
+            if self.binding is not None and self.config.model_name is not None:
+                self.set_loading_status("model", 50)
+                # Unlike load_model, lets the loading error through to be reported
+                self.model = self.activate_model()
+            if self.model is None:
+                ASCIIColors.warning("No model loaded. Please select a binding and a model in the settings")
+            self.set_loading_status("ready", 100)
+        except Exception as ex:
+            trace_exception(ex)
+            self.set_loading_status("failed", 100, str(ex))
+        finally:
+            self.response_cache.bump()
+            self.model_loaded.set()
+
+    def build_model(self):
+        """
+        Builds the model of the current binding, inside a model host process when model_host_process is set
+        """
+        if self.config["model_host_process"]:
+            if get_patched_mode() == "threading":
+                return ModelHostProxy(args=(self.config, self.lollms_paths))
+            # Its pipe reader would block the event loop
+            ASCIIColors.warning(f"The model host process is not available in {get_patched_mode()} server mode. Loading the model in the server process")
+        return self.binding.build_model()
+
+    def activate_model(self):
+        """
+        Makes the configured model the current one, taking it from the model pool when it is still loaded,
+        and points the mounted personalities to it.
+        """
+        def build():
+            if self.binding is None or self.model_pool.owns(self.binding):
+                # The current binding instance holds another resident model
+                self.binding = BindingBuilder().build_binding(self.config, self.lollms_paths)
+            self.model = None
+            self.model_pool.evict(reserve=model_file_size(self.binding))
+            if get_patched_mode() != "threading":
+                # Loading blocks in native code for a long time, out of the event loop
+                return self.binding, run_native(self.build_model)
+            return self.binding, self.build_model()
+
+        self.binding, model = self.model_pool.load(self.config["binding_name"], self.config["model_name"], build)
+        self.model = wrap_model(model)
+        for personality in self.mounted_personalities:
+            if personality is not None:
+                personality.model = self.model
+        self.response_cache.bump()
+        self.load_speculative_decoder()
+        return self.model
+
+    def build_binding(self, installation_option:InstallOption=InstallOption.INSTALL_IF_NECESSARY):
+        """
+        Builds the binding of the configuration and makes it the current one
+        """
+        self.binding = BindingBuilder().build_binding(self.config, self.lollms_paths, installation_option)
+        self.response_cache.bump()
+        return self.binding
+
+    def load_model(self):
+        try:
+            model = self.activate_model()
+        except Exception as ex:
+            ASCIIColors.error(f"Couldn't load model. Please verify your configuration file at {self.lollms_paths.personal_configuration_path} or use the next menu to select a valid model")
+            ASCIIColors.error(f"Binding returned this exception : {ex}")
+            trace_exception(ex)
+            model = None
+        return model
+
     def rebuild_personalities(self, reload_all=False):
         if reload_all:
             self.mounted_personalities=[]
@@ -660,6 +883,7 @@ class LoLLMsAPPI(LollmsApplication):
 
         if self.config["active_personality_id"]>=len(self.config["personalities"]):
             self.config["active_personality_id"]=0
+        self.response_cache.bump()
             
         return mounted_personalities
     # ================================== LOLLMSApp
@@ -744,7 +968,7 @@ class LoLLMsAPPI(LollmsApplication):
 
     def prepare_reception(self, client_id):
         self.connections[client_id]["generated_text"] = ""
-        self.nb_received_tokens = 0
+        self.connections[client_id]["nb_received_tokens"] = 0
     
     def create_new_discussion(self, title):
         self.current_discussion = self.db.create_discussion(title)
@@ -757,25 +981,52 @@ class LoLLMsAPPI(LollmsApplication):
 
 
     def prepare_query(self, client_id, message_id=-1, is_continue=False):
-        messages = self.connections[client_id]["current_discussion"].get_messages()
+        """
+        Returns the prompt, the message content, the prompt tokens and the prompt prefix of the answer to message_id.
+        They are kept by the caller: several generations can be prepared at the same time.
+        """
+        return self.build_discussion_prompt(self.connections[client_id]["current_discussion"], message_id, is_continue)
+
+    def build_discussion_prompt(self, discussion:Discussion, message_id=-1, is_continue=False, personality:AIPersonality=None):
+        """
+        Builds the prompt answering the message message_id of discussion with a personality (the active one by default).
+
+        Returns:
+            tuple: (prompt, message content, prompt tokens, prefix shared with the previous prompts of the discussion)
+        """
+        if personality is None:
+            personality = self.personality
+        messages = discussion.get_messages()
         full_message_list = []
+        # The oldest messages may be replaced by their summary
+        summary = None
+        if self.config["discussion_summary"] and len(messages)>0:
+            summary = discussion.get_summary(message_id if message_id!=-1 else messages[-1].id)
+            if summary is not None:
+                full_message_list.append(self.get_summarizer().format_summary(summary[1]))
+        history = []
         for i, message in enumerate(messages):
             if message.id< message_id or (message_id==-1 and i<len(messages)-1): 
+                if summary is not None and message.id<=summary[0]:
+                    continue
                 if message.message_type<=MSG_TYPE.MSG_TYPE_FULL_INVISIBLE_TO_USER.value and message.message_type!=MSG_TYPE.MSG_TYPE_FULL_INVISIBLE_TO_AI.value:
+                    history.append(message)
                     full_message_list.append("\n"+self.config.discussion_prompt_separator+message.sender+": "+message.content.strip())
             else:
                 break
 
-        link_text = "\n" #self.personality.link_text
+        link_text = "\n" #personality.link_text
+        if self.config["context_retrieval"]:
+            full_message_list = self.select_relevant_context(discussion, history, full_message_list, message, personality)
         if not is_continue:
-            full_message_list.append("\n"+self.config.discussion_prompt_separator +message.sender.replace(":","")+": "+message.content.strip()+link_text+self.personality.ai_message_prefix)
+            full_message_list.append("\n"+self.config.discussion_prompt_separator +message.sender.replace(":","")+": "+message.content.strip()+link_text+personality.ai_message_prefix)
         else:
             full_message_list.append("\n"+self.config.discussion_prompt_separator +message.sender.replace(":","")+": "+message.content.strip())
 
 
         composed_messages = link_text.join(full_message_list)
         t = self.model.tokenize(composed_messages)
-        cond_tk = self.model.tokenize(self.personality.personality_conditioning)
+        cond_tk = self.model.tokenize(personality.personality_conditioning)
         n_t = len(t)
         n_cond_tk = len(cond_tk)
         max_prompt_stx_size = 3*int(self.config.ctx_size/4)
@@ -783,14 +1034,214 @@ class LoLLMsAPPI(LollmsApplication):
             nb_tk = max_prompt_stx_size-n_cond_tk
             composed_messages = self.model.detokenize(t[-nb_tk:])
             ASCIIColors.warning(f"Cropping discussion to fit context [using {nb_tk} tokens/{self.config.ctx_size}]")
-        discussion_messages = self.personality.personality_conditioning+ composed_messages
+            # The history was cut, only the conditioning is shared with the previous prompts
+            prompt_prefix = personality.personality_conditioning
+        else:
+            prompt_prefix = personality.personality_conditioning + link_text.join(full_message_list[:-1])
+        discussion_messages = personality.personality_conditioning+ composed_messages
         tokens = self.model.tokenize(discussion_messages)
         
         if self.config["debug"]:
             ASCIIColors.yellow(discussion_messages)
             ASCIIColors.yellow(f"prompt size:{len(tokens)} tokens")
 
-        return discussion_messages, message.content, tokens
+        return discussion_messages, message.content, tokens, prompt_prefix
+
+    def get_context_index(self, discussion_id):
+        with self.context_indexes_lock:
+            index = self.context_indexes.get(discussion_id)
+            if index is None:
+                index = ContextIndex(self.lollms_paths.personal_path/"cache"/"context_index"/f"{discussion_id}.npz")
+                self.context_indexes[discussion_id] = index
+                while len(self.context_indexes)>32:
+                    self.context_indexes.popitem(last=False)
+            else:
+                self.context_indexes.move_to_end(discussion_id)
+            return index
+
+    def delete_context_index(self, discussion_id):
+        with self.context_indexes_lock:
+            self.context_indexes.pop(discussion_id, None)
+            path = self.lollms_paths.personal_path/"cache"/"context_index"/f"{discussion_id}.npz"
+            if path.exists():
+                path.unlink()
+
+    def index_document(self, discussion:Discussion, file_path:Path):
+        """
+        Splits a text file sent in discussion into excerpts of context_retrieval_chunk_size words
+        that can be selected in the prompts by relevance
+
+        Returns:
+            int: The number of indexed excerpts
+        """
+        if file_path.suffix.lower() not in TEXT_EXTENSIONS or self.model is None:
+            return 0
+        words = file_path.read_text(encoding="utf-8", errors="ignore").split()
+        chunk_size = self.config["context_retrieval_chunk_size"]
+        index = self.get_context_index(discussion.discussion_id)
+        for key in index.keys(f"document:{file_path.name}:"):
+            index.remove(key)
+        for i in range(0, len(words), chunk_size):
+            excerpt = "\n"+self.config.discussion_prompt_separator+f"excerpt of {file_path.name}: "+" ".join(words[i:i+chunk_size])
+            index.add(f"document:{file_path.name}:{i//chunk_size}", excerpt, len(self.model.tokenize(excerpt)), store_text=True)
+        index.save()
+        return (len(words)+chunk_size-1)//chunk_size
+
+    def select_relevant_context(self, discussion:Discussion, history:list, message_list:list, message, personality:AIPersonality):
+        """
+        Fits the history of a prompt in the context by relevance: the most recent messages are kept,
+        then the older messages and the excerpts of the documents sent in the discussion that are the most relevant to message.
+        Excerpts come after the history so that the history stays a shared prefix.
+
+        Args:
+            history (list): The messages of the history, in chronological order
+            message_list (list): The formatted history, possibly headed by the summary
+
+        Returns:
+            list: The formatted entries to put in the prompt before message
+        """
+        index = self.get_context_index(discussion.discussion_id)
+        head = message_list[:len(message_list)-len(history)]
+        texts = message_list[len(head):]
+        # Only new or edited messages are vectorized
+        changed = False
+        for history_message, text in zip(history, texts):
+            version = zlib.crc32(text.encode("utf-8"))
+            entry = index.get(f"message:{history_message.id}")
+            if entry is None or entry["version"]!=version:
+                changed |= index.add(f"message:{history_message.id}", text, len(self.model.tokenize(text)), version)
+        if changed:
+            index.save()
+
+        document_keys = index.keys("document:")
+        history_sizes = [index.get(f"message:{m.id}")["size"] for m in history]
+        budget = 3*int(self.config.ctx_size/4) - len(self.model.tokenize(personality.personality_conditioning+"".join(head))) - len(self.model.tokenize(message.content)) - 16
+        if sum(history_sizes)<=budget and len(document_keys)==0:
+            return message_list
+        scores = index.search(message.content, [f"message:{m.id}" for m in history]+document_keys)
+        kept_history, kept_documents = select_context(
+                                            history_sizes,
+                                            [scores.get(f"message:{m.id}", 0) for m in history],
+                                            [index.get(k)["size"] for k in document_keys],
+                                            [scores.get(k, 0) for k in document_keys],
+                                            budget,
+                                            sum(history_sizes) if sum(history_sizes)<=budget else int(budget*self.config["context_retrieval_recent"]),
+                                            self.config["context_retrieval_top_k"]
+                                        )
+        if len(kept_history)<len(history):
+            ASCIIColors.info(f"Context selection: kept {len(kept_history)}/{len(history)} messages and {len(kept_documents)} document excerpts")
+        return head + [texts[i] for i in kept_history] + [index.get(document_keys[i])["text"] for i in kept_documents]
+
+    def get_summarizer(self):
+        return DiscussionSummarizer(
+                    self.model.tokenize,
+                    threshold   = int(self.config.ctx_size*self.config["discussion_summary_threshold"]),
+                    keep_tokens = int(self.config.ctx_size*self.config["discussion_summary_keep"]),
+                    separator   = self.config.discussion_prompt_separator
+                )
+
+    def schedule_summary(self, discussion:Discussion):
+        """
+        Queues the compaction of discussion with background priority so that it runs when no answer is waiting
+        """
+        if not self.config["discussion_summary"] or self.model is None:
+            return
+        with self.summaries_lock:
+            if discussion.discussion_id in self.summaries_in_progress:
+                return
+            self.summaries_in_progress.add(discussion.discussion_id)
+        cancel_token = CancellationToken()
+        job = self.generation_scheduler.submit(
+                                        f"summary:{discussion.discussion_id}",
+                                        self.summarize_discussion,
+                                        # A separate object so that the current message of the client is not changed
+                                        args            = (Discussion(discussion.discussion_id, self.db),),
+                                        kwargs          = {"cancel_token":cancel_token},
+                                        priority        = PRIORITY_BACKGROUND,
+                                        binding_name    = self.config["binding_name"],
+                                        cancel_token    = cancel_token
+                                    )
+        if job is None:
+            with self.summaries_lock:
+                self.summaries_in_progress.discard(discussion.discussion_id)
+
+    def summarize_discussion(self, discussion:Discussion, cancel_token:CancellationToken=None):
+        """
+        Folds the oldest messages of discussion into a new summary when they take too much of the context
+        """
+        try:
+            if self.model is None:
+                return
+            summarizer = self.get_summarizer()
+            previous_summary = discussion.get_summary()
+            messages = summarizer.select(discussion.get_messages(), previous_summary[0] if previous_summary is not None else None)
+            if len(messages)==0:
+                return
+            prompt = summarizer.build_prompt(messages, previous_summary[1] if previous_summary is not None else None)
+            summary = ""
+            def receive(chunk, message_type:MSG_TYPE=MSG_TYPE.MSG_TYPE_CHUNK, *args, **kwargs):
+                nonlocal summary
+                if cancel_token is not None and cancel_token.canceled:
+                    return False
+                if message_type == MSG_TYPE.MSG_TYPE_CHUNK:
+                    summary += chunk
+                    if self.config.discussion_prompt_separator in summary:
+                        summary = summary[:summary.index(self.config.discussion_prompt_separator)]
+                        return False
+                elif message_type == MSG_TYPE.MSG_TYPE_FULL:
+                    summary = chunk
+                return True
+            ASCIIColors.info(f"Summarizing {len(messages)} messages of discussion {discussion.discussion_id}")
+            self.batched_generator.generate(
+                self.model,
+                prompt,
+                callback=receive,
+                cancel_token=cancel_token,
+                **self.get_generation_parameters(self.config["discussion_summary_max_tokens"])
+            )
+            if (cancel_token is not None and cancel_token.canceled) or summary.strip()=="":
+                return
+            discussion.add_summary(messages[-1].id, summary.strip())
+            ASCIIColors.success(f"Discussion {discussion.discussion_id} compacted up to message {messages[-1].id}")
+        except Exception as ex:
+            trace_exception(ex)
+        finally:
+            with self.summaries_lock:
+                self.summaries_in_progress.discard(discussion.discussion_id)
+
+    def find_mounted_personality(self, name):
+        """
+        Returns the mounted personality named language/category/name or None
+        """
+        for personality in self.mounted_personalities:
+            if personality is not None and f"{personality.language}/{personality.category}/{personality.personality_folder_name}"==name:
+                return personality
+        return None
+
+    def build_prompt(self, prompt, personality:AIPersonality=None):
+        """
+        Assembles a standalone prompt the way prepare_query assembles a discussion: personality conditioning,
+        user message and AI message prefix, cropped to fit the context.
+
+        Returns:
+            tuple: (full prompt, personality conditioning, tokens of the full prompt)
+        """
+        if personality is None:
+            personality = self.personality
+        link_text = "\n"
+        ump = self.config.discussion_prompt_separator +self.config.user_name+": " if self.config.use_user_name_in_discussions else personality.user_message_prefix
+        sender = ump.replace(self.config.discussion_prompt_separator,"").replace(":","")
+        composed_message = "\n"+self.config.discussion_prompt_separator+sender+": "+prompt.strip()+link_text+personality.ai_message_prefix
+
+        t = self.model.tokenize(composed_message)
+        n_cond_tk = len(self.model.tokenize(personality.personality_conditioning))
+        max_prompt_stx_size = 3*int(self.config.ctx_size/4)
+        if n_cond_tk+len(t)>max_prompt_stx_size:
+            nb_tk = max_prompt_stx_size-n_cond_tk
+            composed_message = self.model.detokenize(t[-nb_tk:])
+            ASCIIColors.warning(f"Cropping prompt to fit context [using {nb_tk} tokens/{self.config.ctx_size}]")
+        full_prompt = personality.personality_conditioning+composed_message
+        return full_prompt, personality.personality_conditioning, self.model.tokenize(full_prompt)
 
     def get_discussion_to(self, client_id,  message_id=-1):
         messages = self.connections[client_id]["current_discussion"].get_messages()
@@ -832,14 +1283,268 @@ class LoLLMsAPPI(LollmsApplication):
 
         return string
     
+    def emit_queued(self, event, data, room, delta_key=None):
+        """
+        Sends an event through the outbound queue of room, or directly when emit_queue_size is 0
+        """
+        if self.config["emit_queue_size"]>0:
+            self.emit_queues.put(event, data, room, delta_key)
+        else:
+            self.socketio.emit(event, data, room=room)
+
+    def check_rate_limit(self, client_id, request_name):
+        """
+        Returns False when the client sent more than <request_name>_rate_limit requests per minute
+        (after a burst of rate_limit_burst requests), True otherwise
+        """
+        rate = self.config[f"{request_name}_rate_limit"]
+        if rate<=0:
+            return True
+        key = (client_id, request_name)
+        if key not in self.rate_limits:
+            self.rate_limits[key] = TokenBucket(rate/60, max(1, self.config["rate_limit_burst"]))
+        if self.rate_limits[key].consume():
+            return True
+        ASCIIColors.warning(f"Client {client_id} exceeded the {request_name} rate limit")
+        self.notify(f"Too many requests, please wait before sending another one", False, client_id)
+        return False
+
     def notify(self, content, status, client_id):
-        self.socketio.emit('notification', {
+        self.emit_queued('notification', {
                             'content': content,# self.connections[client_id]["generated_text"], 
                             'status': status
-                        }, room=client_id
-                        )        
+                        }, client_id
+                        )
+
+    def notify_queue_position(self, job, queue_size):
+        self.emit_queued('queue_position', {
+                            'job_id': job.id,
+                            'position': job.position,
+                            'queue_size': queue_size
+                        }, job.client_id
+                        )
+
+    def update_binding_concurrency(self):
+        """
+        Returns the current binding name after letting enough of its generations run together
+        to fill a batch when it supports batching
+        """
+        binding_name = self.config["binding_name"]
+        if supports_batching(self.model) and binding_name not in self.config["bindings_max_concurrency"]:
+            self.generation_scheduler.set_max_concurrency(self.config["max_batch_size"], binding_name)
+        return binding_name
+
+    def schedule_generation(self, message, client_id, is_continue=False, priority=PRIORITY_INTERACTIVE, use_cache=True):
+        """
+        Queues the generation of an answer to message in the generation scheduler.
+        When use_cache is False, the completion cache is bypassed.
 
-    def new_message(self, 
+        Returns:
+            bool: True if the request was queued, False if the queue is full
+        """
+        binding_name = self.update_binding_concurrency()
+        cancel_token = CancellationToken()
+        job = self.generation_scheduler.submit(
+                                        client_id,
+                                        self.start_message_generation,
+                                        args            = (message, message.id, client_id, is_continue),
+                                        kwargs          = {"cancel_token":cancel_token, "use_cache":use_cache, "queued_at":time.perf_counter()},
+                                        priority        = priority,
+                                        binding_name    = binding_name,
+                                        cancel_token    = cancel_token,
+                                        # Uses the state of the connection and the current message of its discussion
+                                        exclusive       = True
+                                    )
+        if job is None:
+            self.notify("Too many generation requests are waiting. Please try again later.", False, client_id)
+            return False
+        self.connections[client_id]['generation_job'] = job
+        return True
+
+    def schedule_personalities_generation(self, message, client_id, personality_names:list, priority=PRIORITY_INTERACTIVE):
+        """
+        Queues the answers of the named mounted personalities to message as one generation job.
+        The answers are generated together (in one batch when the binding supports it) and each one
+        is streamed as its own message.
+
+        Returns:
+            bool: True if the answers were queued
+        """
+        personalities = [self.find_mounted_personality(name) for name in personality_names]
+        missing = [name for name, personality in zip(personality_names, personalities) if personality is None]
+        if len(missing)>0:
+            self.notify(f"Personalities not mounted: {', '.join(missing)}", False, client_id)
+            return False
+        binding_name = self.update_binding_concurrency()
+        discussion = self.connections[client_id]["current_discussion"]
+        cancel_token = CancellationToken()
+        job = self.generation_scheduler.submit(
+                                        client_id,
+                                        self.answer_with_personalities,
+                                        args            = (message, discussion, personalities, client_id),
+                                        kwargs          = {"cancel_token":cancel_token, "queued_at":time.perf_counter()},
+                                        priority        = priority,
+                                        binding_name    = binding_name,
+                                        cancel_token    = cancel_token,
+                                        # Uses the state of the connection and the current message of its discussion
+                                        exclusive       = True
+                                    )
+        if job is None:
+            self.notify("Too many generation requests are waiting. Please try again later.", False, client_id)
+            return False
+        self.connections[client_id]['generation_job'] = job
+        return True
+
+    def answer_with_personalities(self, message, discussion:Discussion, personalities:list, client_id, cancel_token:CancellationToken=None, queued_at=None):
+        """
+        Generates the answers of personalities to message as new messages of discussion.
+
+        Every answer message is created and every prompt is built before the generation starts, then the
+        prompts are sent to the model together with the sampling parameters of their personality.
+        Unlike start_message_generation, the state of each answer is kept here and not in the connection,
+        so that the answers are streamed at the same time.
+        """
+        if not self.wait_for_model(cancel_token):
+            return
+        if self.model is None:
+            self.notify(self.get_missing_model_error(), False, client_id)
+            return
+        answers = [self.prepare_personality_answer(message, discussion, personality, client_id, cancel_token, queued_at) for personality in personalities]
+        for answer in answers:
+            answer["trace"].generation_started()
+        try:
+            self.batched_generator.generate_many(self.model, [answer["request"] for answer in answers if answer["request"] is not None])
+        except Exception as ex:
+            trace_exception(ex)
+            self.notify(f"The personalities failed to answer: {ex}", False, client_id)
+        for answer in answers:
+            if answer["request"] is None:
+                try:
+                    # The workflow calls the model itself, it must not run alongside the batched generations
+                    with self.batched_generator.model_lock:
+                        answer["personality"].processor.run_workflow(answer["content"], answer["prompt"], answer["callback"])
+                except Exception as ex:
+                    trace_exception(ex)
+                    self.notify(f"{answer['personality'].name} failed to answer: {ex}", False, client_id)
+        for answer in answers:
+            self.finish_personality_answer(answer, client_id, cancel_token)
+        self.schedule_summary(discussion)
+
+    def prepare_personality_answer(self, message, discussion:Discussion, personality:AIPersonality, client_id, cancel_token:CancellationToken=None, queued_at=None):
+        """
+        Creates and announces the answer message of personality to message and builds its prompt.
+
+        Returns:
+            dict: The state of the answer. Its request is the BatchRequest generating it, None for personalities with a workflow.
+        """
+        personality_name = f"{personality.language}/{personality.category}/{personality.personality_folder_name}"
+        with self.discussion_lock:
+            message_answer = discussion.add_message(
+                message_type        = MSG_TYPE.MSG_TYPE_FULL.value,
+                sender_type         = SENDER_TYPES.SENDER_TYPES_AI.value,
+                sender              = personality.name,
+                content             = "✍ please stand by ...",
+                parent_message_id   = message.id,
+                binding             = self.config["binding_name"],
+                model               = self.config["model_name"],
+                personality         = personality_name
+            )
+        stream = self.start_message_stream(client_id, message_answer.id, message_answer.content, personality.name, discussion.discussion_id)
+        self.emit_queued('new_message',
+                {
+                    "sender":                   personality.name,
+                    "message_type":             MSG_TYPE.MSG_TYPE_FULL.value,
+                    "sender_type":              SENDER_TYPES.SENDER_TYPES_AI.value,
+                    "content":                  message_answer.content,
+                    "metadata":                 None,
+                    "id":                       message_answer.id,
+                    "parent_message_id":        message_answer.parent_message_id,
+
+                    'binding':                  self.config["binding_name"],
+                    'model' :                   self.config["model_name"], 
+                    'personality':              personality_name,
+
+                    'created_at':               message_answer.created_at,
+                    'finished_generating_at':   message_answer.finished_generating_at,
+                }, stream.session
+        )
+
+        trace = GenerationTrace(self.config["binding_name"], self.config["model_name"], personality_name, queued_at)
+        prompt, content, tokens, prompt_prefix = self.build_discussion_prompt(discussion, message.id, personality=personality)
+        trace.prompt_ready(len(tokens))
+        answer = {
+            "personality":      personality,
+            "personality_name": personality_name,
+            "message":          message_answer,
+            "trace":            trace,
+            "prompt":           prompt,
+            "content":          content,
+            "generated_text":   ""
+        }
+
+        def send_update(chunk, message_type:MSG_TYPE):
+            self.emit_message_update(client_id, personality.name, discussion.discussion_id, message_answer.id, chunk, message_type)
+            # Only yields: the chunks of every sequence of the batch go through here
+            self.socketio.sleep(0)
+
+        def receive(chunk, message_type:MSG_TYPE=MSG_TYPE.MSG_TYPE_CHUNK, *args, **kwargs):
+            if cancel_token is not None and cancel_token.canceled:
+                return False
+            if message_type == MSG_TYPE.MSG_TYPE_CHUNK:
+                answer["generated_text"] += chunk
+                antiprompt = personality.detect_antiprompt(answer["generated_text"])
+                if antiprompt:
+                    ASCIIColors.warning(f"\nDetected hallucination with antiprompt: {antiprompt}")
+                    answer["generated_text"] = self.remove_text_from_string(answer["generated_text"], antiprompt)
+                    send_update(answer["generated_text"], MSG_TYPE.MSG_TYPE_FULL)
+                    return False
+                send_update(chunk, MSG_TYPE.MSG_TYPE_CHUNK)
+            elif message_type == MSG_TYPE.MSG_TYPE_FULL:
+                answer["generated_text"] = chunk
+                send_update(chunk, MSG_TYPE.MSG_TYPE_FULL)
+            elif message_type == MSG_TYPE.MSG_TYPE_EXCEPTION:
+                self.notify(chunk, False, client_id)
+            return True
+
+        answer["callback"] = trace.wrap(receive)
+        if personality.processor is not None:
+            answer["request"] = None
+        else:
+            gpt_params = self.get_generation_parameters(self.config.ctx_size-len(tokens)-1, personality)
+            answer["request"] = BatchRequest(
+                                        prompt,
+                                        gpt_params.pop("n_predict"),
+                                        answer["callback"],
+                                        cancel_token        = cancel_token,
+                                        gpt_params          = gpt_params,
+                                        prefix              = prompt_prefix,
+                                        prefix_namespace    = (self.config["binding_name"], self.config["model_name"], personality_name)
+                                    )
+        return answer
+
+    def finish_personality_answer(self, answer, client_id, cancel_token:CancellationToken=None):
+        """
+        Saves the generated text of an answer prepared by prepare_personality_answer and closes its stream
+        """
+        message_answer = answer["message"]
+        with self.discussion_lock:
+            message_answer.update(answer["generated_text"])
+        self.telemetry.add(answer["trace"].finish("canceled" if cancel_token is not None and cancel_token.canceled else "finished", message_answer.id))
+        self.emit_message_close(client_id, {
+                                        "sender":                   answer["personality"].name,
+                                        "id":                       message_answer.id,
+                                        "content":                  answer["generated_text"],
+
+                                        'binding':                  self.config["binding_name"],
+                                        'model' :                   self.config["model_name"], 
+                                        'personality':              answer["personality_name"],
+
+                                        'created_at':               message_answer.created_at,
+                                        'finished_generating_at':   message_answer.finished_generating_at,
+                                    }
+                            )
+
+    def new_message(self,
                             client_id, 
                             sender, 
                             content, 
@@ -848,20 +1553,22 @@ class LoLLMsAPPI(LollmsApplication):
                             sender_type:SENDER_TYPES=SENDER_TYPES.SENDER_TYPES_AI
                         ):
         
-        msg = self.connections[client_id]["current_discussion"].add_message(
-            message_type        = message_type.value,
-            sender_type         = sender_type.value,
-            sender              = sender,
-            content             = content,
-            metadata            = json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata,
-            rank                = 0,
-            parent_message_id   = self.connections[client_id]["current_discussion"].current_message.id,
-            binding             = self.config["binding_name"],
-            model               = self.config["model_name"], 
-            personality         = self.config["personalities"][self.config["active_personality_id"]],
-        )  # first the content is empty, but we'll fill it at the end  
-
-        self.socketio.emit('new_message',
+        with self.discussion_lock:
+            msg = self.connections[client_id]["current_discussion"].add_message(
+                message_type        = message_type.value,
+                sender_type         = sender_type.value,
+                sender              = sender,
+                content             = content,
+                metadata            = json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata,
+                rank                = 0,
+                parent_message_id   = self.connections[client_id]["current_discussion"].current_message.id,
+                binding             = self.config["binding_name"],
+                model               = self.config["model_name"], 
+                personality         = self.config["personalities"][self.config["active_personality_id"]],
+            )  # first the content is empty, but we'll fill it at the end  
+
+        stream = self.start_message_stream(client_id, msg.id, content, self.personality.name, self.connections[client_id]["current_discussion"].discussion_id)
+        self.emit_queued('new_message',
                 {
                     "sender":                   self.personality.name,
                     "message_type":             message_type.value,
@@ -877,28 +1584,113 @@ class LoLLMsAPPI(LollmsApplication):
 
                     'created_at':               self.connections[client_id]["current_discussion"].current_message.created_at,
                     'finished_generating_at':   self.connections[client_id]["current_discussion"].current_message.finished_generating_at,                        
-                }, room=client_id
+                }, stream.session
         )
 
+    def start_message_stream(self, client_id, message_id, content, sender, discussion_id):
+        stream = MessageStream(
+                        message_id,
+                        content,
+                        session         = self.connections[client_id]["session"] or client_id,
+                        protocol        = self.connections[client_id]["protocol"],
+                        sender          = sender,
+                        discussion_id   = discussion_id,
+                        replay_size     = self.config["stream_replay_buffer_size"]
+                    )
+        self.message_streams[message_id] = stream
+        return stream
+
+    def emit_message_update(self, client_id, sender, discussion_id, message_id, chunk, message_type:MSG_TYPE, metadata=None):
+        """
+        Sends a chunk of a message being generated to the session of the client, in the streaming protocol negotiated at connection
+        """
+        stream = self.message_streams.get(message_id)
+        if stream is None:
+            stream = self.start_message_stream(client_id, message_id, "", sender, discussion_id)
+        with stream.lock:
+            seq = stream.apply(chunk, message_type.value, metadata)
+            self.emit_queued(
+                            'update_message',
+                            update_payload(stream.protocol, sender, discussion_id, message_id, seq, message_type.value, chunk, metadata),
+                            stream.session,
+                            # Chunks can be merged when the client is late
+                            delta_key = message_id if message_type == MSG_TYPE.MSG_TYPE_CHUNK else None
+                        )
+
+    def emit_message_close(self, client_id, payload:dict):
+        """
+        Ends the stream of a message. close_message carries the number of updates sent and the checksum of the content,
+        and the content itself only for json clients: compact clients assembled it from the updates.
+        """
+        stream = self.message_streams.pop(payload["id"], None)
+        if stream is None:
+            stream = self.start_message_stream(client_id, payload["id"], payload["content"], payload["sender"], None)
+            self.message_streams.pop(payload["id"])
+        with stream.lock:
+            payload["seq"] = stream.seq
+            payload["checksum"] = text_checksum(payload["content"])
+            payload["length"] = len(payload["content"])
+            stream.close_payload = dict(payload)
+            if stream.protocol == "compact":
+                del payload["content"]
+            self.emit_queued('close_message', payload, stream.session)
+        if self.config["stream_replay_buffer_size"]>0:
+            self.closed_streams[stream.message_id] = stream
+            while len(self.closed_streams)>64:
+                self.closed_streams.popitem(last=False)
+
+    def send_message_resync(self, client_id, message_id):
+        """
+        Sends the current state of a message being generated, or its stored content once finished
+        """
+        stream = self.message_streams.get(message_id)
+        if stream is not None:
+            with stream.lock:
+                state = stream.get_state()
+            state["finished"] = False
+        else:
+            content = Message.from_db(self.db, message_id).content
+            state = {"id": message_id, "seq": None, "content": content, "checksum": text_checksum(content), "length": len(content), "finished": True}
+        self.emit_queued('message_resync', state, client_id)
+
+    def get_session_clients(self, session):
+        return [client_id for client_id, connection in list(self.connections.items()) if connection.get("session") == session]
+
+    def release_disconnected_client(self, client_id):
+        """
+        Cancels the generations of a disconnected client unless it came back with the same session within stream_resume_timeout
+        """
+        self.socketio.sleep(self.config["stream_resume_timeout"])
+        connection = self.connections.get(client_id)
+        if connection is None:
+            return
+        resumed = any(not self.connections[other]["schedule_for_deletion"] for other in self.get_session_clients(connection["session"]) if other!=client_id and other in self.connections)
+        if not resumed:
+            ASCIIColors.warning(f"Client {client_id} didn't come back, canceling its generations")
+            self.generation_scheduler.cancel(client_id=client_id)
+        if len(self.generation_scheduler.running_jobs(client_id))==0 and len(self.generation_scheduler.queued_jobs(client_id))==0:
+            self.connections.pop(client_id, None)
+
     def update_message(self, client_id, chunk, metadata, msg_type:MSG_TYPE=None):
-        self.connections[client_id]["current_discussion"].current_message.finished_generating_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.socketio.emit('update_message', {
-                                        "sender": self.personality.name,
-                                        'id':self.connections[client_id]["current_discussion"].current_message.id, 
-                                        'content': chunk,# self.connections[client_id]["generated_text"], 
-                                        'discussion_id':self.connections[client_id]["current_discussion"].discussion_id,
-                                        'message_type': msg_type.value if msg_type is not None else MSG_TYPE.MSG_TYPE_CHUNK.value if self.nb_received_tokens>1 else MSG_TYPE.MSG_TYPE_FULL.value,
-                                        'finished_generating_at': self.connections[client_id]["current_discussion"].current_message.finished_generating_at,
-                                        'metadata':json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata
-                                    }, room=client_id
-                            )
+        current_message = self.connections[client_id]["current_discussion"].current_message
+        current_message.finished_generating_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.emit_message_update(
+                client_id,
+                self.personality.name,
+                self.connections[client_id]["current_discussion"].discussion_id,
+                current_message.id,
+                chunk,
+                msg_type if msg_type is not None else MSG_TYPE.MSG_TYPE_CHUNK if self.connections[client_id]["nb_received_tokens"]>1 else MSG_TYPE.MSG_TYPE_FULL,
+                metadata
+            )
         self.socketio.sleep(0.01)
-        self.connections[client_id]["current_discussion"].update_message(self.connections[client_id]["generated_text"])
+        with self.discussion_lock:
+            self.connections[client_id]["current_discussion"].update_message(self.connections[client_id]["generated_text"])
 
     def close_message(self, client_id):
         # Send final message
         self.connections[client_id]["current_discussion"].current_message.finished_generating_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.socketio.emit('close_message', {
+        self.emit_message_close(client_id, {
                                         "sender": self.personality.name,
                                         "id": self.connections[client_id]["current_discussion"].current_message.id,
                                         "content":self.connections[client_id]["generated_text"],
@@ -910,13 +1702,15 @@ class LoLLMsAPPI(LollmsApplication):
                                         'created_at': self.connections[client_id]["current_discussion"].current_message.created_at,
                                         'finished_generating_at': self.connections[client_id]["current_discussion"].current_message.finished_generating_at,
 
-                                    }, room=client_id
+                                    }
                             )
-    def process_chunk(self, chunk, message_type:MSG_TYPE, metadata:dict={}, client_id:int=0):
+    def process_chunk(self, chunk, message_type:MSG_TYPE, metadata:dict={}, client_id:int=0, cancel_token:CancellationToken=None):
         """
         0 : a regular message
         1 : a notification message
         2 : A hidden message
+
+        Returns False to stop the generation (antiprompt detected or cancel_token canceled)
         """
 
         if message_type == MSG_TYPE.MSG_TYPE_STEP:
@@ -939,7 +1733,7 @@ class LoLLMsAPPI(LollmsApplication):
             ASCIIColors.info("--> Info:"+chunk)
 
         if message_type == MSG_TYPE.MSG_TYPE_NEW_MESSAGE:
-            self.nb_received_tokens = 0
+            self.connections[client_id]["nb_received_tokens"] = 0
             self.new_message(client_id, self.personality.name, chunk, metadata = metadata["metadata"], message_type= MSG_TYPE(metadata["type"]))
 
         elif message_type == MSG_TYPE.MSG_TYPE_FINISHED_MESSAGE:
@@ -947,8 +1741,8 @@ class LoLLMsAPPI(LollmsApplication):
 
         elif message_type == MSG_TYPE.MSG_TYPE_CHUNK:
             self.connections[client_id]["generated_text"] += chunk
-            self.nb_received_tokens += 1
-            ASCIIColors.green(f"Received {self.nb_received_tokens} tokens",end="\r")
+            self.connections[client_id]["nb_received_tokens"] += 1
+            ASCIIColors.green(f"Received {self.connections[client_id]['nb_received_tokens']} tokens",end="\r")
             sys.stdout = sys.__stdout__
             sys.stdout.flush()
             antiprompt = self.personality.detect_antiprompt(self.connections[client_id]["generated_text"])
@@ -960,31 +1754,34 @@ class LoLLMsAPPI(LollmsApplication):
             else:
                 self.update_message(client_id, chunk, metadata)
                 # if stop generation is detected then stop
-                if not self.cancel_gen:
+                if cancel_token is None or not cancel_token.canceled:
                     return True
                 else:
-                    self.cancel_gen = False
                     ASCIIColors.warning("Generation canceled")
                     return False
  
         # Stream the generated text to the main process
         elif message_type == MSG_TYPE.MSG_TYPE_FULL:
             self.connections[client_id]["generated_text"] = chunk
-            self.nb_received_tokens += 1
-            ASCIIColors.green(f"Received {self.nb_received_tokens} tokens",end="\r",flush=True)
+            self.connections[client_id]["nb_received_tokens"] += 1
+            ASCIIColors.green(f"Received {self.connections[client_id]['nb_received_tokens']} tokens",end="\r",flush=True)
             self.update_message(client_id, chunk, metadata)
-            return True
+            return cancel_token is None or not cancel_token.canceled
         # Stream the generated text to the frontend
         else:
             self.update_message(client_id, chunk, metadata, message_type)
         return True
 
 
-    def generate(self, full_prompt, prompt, n_predict, client_id, callback=None):
-        if self.personality.processor is not None:
+    def generate(self, full_prompt, prompt, n_predict, client_id, callback=None, cancel_token:CancellationToken=None, use_cache=True, personality:AIPersonality=None, prefix=None):
+        if personality is None:
+            personality = self.personality
+        if personality.processor is not None:
             ASCIIColors.success("Running workflow")
             try:
-                self.personality.processor.run_workflow( prompt, full_prompt, callback)
+                # The workflow calls the model itself, it must not run alongside the batched generations
+                with self.batched_generator.model_lock:
+                    personality.processor.run_workflow( prompt, full_prompt, callback)
             except Exception as ex:
                 # Catch the exception and get the traceback as a list of strings
                 traceback_lines = traceback.format_exception(type(ex), ex, ex.__traceback__)
@@ -997,39 +1794,205 @@ class LoLLMsAPPI(LollmsApplication):
             print("Finished executing the workflow")
             return
 
-        self._generate(full_prompt, n_predict, client_id, callback)
+        self._generate(full_prompt, n_predict, client_id, callback, cancel_token, use_cache, personality, prefix)
         ASCIIColors.success("\nFinished executing the generation")
 
-    def _generate(self, prompt, n_predict, client_id, callback=None):
-        self.nb_received_tokens = 0
+    def get_generation_parameters(self, n_predict, personality:AIPersonality=None):
+        """
+        Returns the sampling parameters of the next generation, taken from the configuration
+        if override_personality_model_parameters is set, and from the personality (the active one by default) otherwise.
+        """
+        if personality is None:
+            personality = self.personality
+        if self.config["override_personality_model_parameters"]:
+            return {
+                "n_predict":        n_predict,
+                "temperature":      self.config['temperature'],
+                "top_k":            self.config['top_k'],
+                "top_p":            self.config['top_p'],
+                "repeat_penalty":   self.config['repeat_penalty'],
+                "repeat_last_n":    self.config['repeat_last_n'],
+                "seed":             self.config['seed'],
+                "n_threads":        self.config['n_threads']
+            }
+        else:
+            return {
+                "n_predict":        min(n_predict,personality.model_n_predicts),
+                "temperature":      personality.model_temperature,
+                "top_k":            personality.model_top_k,
+                "top_p":            personality.model_top_p,
+                "repeat_penalty":   personality.model_repeat_penalty,
+                "repeat_last_n":    personality.model_repeat_last_n,
+                "seed":             self.config['seed'],
+                "n_threads":        self.config['n_threads']
+            }
+
+    def wait_for_model(self, cancel_token:CancellationToken=None):
+        """
+        Waits for the background loading of the model.
+
+        Returns:
+            bool: False if cancel_token was canceled meanwhile
+        """
+        if not self.model_loaded.is_set():
+            ASCIIColors.info("Waiting for the model to be loaded")
+            while not self.model_loaded.wait(0.1):
+                if cancel_token is not None and cancel_token.canceled:
+                    return False
+        return True
+
+    def get_missing_model_error(self):
+        """
+        Returns the reason why there is no model to generate with
+        """
+        if self.loading_status["status"] == "failed":
+            return f"The model couldn't be loaded: {self.loading_status['error']}"
+        return "No model selected. Please make sure you select a model before starting generation"
+
+    def complete(self, prompt, callback=None, personality:AIPersonality=None, cancel_token:CancellationToken=None, **parameters):
+        """
+        Generates the answer of a personality (the active one by default) to a standalone prompt,
+        without creating any discussion or message. parameters override the sampling parameters.
+        callback receives the generated chunks and can return False to stop the generation.
+
+        Returns:
+            str: The generated text, antiprompt removed
+        """
+        if not self.wait_for_model(cancel_token):
+            return ""
+        if self.model is None:
+            raise Exception(self.get_missing_model_error())
+        if personality is None:
+            personality = self.personality
+        full_prompt, conditioning, tokens = self.build_prompt(prompt, personality)
+        gpt_params = self.get_generation_parameters(self.config.ctx_size-len(tokens)-1, personality)
+        if "n_predict" in parameters:
+            parameters["n_predict"] = min(int(parameters["n_predict"]), self.config.ctx_size-len(tokens)-1)
+        gpt_params.update({k:v for k,v in parameters.items() if k in gpt_params})
+
+        output = ""
+        def receive(chunk, message_type:MSG_TYPE=MSG_TYPE.MSG_TYPE_CHUNK, *args, **kwargs):
+            nonlocal output
+            if cancel_token is not None and cancel_token.canceled:
+                return False
+            if message_type == MSG_TYPE.MSG_TYPE_CHUNK:
+                output += chunk
+                antiprompt = personality.detect_antiprompt(output)
+                if antiprompt:
+                    output = self.remove_text_from_string(output, antiprompt)
+                    return False
+                if callback is not None:
+                    return callback(chunk) != False
+            elif message_type == MSG_TYPE.MSG_TYPE_FULL:
+                output = chunk
+            return True
+
+        self.batched_generator.generate(
+            self.model,
+            full_prompt,
+            callback=receive,
+            cancel_token=cancel_token,
+            prefix=conditioning,
+            prefix_namespace=(self.config["binding_name"], self.config["model_name"], f"{personality.language}/{personality.category}/{personality.personality_folder_name}"),
+            **gpt_params
+        )
+        return output
+
+    def load_speculative_decoder(self):
+        """
+        Loads the draft model of the speculative_* settings through the model pool, which counts it and keeps it
+        next to the current model, and unloads the previous draft model. Called when the model or these settings change.
+        """
+        with self.speculative_decoder_lock:
+            key = None
+            if self.config["speculative_decoding"] and self.config["speculative_draft_model"] and supports_verification(self.model):
+                key = (self.config["speculative_draft_binding"] or self.config["binding_name"], self.config["speculative_draft_model"])
+            if key == self.speculative_decoder_key and (key is None or self.model_pool.get(*key) is not None):
+                return self.speculative_decoder
+            model_key = (self.config["binding_name"], self.config["model_name"])
+            previous_key = self.speculative_decoder_key
+            self.speculative_decoder = None
+            self.speculative_decoder_key = key
+            if previous_key is not None and previous_key != model_key:
+                self.model_pool.unpin(*previous_key)
+                # Waits for the generations using it
+                self.model_pool.remove(*previous_key)
+            if key is None:
+                return None
+
+            def build():
+                draft_config = copy.deepcopy(self.config)
+                draft_config["binding_name"], draft_config["model_name"] = key
+                binding = BindingBuilder().build_binding(draft_config, self.lollms_paths)
+                if get_patched_mode() != "threading":
+                    return binding, run_native(binding.build_model)
+                return binding, binding.build_model()
+
+            try:
+                self.model_pool.pin(*key)
+                _, draft_model = self.model_pool.load(*key, build, keep=[model_key])
+                if supports_drafting(draft_model):
+                    self.speculative_decoder = SpeculativeDecoder(wrap_model(draft_model))
+                    ASCIIColors.success(f"Speculative decoding enabled with draft model {key[0]}/{key[1]}")
+                else:
+                    ASCIIColors.warning(f"Draft model {key[0]}/{key[1]} can't propose tokens. Speculative decoding is disabled")
+            except Exception as ex:
+                ASCIIColors.error(f"Couldn't load the draft model: {ex}")
+                trace_exception(ex)
+            if self.speculative_decoder is None and key != model_key:
+                self.model_pool.unpin(*key)
+                self.model_pool.remove(*key)
+            return self.speculative_decoder
+
+    def get_speculative_decoder(self):
+        """
+        Returns the speculative decoder of the loaded draft model, or None when speculative decoding
+        is disabled, not supported by the models or the draft model was unloaded
+        """
+        speculative_decoder, key = self.speculative_decoder, self.speculative_decoder_key
+        if speculative_decoder is None or not self.config["speculative_decoding"] or not supports_verification(self.model):
+            return None
+        if self.model_pool.get(*key) is None:
+            # Unloaded with its binding, loaded again by the next load_speculative_decoder
+            return None
+        speculative_decoder.n_draft_tokens = self.config["speculative_draft_tokens"]
+        return speculative_decoder
+
+    def _generate(self, prompt, n_predict, client_id, callback=None, cancel_token:CancellationToken=None, use_cache=True, personality:AIPersonality=None, prefix=None):
+        self.connections[client_id]["nb_received_tokens"] = 0
+        if personality is None:
+            personality = self.personality
         if self.model is not None:
+            parameters = self.get_generation_parameters(n_predict, personality)
+            cache_key = None
+            if use_cache and self.completion_cache is not None and CompletionCache.is_deterministic(parameters):
+                cache_key = CompletionCache.make_key(self.config["binding_name"], self.config["model_name"], parameters, prompt)
+                chunks = self.completion_cache.get(cache_key)
+                if chunks is not None:
+                    return CompletionCache.replay(chunks, callback)
+                chunks = []
+                callback = CompletionCache.record(callback, chunks)
             ASCIIColors.info(f"warmup for generating {n_predict} tokens")
-            if self.config["override_personality_model_parameters"]:
-                output = self.model.generate(
-                    prompt,
-                    callback=callback,
-                    n_predict=n_predict,
-                    temperature=self.config['temperature'],
-                    top_k=self.config['top_k'],
-                    top_p=self.config['top_p'],
-                    repeat_penalty=self.config['repeat_penalty'],
-                    repeat_last_n = self.config['repeat_last_n'],
-                    seed=self.config['seed'],
-                    n_threads=self.config['n_threads']
-                )
-            else:
-                output = self.model.generate(
+            speculative_decoder = self.get_speculative_decoder()
+            output = None
+            if speculative_decoder is not None:
+                with self.batched_generator.model_lock:
+                    # The draft model is not unloaded while the lock is held, but may have been before
+                    if self.get_speculative_decoder() is speculative_decoder:
+                        output = speculative_decoder.generate(self.model, prompt, callback=callback, **parameters)
+            if output is None:
+                output = self.batched_generator.generate(
+                    self.model,
                     prompt,
                     callback=callback,
-                    n_predict=min(n_predict,self.personality.model_n_predicts),
-                    temperature=self.personality.model_temperature,
-                    top_k=self.personality.model_top_k,
-                    top_p=self.personality.model_top_p,
-                    repeat_penalty=self.personality.model_repeat_penalty,
-                    repeat_last_n = self.personality.model_repeat_last_n,
-                    seed=self.config['seed'],
-                    n_threads=self.config['n_threads']
+                    cancel_token=cancel_token,
+                    prefix=prefix,
+                    prefix_namespace=(self.config["binding_name"], self.config["model_name"], f"{personality.language}/{personality.category}/{personality.personality_folder_name}"),
+                    **parameters
                 )
+            # Interrupted generations are not complete answers
+            if cache_key is not None and (cancel_token is None or not cancel_token.canceled):
+                self.completion_cache.put(cache_key, chunks)
         else:
             print("No model is installed or selected. Please make sure to install a model and select it inside your configuration before attempting to communicate with the model.")
             print("To do this: Install the model to your models/<binding name> folder.")
@@ -1038,43 +2001,59 @@ class LoLLMsAPPI(LollmsApplication):
             output = ""
         return output
                      
-    def start_message_generation(self, message, message_id, client_id, is_continue=False):
+    def start_message_generation(self, message, message_id, client_id, is_continue=False, cancel_token:CancellationToken=None, use_cache=True, queued_at=None):
 
         ASCIIColors.info(f"Text generation requested by client: {client_id}")
+        if not self.wait_for_model(cancel_token):
+            return
         # send the message to the bot
         print(f"Received message : {message.content}")
         if self.connections[client_id]["current_discussion"]:
             if not self.model:
-                self.notify("No model selected. Please make sure you select a model before starting generation", False, client_id)
+                self.notify(self.get_missing_model_error(), False, client_id)
                 return          
             # First we need to send the new message ID to the client
             if is_continue:
                 self.connections[client_id]["current_discussion"].load_message(message_id)
                 self.connections[client_id]["generated_text"] = message.content
+                self.start_message_stream(client_id, message_id, message.content, self.personality.name, self.connections[client_id]["current_discussion"].discussion_id)
             else:
                 self.new_message(client_id, self.personality.name, "✍ please stand by ...")
             self.socketio.sleep(0.01)
 
+            trace = GenerationTrace(self.config["binding_name"], self.config["model_name"], self.config["personalities"][self.config["active_personality_id"]], queued_at)
             # prepare query and reception
-            self.discussion_messages, self.current_message, tokens = self.prepare_query(client_id, message_id, is_continue)
+            # The prompt stays local: other jobs may be preparing theirs at the same time
+            personality = self.personality
+            discussion_messages, current_message, tokens, prompt_prefix = self.prepare_query(client_id, message_id, is_continue)
+            trace.prompt_ready(len(tokens))
             self.prepare_reception(client_id)
             self.generating = True
             self.connections[client_id]["processing"]=True
+            trace.generation_started()
             self.generate(
-                            self.discussion_messages, 
-                            self.current_message, 
+                            discussion_messages, 
+                            current_message, 
                             n_predict = self.config.ctx_size-len(tokens)-1,
                             client_id=client_id,
-                            callback=partial(self.process_chunk,client_id = client_id)
+                            callback=trace.wrap(partial(self.process_chunk,client_id = client_id, cancel_token = cancel_token)),
+                            cancel_token=cancel_token,
+                            use_cache=use_cache,
+                            personality=personality,
+                            prefix=prompt_prefix
                         )
+            self.telemetry.add(trace.finish(
+                                    "canceled" if cancel_token is not None and cancel_token.canceled else "finished",
+                                    self.connections[client_id]["current_discussion"].current_message.id
+                                ))
             print()
             print("## Done Generation ##")
             print()
-            self.cancel_gen = False
 
             # Send final message
             self.close_message(client_id)
             self.socketio.sleep(0.01)
+            self.schedule_summary(self.connections[client_id]["current_discussion"])
             self.connections[client_id]["processing"]=False
             if self.connections[client_id]["schedule_for_deletion"]:
                 del self.connections[client_id]
@@ -1085,7 +2064,6 @@ class LoLLMsAPPI(LollmsApplication):
         else:
             ump = self.config.discussion_prompt_separator +self.config.user_name+": " if self.config.use_user_name_in_discussions else self.personality.user_message_prefix
             
-            self.cancel_gen = False
             #No discussion available
             ASCIIColors.warning("No discussion selected!!!")
 
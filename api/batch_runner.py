@@ -0,0 +1,183 @@
+######
+# Project       : lollms-webui
+# File          : batch_runner.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Answers the prompts of a JSONL file with a personality and writes the
+# answers to another JSONL file, resuming interrupted runs.
+######
+from lollms.helpers import ASCIIColors, trace_exception
+from api.scheduler import CancellationToken, PRIORITY_BACKGROUND
+from pathlib import Path
+import threading
+import time
+import json
+import os
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+class BatchRunner:
+    """
+    Reads prompts from input_path, one JSON object per line:
+
+        {"prompt": "...", "id": "optional identifier", "temperature": 0.1, ...}
+
+    and appends one line per answer to output_path:
+
+        {"line": 0, "id": "...", "prompt": "...", "text": "..."} or {"line": 0, "id": "...", "prompt": "...", "error": "..."}
+
+    The output file is the checkpoint: lines already answered there are skipped when the run is started again.
+    Prompts go through the generation scheduler with background priority, max_in_flight at a time.
+    complete is the function producing the answers (see LoLLMsAPPI.complete).
+    """
+    PARAMETERS = ["n_predict", "temperature", "top_k", "top_p", "repeat_penalty", "repeat_last_n", "seed"]
+
+    def __init__(self, scheduler, complete, input_path, output_path, personality=None, parameters=None, max_in_flight=1, binding_name="", name="batch"):
+        self.scheduler      = scheduler
+        self.complete       = complete
+        self.input_path     = Path(input_path)
+        self.output_path    = Path(output_path)
+        self.personality    = personality
+        self.parameters     = parameters if parameters is not None else {}
+        self.max_in_flight  = max(1, max_in_flight)
+        self.binding_name   = binding_name
+        self.client_id      = f"batch:{name}"
+
+        self.total          = 0
+        self.skipped        = 0
+        self.done           = 0
+        self.errors         = 0
+        self.status         = "idle"
+        self.started_at     = None
+        self.cancel_token   = CancellationToken()
+
+        self._lock          = threading.Lock()
+        self._in_flight     = threading.Semaphore(self.max_in_flight)
+        self._jobs          = []
+
+    def load_checkpoint(self):
+        """
+        Returns the input lines already answered in the output file, removing a partially written last line
+        """
+        answered = set()
+        if not self.output_path.exists():
+            return answered
+        with open(self.output_path, "rb+") as f:
+            content = f.read()
+            end = content.rfind(b"\n")+1
+            if end<len(content):
+                f.truncate(end)
+        for line in content[:end].decode("utf-8").splitlines():
+            try:
+                answered.add(json.loads(line)["line"])
+            except (ValueError, KeyError):
+                pass
+        return answered
+
+    def run(self):
+        """
+        Processes the whole input file, returns once every prompt is answered or the run is canceled
+        """
+        self.status = "running"
+        self.started_at = time.perf_counter()
+        answered = self.load_checkpoint()
+        with open(self.input_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        self.total = len([l for l in lines if l.strip()!=""])
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        ASCIIColors.info(f"Batch generation: {self.total} prompts, {len(answered)} already answered")
+
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            for index, line in enumerate(lines):
+                if self.cancel_token.canceled:
+                    break
+                if line.strip()=="":
+                    continue
+                if index in answered:
+                    self.skipped += 1
+                    continue
+                try:
+                    item = json.loads(line)
+                    if not isinstance(item, dict) or "prompt" not in item:
+                        raise ValueError("no prompt")
+                except ValueError as ex:
+                    self._write(output, {"line": index, "id": None, "prompt": None, "error": f"Invalid line: {ex}"})
+                    continue
+                # Prompts canceled while queued never release their slot
+                while not self._in_flight.acquire(timeout=0.5):
+                    if self.cancel_token.canceled:
+                        break
+                if self.cancel_token.canceled or not self._submit(output, index, item):
+                    break
+            for job in self._jobs:
+                job.wait()
+
+        self.status = "canceled" if self.cancel_token.canceled else "finished"
+        ASCIIColors.success(f"Batch generation {self.status}: {self.done} answers, {self.errors} errors")
+
+    def _submit(self, output, index, item):
+        token = CancellationToken()
+        while not self.cancel_token.canceled:
+            job = self.scheduler.submit(
+                                    self.client_id,
+                                    self._answer,
+                                    args            = (output, index, item),
+                                    kwargs          = {"cancel_token":token},
+                                    priority        = PRIORITY_BACKGROUND,
+                                    binding_name    = self.binding_name,
+                                    cancel_token    = token
+                                )
+            if job is not None:
+                self._jobs = [j for j in self._jobs if not j.done.is_set()]+[job]
+                return True
+            # The queue is full of interactive requests
+            time.sleep(0.5)
+        return False
+
+    def _answer(self, output, index, item, cancel_token=None):
+        try:
+            if self.cancel_token.canceled:
+                return
+            parameters = {**self.parameters, **{k:v for k,v in item.items() if k in self.PARAMETERS}}
+            text = self.complete(item["prompt"], personality=self.personality, cancel_token=cancel_token, **parameters)
+            if cancel_token.canceled or self.cancel_token.canceled:
+                return
+            self._write(output, {"line": index, "id": item.get("id", index), "prompt": item["prompt"], "text": text})
+        except Exception as ex:
+            trace_exception(ex)
+            self._write(output, {"line": index, "id": item.get("id", index), "prompt": item["prompt"], "error": str(ex)})
+        finally:
+            self._in_flight.release()
+
+    def _write(self, output, record):
+        with self._lock:
+            output.write(json.dumps(record)+"\n")
+            output.flush()
+            os.fsync(output.fileno())
+            if "error" in record:
+                self.errors += 1
+            else:
+                self.done += 1
+
+    def cancel(self):
+        self.cancel_token.cancel()
+        self.scheduler.cancel(client_id=self.client_id)
+
+    def get_status(self):
+        elapsed = time.perf_counter()-self.started_at if self.started_at is not None else 0
+        return {
+            "status":               self.status,
+            "input_path":           str(self.input_path),
+            "output_path":          str(self.output_path),
+            "total":                self.total,
+            "skipped":              self.skipped,
+            "done":                 self.done,
+            "errors":               self.errors,
+            "prompts_per_minute":   60*(self.done+self.errors)/elapsed if elapsed>0 else 0
+        }
@@ -0,0 +1,218 @@
+######
+# Project       : lollms-webui
+# File          : batching.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Groups concurrent generation requests into batched calls for the bindings
+# that support it and serializes the calls for the others.
+######
+from lollms.types import MSG_TYPE
+from lollms.helpers import ASCIIColors, trace_exception
+from api.prefix_cache import supports_state_cache
+import threading
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def supports_batching(model):
+    """
+    A binding advertises batch support by setting supports_batch_generation to True and implementing:
+
+        generate_batch(prompts:list, n_predict:int, callback:Callable[[int, str, MSG_TYPE], bool], **gpt_params) -> list
+
+    The callback receives the index of the prompt the chunk belongs to. When it returns False
+    the binding stops generating that sequence only.
+
+    A binding that also sets supports_sequence_parameters to True accepts a sequence_parameters list
+    giving the sampling parameters (n_predict included) of each prompt, so that prompts with different
+    parameters can share a batch. The keyword parameters are then the ones common to every prompt.
+    """
+    return model is not None and getattr(model, "supports_batch_generation", False) and hasattr(model, "generate_batch")
+
+
+def supports_sequence_parameters(model):
+    return supports_batching(model) and getattr(model, "supports_sequence_parameters", False)
+
+
+class BatchRequest:
+    def __init__(self, prompt, n_predict, callback, cancel_token=None, gpt_params=None, prefix=None, prefix_namespace=None):
+        self.prompt             = prompt
+        self.n_predict          = n_predict
+        self.callback           = callback
+        self.cancel_token       = cancel_token
+        self.gpt_params         = gpt_params if gpt_params is not None else {}
+        self.prefix             = prefix
+        self.prefix_namespace   = prefix_namespace
+        self.n_tokens       = 0
+        self.stopped        = False
+        self.output         = ""
+        self.done           = threading.Event()
+
+    def receive(self, chunk, message_type=MSG_TYPE.MSG_TYPE_CHUNK):
+        if self.cancel_token is not None and self.cancel_token.canceled:
+            self.stopped = True
+        if self.stopped:
+            return False
+        if message_type == MSG_TYPE.MSG_TYPE_CHUNK:
+            self.n_tokens += 1
+        if self.callback is not None:
+            try:
+                if self.callback(chunk, message_type) == False:
+                    self.stopped = True
+            except Exception as ex:
+                trace_exception(ex)
+                self.stopped = True
+        if self.n_tokens>=self.n_predict:
+            self.stopped = True
+        return not self.stopped
+
+
+class BatchedGenerator:
+    """
+    Sends generation requests to the model.
+
+    Requests reaching a batch capable model within batch_window seconds with the same
+    sampling parameters are sent as one generate_batch call, and the produced chunks are
+    routed back to the callback of each request. Other models are called one request at a time,
+    through the prefix state cache when the model supports it.
+    """
+    def __init__(self, batch_window=0.05, max_batch_size=8, prefix_cache=None, model_lock=None):
+        self.batch_window   = batch_window
+        self.max_batch_size = max_batch_size
+        self.prefix_cache   = prefix_cache
+
+        # Held during each call to the model
+        self.model_lock     = model_lock if model_lock is not None else threading.Lock()
+        self._lock          = threading.Condition()
+        self._groups        = {}
+
+    def generate(self, model, prompt, n_predict=128, callback=None, cancel_token=None, prefix=None, prefix_namespace=None, **gpt_params):
+        """
+        Generates the answer to prompt.
+
+        prefix is the beginning of prompt that is shared with other requests (personality conditioning
+        and discussion history) and prefix_namespace identifies the binding, model and personality it belongs to.
+        """
+        if not supports_batching(model) or self.max_batch_size<=1:
+            with self.model_lock:
+                if cancel_token is not None and cancel_token.canceled:
+                    return ""
+                if cancel_token is not None and getattr(model, "supports_cancel_token", False):
+                    gpt_params["cancel_token"] = cancel_token
+                if prefix is not None and self.prefix_cache is not None and supports_state_cache(model):
+                    return self.prefix_cache.generate(model, prefix_namespace, prefix, prompt, n_predict=n_predict, callback=callback, **gpt_params)
+                return model.generate(prompt, n_predict=n_predict, callback=callback, **gpt_params)
+
+        request = BatchRequest(prompt, n_predict, callback, cancel_token)
+        key = (id(model), tuple(sorted(gpt_params.items())))
+        with self._lock:
+            group = self._groups.get(key)
+            leader = group is None
+            if leader:
+                group = []
+                self._groups[key] = group
+            group.append(request)
+            if len(group)>=self.max_batch_size:
+                del self._groups[key]
+                self._lock.notify_all()
+
+        if leader:
+            deadline = time.perf_counter() + self.batch_window
+            with self._lock:
+                while self._groups.get(key) is group and time.perf_counter()<deadline:
+                    self._lock.wait(deadline - time.perf_counter())
+                if self._groups.get(key) is group:
+                    del self._groups[key]
+            self._run_batch(model, group, gpt_params)
+        else:
+            request.done.wait()
+        return request.output
+
+    def generate_many(self, model, requests:list):
+        """
+        Generates the answers to several BatchRequest at once, each one with its own sampling parameters
+        (gpt_params), and returns their outputs.
+
+        A model supporting sequence parameters gets them in as few generate_batch calls as max_batch_size allows.
+        Other batch capable models get one batch per distinct set of parameters, and the remaining models
+        are called one request at a time.
+        """
+        if not supports_batching(model) or self.max_batch_size<=1:
+            for request in requests:
+                request.output = self.generate(
+                                        model,
+                                        request.prompt,
+                                        n_predict           = request.n_predict,
+                                        callback            = request.callback,
+                                        cancel_token        = request.cancel_token,
+                                        prefix              = request.prefix,
+                                        prefix_namespace    = request.prefix_namespace,
+                                        **request.gpt_params
+                                    )
+            return [request.output for request in requests]
+
+        if supports_sequence_parameters(model):
+            groups = [(None, requests)]
+        else:
+            by_parameters = {}
+            for request in requests:
+                key = tuple(sorted(request.gpt_params.items()))
+                by_parameters.setdefault(key, (request.gpt_params, []))[1].append(request)
+            groups = list(by_parameters.values())
+        for gpt_params, group in groups:
+            for i in range(0, len(group), self.max_batch_size):
+                self._run_batch(model, group[i:i+self.max_batch_size], gpt_params)
+        return [request.output for request in requests]
+
+    def _run_batch(self, model, requests, gpt_params=None):
+        """
+        Sends requests as one generate_batch call, with gpt_params for all of them
+        or, when gpt_params is None, with the sequence parameters of each request
+        """
+        group = requests
+
+        def dispatch(index, chunk, message_type=MSG_TYPE.MSG_TYPE_CHUNK):
+            return group[index].receive(chunk, message_type)
+
+        try:
+            with self.model_lock:
+                # Requests canceled while waiting for the model are not sent
+                group = [r for r in requests if r.cancel_token is None or not r.cancel_token.canceled]
+                if len(group)==0:
+                    return
+                if len(group)>1:
+                    ASCIIColors.info(f"Generating a batch of {len(group)} prompts")
+                if gpt_params is None:
+                    sequence_parameters = [{"n_predict":r.n_predict, **r.gpt_params} for r in group]
+                    # Only the parameters shared by every sequence are given as keywords
+                    common = {k:v for k,v in sequence_parameters[0].items() if k!="n_predict" and all(k in p and p[k] == v for p in sequence_parameters)}
+                    outputs = model.generate_batch(
+                                    [r.prompt for r in group],
+                                    n_predict=max(r.n_predict for r in group),
+                                    callback=dispatch,
+                                    sequence_parameters=sequence_parameters,
+                                    **common
+                                )
+                else:
+                    outputs = model.generate_batch(
+                                    [r.prompt for r in group],
+                                    n_predict=max(r.n_predict for r in group),
+                                    callback=dispatch,
+                                    **gpt_params
+                                )
+            for request, output in zip(group, outputs):
+                request.output = output
+        except Exception as ex:
+            ASCIIColors.error("Batched generation failed")
+            trace_exception(ex)
+            for request in group:
+                request.receive(f"Batched generation failed\nError:{ex}", MSG_TYPE.MSG_TYPE_EXCEPTION)
+        finally:
+            for request in requests:
+                request.done.set()
@@ -0,0 +1,423 @@
+######
+# Project       : lollms-webui
+# File          : catalog.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Catalogs of the zoos kept in memory and on disk. Entries are only reparsed
+# when the modification times of their files or folders change.
+######
+from pathlib import Path
+import threading
+import inspect
+import json
+import time
+import yaml
+import os
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+# Logo files of a personality, by order of preference
+PERSONALITY_LOGOS = ["logo.gif", "logo.webp", "logo.png", "logo.jpg", "logo.jpeg", "logo.bmp"]
+# Fields of the entries used by filter_catalog: searched by name, matching type and license, installed flag
+BINDING_FIELDS = {"name": ["name", "folder", "description"], "type": "type", "license": "license", "installed": "installed"}
+MODEL_FIELDS = {"name": ["title", "description", "owner"], "type": "model_type", "license": "license", "installed": "isInstalled"}
+
+
+def mtime(path):
+    """
+    Returns the modification time of path in nanoseconds, None if it doesn't exist
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class DirectoryListings:
+    """
+    Names of the visible sub folders of folders, listed again only when the modification time of the folder changes
+    (which happens when an entry is added, removed or renamed in it)
+    """
+    def __init__(self):
+        self._listings = {}
+
+    def list(self, folder):
+        folder = Path(folder)
+        folder_mtime = mtime(folder)
+        if folder_mtime is None:
+            self._listings.pop(str(folder), None)
+            return []
+        listing = self._listings.get(str(folder))
+        if listing is None or listing[0]!=folder_mtime:
+            names = sorted(entry.name for entry in os.scandir(folder) if entry.is_dir() and not entry.name.startswith("."))
+            listing = (folder_mtime, names)
+            self._listings[str(folder)] = listing
+        return listing[1]
+
+    def entries(self, folder):
+        """
+        Names of the files and folders of folder, listed again only when its modification time changes
+        """
+        folder = Path(folder)
+        folder_mtime = mtime(folder)
+        if folder_mtime is None:
+            return set()
+        key = str(folder)+"|entries"
+        listing = self._listings.get(key)
+        if listing is None or listing[0]!=folder_mtime:
+            listing = (folder_mtime, set(os.listdir(folder)))
+            self._listings[key] = listing
+        return listing[1]
+
+    def files(self, folder):
+        """
+        Names of the files of folder, listed again only when its modification time changes
+        """
+        folder = Path(folder)
+        folder_mtime = mtime(folder)
+        if folder_mtime is None:
+            return set()
+        key = str(folder)+"|files"
+        listing = self._listings.get(key)
+        if listing is None or listing[0]!=folder_mtime:
+            listing = (folder_mtime, set(entry.name for entry in os.scandir(folder) if entry.is_file()))
+            self._listings[key] = listing
+        return listing[1]
+
+
+def filter_catalog(entries, name=None, type=None, license=None, installed=None, fields=BINDING_FIELDS):
+    """
+    Returns the entries containing name (case insensitive) in one of their name fields and matching type, license and installed.
+    Criteria left to None are not applied.
+    """
+    if name:
+        name = name.lower()
+        entries = [entry for entry in entries if any(name in str(entry.get(field) or "").lower() for field in fields["name"])]
+    if type:
+        entries = [entry for entry in entries if str(entry.get(fields["type"]) or "").lower()==type.lower()]
+    if license:
+        entries = [entry for entry in entries if str(entry.get(fields["license"]) or "").lower()==license.lower()]
+    if installed is not None:
+        entries = [entry for entry in entries if bool(entry.get(fields["installed"]))==installed]
+    return entries
+
+
+def paginate(entries, offset=0, limit=None):
+    offset = max(0, offset)
+    if limit is None:
+        return entries[offset:]
+    return entries[offset:offset+max(0, limit)]
+
+
+class PersonalityCatalog:
+    """
+    Index of the personalities of a zoo (language/category/personality folders).
+
+    Each personality is parsed once and kept with the modification times of its folder, its config.yaml
+    and its assets folder. The zoo is checked at most every check_interval seconds: only the folders whose
+    modification time changed are listed again and only the modified personalities are parsed again.
+    The index is saved to cache_file so that a restart doesn't parse the whole zoo.
+    """
+    def __init__(self, zoo_path, personal_configuration_path=None, cache_file=None, check_interval=2):
+        self.zoo_path                       = Path(zoo_path)
+        self.personal_configuration_path    = Path(personal_configuration_path) if personal_configuration_path is not None else None
+        self.cache_file                     = Path(cache_file) if cache_file is not None else None
+        self.check_interval                 = check_interval
+        self.listings                       = DirectoryListings()
+        self.lock                           = threading.RLock()
+        self._entries                       = {}
+        self._tree                          = None
+        self._last_check                    = 0
+        # Incremented each time a personality is added, removed or parsed again
+        self.version                        = 0
+        self._load()
+
+    def _load(self):
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("zoo_path") == str(self.zoo_path):
+                self._entries = {key: (tuple(entry["signature"]), entry["infos"]) for key, entry in cache["entries"].items()}
+        except Exception as ex:
+            print(f"Couldn't load the personalities catalog cache {self.cache_file}: {ex}")
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"zoo_path": str(self.zoo_path), "entries": {key: {"signature": list(signature), "infos": infos} for key, (signature, infos) in self._entries.items()}}, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def _signature(self, folder):
+        return (mtime(folder), mtime(folder/"config.yaml"), mtime(folder/"assets"), mtime(folder/"scripts"))
+
+    def _parse(self, language, category, name):
+        """
+        Reads the informations of a personality from its config.yaml, None if it has none
+        """
+        folder = self.zoo_path/language/category/name
+        config_path = folder/"config.yaml"
+        if not config_path.exists():
+            return None
+        with open(config_path, encoding="utf-8") as config_file:
+            config_data = yaml.load(config_file, Loader=yaml.FullLoader) or {}
+        assets = self.listings.files(folder/"assets")
+        logo = next((logo for logo in PERSONALITY_LOGOS if logo in assets), None)
+        return {
+            "folder":       name,
+            "name":         config_data.get("name", "No Name"),
+            "description":  config_data.get("personality_description", ""),
+            "author":       config_data.get("author", "ParisNeo"),
+            "creator":      config_data.get("creator", "ParisNeo"),
+            "version":      config_data.get("version", "1.0.0"),
+            "help":         config_data.get("help", ""),
+            "commands":     config_data.get("commands", ""),
+            "has_scripts":  (folder/"scripts").is_dir(),
+            "has_logo":     "logo.png" in assets or "logo.gif" in assets,
+            "logo":         logo
+        }
+
+    def get(self, language, category, name):
+        """
+        Returns the informations of a personality, parsed again if it was modified, None if it doesn't exist
+        """
+        key = f"{language}/{category}/{name}"
+        folder = self.zoo_path/language/category/name
+        signature = self._signature(folder)
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]==signature:
+                return entry[1]
+            try:
+                # Folders without config.yaml are kept as None so that they are not checked again
+                infos = self._parse(language, category, name) if signature[1] is not None else None
+            except Exception as ex:
+                print(f"Couldn't load personality from {folder} [{ex}]")
+                infos = None
+            self._entries[key] = (signature, infos)
+            self._tree = None
+            self.version += 1
+            return infos
+
+    def refresh(self, force=False):
+        """
+        Returns the tree {language: {category: [personality folders]}} of the zoo, checked again if check_interval elapsed
+        """
+        with self.lock:
+            if not force and self._tree is not None and time.time()-self._last_check<self.check_interval:
+                return self._tree
+            n_entries = len(self._entries)
+            changed = False
+            tree = {}
+            seen = set()
+            for language in self.listings.list(self.zoo_path):
+                tree[language] = {}
+                for category in self.listings.list(self.zoo_path/language):
+                    tree[language][category] = []
+                    for name in self.listings.list(self.zoo_path/language/category):
+                        key = f"{language}/{category}/{name}"
+                        seen.add(key)
+                        previous = self._entries.get(key)
+                        infos = self.get(language, category, name)
+                        changed = changed or previous is None or self._entries.get(key) is not previous
+                        if infos is not None:
+                            tree[language][category].append(name)
+            for key in [key for key in self._entries if key not in seen]:
+                del self._entries[key]
+            changed = changed or len(self._entries)!=n_entries
+            if changed:
+                self.version += 1
+            self._tree = tree
+            self._last_check = time.time()
+            if changed:
+                try:
+                    self._save()
+                except Exception as ex:
+                    print(f"Couldn't save the personalities catalog cache {self.cache_file}: {ex}")
+            return tree
+
+    def languages(self):
+        return list(self.refresh().keys())
+
+    def categories(self, language):
+        return list(self.refresh().get(language, {}).keys())
+
+    def personalities(self, language, category):
+        return list(self.refresh().get(language, {}).get(category, []))
+
+    def is_installed(self, infos):
+        if infos["has_scripts"]:
+            return True
+        if self.personal_configuration_path is None:
+            return False
+        return f"personality_{infos['folder']}.yaml" in self.listings.files(self.personal_configuration_path)
+
+    def avatar(self, language, category, infos, root="personalities"):
+        """
+        Path of the logo of a personality relative to root, empty if it has none
+        """
+        if infos["logo"] is None:
+            return ""
+        return f"{root}/{language}/{category}/{infos['folder']}/assets/{infos['logo']}"
+
+    def as_dict(self):
+        """
+        Returns the whole catalog in the format of /get_all_personalities
+        """
+        tree = self.refresh()
+        personalities = {}
+        with self.lock:
+            for language, categories in tree.items():
+                personalities[language] = {}
+                for category, names in categories.items():
+                    personalities[language][category] = []
+                    for name in names:
+                        infos = self._entries.get(f"{language}/{category}/{name}", (None, None))[1]
+                        if infos is None:
+                            continue
+                        personalities[language][category].append({
+                            "folder":       infos["folder"],
+                            "has_scripts":  infos["has_scripts"],
+                            "name":         infos["name"],
+                            "description":  infos["description"],
+                            "author":       infos["author"],
+                            "version":      infos["version"],
+                            "installed":    self.is_installed(infos),
+                            "help":         infos["help"],
+                            "commands":     infos["commands"],
+                            "has_logo":     infos["has_logo"],
+                            "avatar":       self.avatar(language, category, infos)
+                        })
+        return personalities
+
+
+class BindingCatalog:
+    """
+    Cards of the bindings of the zoo. A card is read again only when its folder, binding_card.yaml or logo changes,
+    and the zoo is checked at most every check_interval seconds.
+    """
+    def __init__(self, bindings_zoo_path, personal_configuration_path, check_interval=2):
+        self.bindings_zoo_path              = Path(bindings_zoo_path)
+        self.personal_configuration_path    = Path(personal_configuration_path)
+        self.check_interval                 = check_interval
+        self.listings                       = DirectoryListings()
+        self.lock                           = threading.Lock()
+        self._cards                         = {}
+        self._names                         = []
+        self._last_check                    = None
+
+    def _parse(self, folder):
+        with open(folder/"binding_card.yaml", "r", encoding="utf-8") as stream:
+            card = yaml.safe_load(stream) or {}
+        card["folder"] = folder.name
+        if (folder/"logo.png").exists():
+            card["icon"] = f"bindings/{folder.name}/logo.png"
+        return card
+
+    def refresh(self, force=False):
+        with self.lock:
+            if not force and self._last_check is not None and time.time()-self._last_check<self.check_interval:
+                return
+            names = []
+            for name in self.listings.list(self.bindings_zoo_path):
+                folder = self.bindings_zoo_path/name
+                signature = (mtime(folder), mtime(folder/"binding_card.yaml"), mtime(folder/"logo.png"))
+                if signature[1] is None:
+                    continue
+                entry = self._cards.get(name)
+                if entry is None or entry[0]!=signature:
+                    try:
+                        entry = (signature, self._parse(folder))
+                    except Exception as ex:
+                        print(f"Couldn't load backend card : {folder}\n\t{ex}")
+                        entry = (signature, None)
+                    self._cards[name] = entry
+                if entry[1] is not None:
+                    names.append(name)
+            for name in [name for name in self._cards if name not in names]:
+                del self._cards[name]
+            self._names = names
+            self._last_check = time.time()
+
+    def list(self):
+        """
+        Returns the cards of the bindings with their installed flag
+        """
+        self.refresh()
+        with self.lock:
+            configurations = self.listings.files(self.personal_configuration_path)
+            return [dict(self._cards[name][1], installed=f"binding_{name}.yaml" in configurations) for name in self._names]
+
+
+class ModelCatalog:
+    """
+    Models available for the current binding. The list returned by the binding is kept until the binding is reloaded
+    or one of the yaml files of its folder (the model lists of the zoo) changes. The installed flags come from
+    the listing of the models folder of the binding, done again only when it changes.
+    """
+    def __init__(self, personal_models_path):
+        self.personal_models_path   = Path(personal_models_path)
+        self.listings               = DirectoryListings()
+        self.lock                   = threading.Lock()
+        self._signature             = None
+        self._models                = []
+
+    def _binding_signature(self, binding, binding_name):
+        try:
+            folder = Path(inspect.getfile(type(binding))).parent
+            model_lists = tuple(sorted((name, mtime(folder/name)) for name in self.listings.files(folder) if name.endswith((".yaml", ".yml"))))
+        except (TypeError, OSError):
+            model_lists = ()
+        return (binding_name, id(binding), model_lists)
+
+    @staticmethod
+    def describe(model):
+        """
+        Returns the entry of a model of the list of a binding as sent by /get_available_models, without isInstalled
+        """
+        filename = model.get('filename',"")
+        server = model.get('server',"")
+        if server.endswith("/"):
+            path = f'{server}{filename}'
+        else:
+            path = f'{server}/{filename}'
+        return {
+            'title':        filename,
+            'variants':     model.get('variants',[]),
+            'icon':         model.get("icon", '/images/default_model.png'),
+            'license':      model.get("license", 'unknown'),
+            'owner':        model.get("owner", 'unknown'),
+            'owner_link':   model.get("owner_link", 'https://github.com/ParisNeo'),
+            'description':  model.get('description',""),
+            'path':         path,
+            'filesize':     int(model.get('filesize',0)),
+            'model_type':   model.get("model_type","")
+        }
+
+    def list(self, binding, binding_name):
+        signature = self._binding_signature(binding, binding_name)
+        with self.lock:
+            if signature!=self._signature:
+                models = []
+                for model in binding.get_available_models():
+                    try:
+                        models.append(self.describe(model))
+                    except Exception as ex:
+                        print("#################################")
+                        print(ex)
+                        print("#################################")
+                        print(f"Problem with model : {model}")
+                self._models = models
+                self._signature = signature
+            installed = self.listings.entries(self.personal_models_path/binding_name)
+            return [dict(model, isInstalled=model["title"] in installed or model["model_type"].lower()=="api" or ("/" in model["title"] and (self.personal_models_path/binding_name/model["title"]).exists())) for model in self._models]
@@ -0,0 +1,136 @@
+######
+# Project       : lollms-webui
+# File          : completion_cache.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# On disk cache of the completions produced with deterministic sampling.
+######
+from lollms.types import MSG_TYPE
+from lollms.helpers import ASCIIColors
+from pathlib import Path
+import sqlite3
+import hashlib
+import json
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+class CompletionCache:
+    """
+    Stores the chunks sent by the model for a prompt so that a later identical request
+    can be answered by replaying them through the same callback.
+    Entries are keyed by binding, model, sampling parameters and prompt hash, and the least
+    recently used ones are removed once the cache grows above max_size bytes.
+    """
+    # Parameters that don't change the generated text
+    IGNORED_PARAMETERS = ["n_threads"]
+
+    def __init__(self, db_path, max_size=100*1024*1024):
+        self.db_path    = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True, parents= True)
+        self.max_size   = max_size
+        self.create_tables()
+
+    def create_tables(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS completion (
+                    key TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.commit()
+
+    @staticmethod
+    def is_deterministic(parameters:dict):
+        """
+        A generation is reproducible when the seed is fixed and the sampling always picks the most probable token
+        """
+        greedy = float(parameters.get("temperature", 1))<=0 or int(parameters.get("top_k", 0))==1
+        return int(parameters.get("seed", -1))!=-1 and greedy
+
+    @staticmethod
+    def make_key(binding_name, model_name, parameters:dict, prompt:str):
+        parameters = {k:v for k,v in parameters.items() if k not in CompletionCache.IGNORED_PARAMETERS}
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        description = json.dumps([binding_name, model_name, parameters, prompt_hash], sort_keys=True)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Returns:
+            list: The recorded [chunk, message type] pairs or None
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT chunks FROM completion WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE completion SET last_access=? WHERE key=?", (time.time(), key))
+            conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, chunks:list):
+        data = json.dumps(chunks)
+        size = len(data.encode("utf-8"))
+        if size>self.max_size:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO completion (key, chunks, size, last_access) VALUES (?, ?, ?, ?)", (key, data, size, time.time()))
+            total = conn.execute("SELECT COALESCE(SUM(size),0) FROM completion").fetchone()[0]
+            if total>self.max_size:
+                rows = conn.execute("SELECT key, size FROM completion ORDER BY last_access ASC").fetchall()
+                for old_key, old_size in rows:
+                    if total<=self.max_size:
+                        break
+                    conn.execute("DELETE FROM completion WHERE key=?", (old_key,))
+                    total -= old_size
+            conn.commit()
+
+    def clear(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DELETE FROM completion")
+            conn.commit()
+
+    def get_size(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT COALESCE(SUM(size),0) FROM completion").fetchone()[0]
+
+    @staticmethod
+    def record(callback, chunks:list):
+        """
+        Wraps a generation callback so that every chunk it receives is appended to chunks
+        """
+        def recorder(chunk, message_type:MSG_TYPE=MSG_TYPE.MSG_TYPE_CHUNK, *args, **kwargs):
+            chunks.append([chunk, message_type.value])
+            if callback is None:
+                return True
+            return callback(chunk, message_type, *args, **kwargs)
+        return recorder
+
+    @staticmethod
+    def replay(chunks:list, callback):
+        """
+        Sends recorded chunks to callback as the model would have done
+
+        Returns:
+            str: The generated text
+        """
+        ASCIIColors.info("Replaying cached completion")
+        output = ""
+        for chunk, message_type in chunks:
+            message_type = MSG_TYPE(message_type)
+            if message_type == MSG_TYPE.MSG_TYPE_CHUNK:
+                output += chunk
+            elif message_type == MSG_TYPE.MSG_TYPE_FULL:
+                output = chunk
+            if callback is not None and callback(chunk, message_type) == False:
+                break
+        return output
@@ -0,0 +1,185 @@
+######
+# Project       : lollms-webui
+# File          : context_index.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Local TF-IDF index of the messages and document excerpts of a discussion,
+# used to put the most relevant ones in the prompt when they don't all fit.
+######
+from pathlib import Path
+import numpy as np
+import threading
+import json
+import zlib
+import os
+import re
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+# Uploaded files whose text is indexed as it is
+TEXT_EXTENSIONS = [".txt", ".md", ".py", ".js", ".ts", ".c", ".cpp", ".h", ".java", ".json", ".yaml", ".yml", ".csv", ".html", ".xml", ".tex", ".rst"]
+
+
+class HashingVectorizer:
+    """
+    Hashes the words and pairs of consecutive words of a text into n_features dimensions
+    and returns the sparse term frequencies as (indices, values)
+    """
+    def __init__(self, n_features=2**18):
+        self.n_features = n_features
+
+    def transform(self, text):
+        words = re.findall(r"\w+", text.lower())
+        terms = words + [a+" "+b for a, b in zip(words, words[1:])]
+        if len(terms)==0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        hashes = np.array([zlib.crc32(term.encode("utf-8")) for term in terms], dtype=np.uint64) % self.n_features
+        indices, counts = np.unique(hashes, return_counts=True)
+        return indices.astype(np.int32), (1+np.log(counts)).astype(np.float32)
+
+
+class ContextIndex:
+    """
+    Hashed TF-IDF vectors of the entries of a discussion, persisted in one .npz file.
+    Each entry has a key ("message:<id>" or "document:<file>:<n>"), a version (to detect edited messages),
+    its size in tokens and, for document excerpts, its text. Adding an entry only vectorizes that entry.
+    """
+    def __init__(self, path=None, n_features=2**18):
+        self.path           = Path(path) if path is not None else None
+        self.vectorizer     = HashingVectorizer(n_features)
+        self.entries        = []
+        self._positions     = {}
+        self._indices       = []
+        self._values        = []
+        self._df            = np.zeros(n_features, dtype=np.int32)
+        self._lock          = threading.Lock()
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        with np.load(self.path) as data:
+            lengths = data["lengths"]
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            self.entries = json.loads(str(data["entries"]))
+            self._indices = [data["indices"][offsets[i]:offsets[i+1]] for i in range(len(lengths))]
+            self._values = [data["values"][offsets[i]:offsets[i+1]] for i in range(len(lengths))]
+        self._positions = {entry["key"]:i for i, entry in enumerate(self.entries)}
+        self._df = np.bincount(np.concatenate(self._indices), minlength=self.vectorizer.n_features).astype(np.int32) if len(self.entries)>0 else np.zeros(self.vectorizer.n_features, dtype=np.int32)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    entries = np.array(json.dumps(self.entries)),
+                    lengths = np.array([len(i) for i in self._indices], dtype=np.int64),
+                    indices = np.concatenate(self._indices) if len(self._indices)>0 else np.zeros(0, dtype=np.int32),
+                    values  = np.concatenate(self._values) if len(self._values)>0 else np.zeros(0, dtype=np.float32)
+                )
+            os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        position = self._positions.get(key)
+        return self.entries[position] if position is not None else None
+
+    def keys(self, prefix=""):
+        return [entry["key"] for entry in self.entries if entry["key"].startswith(prefix)]
+
+    def add(self, key, text, size=0, version=None, store_text=False):
+        """
+        Adds or replaces an entry. Returns False when the entry is already indexed with this version.
+        """
+        entry = self.get(key)
+        if entry is not None and entry["version"]==version:
+            return False
+        indices, values = self.vectorizer.transform(text)
+        with self._lock:
+            if key in self._positions:
+                self._remove(key)
+            self.entries.append({"key":key, "version":version, "size":size, "text":text if store_text else None})
+            self._positions[key] = len(self.entries)-1
+            self._indices.append(indices)
+            self._values.append(values)
+            self._df[indices] += 1
+        return True
+
+    def remove(self, key):
+        with self._lock:
+            if key in self._positions:
+                self._remove(key)
+
+    def _remove(self, key):
+        position = self._positions[key]
+        self._df[self._indices[position]] -= 1
+        del self.entries[position]
+        del self._indices[position]
+        del self._values[position]
+        self._positions = {entry["key"]:i for i, entry in enumerate(self.entries)}
+
+    def search(self, query, keys=None):
+        """
+        Returns the cosine similarities between query and the entries (all of them, or those of keys) as {key: score}
+        """
+        with self._lock:
+            positions = list(range(len(self.entries))) if keys is None else [self._positions[k] for k in keys if k in self._positions]
+            if len(positions)==0:
+                return {}
+            q_indices, q_values = self.vectorizer.transform(query)
+            if len(q_indices)==0:
+                return {self.entries[p]["key"]:0.0 for p in positions}
+            idf = np.log((len(self.entries)+1)/(self._df+1)).astype(np.float32)+1
+            query_vector = np.zeros(self.vectorizer.n_features, dtype=np.float32)
+            query_vector[q_indices] = q_values*idf[q_indices]
+            lengths = np.array([len(self._indices[p]) for p in positions])
+            indices = np.concatenate([self._indices[p] for p in positions])
+            weights = np.concatenate([self._values[p] for p in positions])*idf[indices]
+            entry_ids = np.repeat(np.arange(len(positions)), lengths)
+            norms = np.sqrt(np.bincount(entry_ids, weights=weights*weights, minlength=len(positions)))
+            dots = np.bincount(entry_ids, weights=weights*query_vector[indices], minlength=len(positions))
+            scores = np.where(norms>0, dots/np.maximum(norms, 1e-12), 0)/np.linalg.norm(query_vector)
+            return {self.entries[p]["key"]:float(score) for p, score in zip(positions, scores)}
+
+
+def select_context(history_sizes, history_scores, document_sizes, document_scores, budget, recent_budget, top_k):
+    """
+    Chooses what goes in a prompt of budget tokens. The most recent history entries are kept up to recent_budget tokens,
+    then the top_k most relevant older entries and document excerpts that still fit.
+
+    Returns:
+        tuple: (kept history positions in chronological order, kept document positions by decreasing relevance)
+    """
+    n_recent = 0
+    used = 0
+    while n_recent<len(history_sizes) and used+history_sizes[-1-n_recent]<=min(recent_budget, budget):
+        used += history_sizes[-1-n_recent]
+        n_recent += 1
+    first_recent = len(history_sizes)-n_recent
+    candidates = [(history_scores[i], "history", i, history_sizes[i]) for i in range(first_recent)]
+    candidates += [(document_scores[i], "document", i, document_sizes[i]) for i in range(len(document_sizes))]
+    candidates.sort(key=lambda c: -c[0])
+    kept_history = list(range(first_recent, len(history_sizes)))
+    kept_documents = []
+    for score, kind, position, size in candidates:
+        if len(kept_documents)+len(kept_history)-n_recent>=top_k:
+            break
+        if score<=0 or used+size>budget:
+            continue
+        used += size
+        if kind=="history":
+            kept_history.append(position)
+        else:
+            kept_documents.append(position)
+    return sorted(kept_history), kept_documents
@@ -20,7 +20,7 @@ class DiscussionsDB:
 
 
     def create_tables(self):
-        db_version = 8
+        db_version = 10
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
 
@@ -60,6 +60,37 @@ class DiscussionsDB:
                 )
             """)
 
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS generation_telemetry (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_id INT,
+                    binding TEXT,
+                    model TEXT,
+                    personality TEXT,
+                    status TEXT,
+                    prompt_tokens INT,
+                    generated_tokens INT,
+                    queue_wait REAL,
+                    prompt_processing_time REAL,
+                    ttft REAL,
+                    decode_tokens_per_second REAL,
+                    total_time REAL,
+                    created_at TIMESTAMP,
+                    FOREIGN KEY (message_id) REFERENCES message(id)
+                )
+            """)
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS discussion_summary (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    discussion_id INTEGER NOT NULL,
+                    last_message_id INT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at TIMESTAMP,
+                    FOREIGN KEY (discussion_id) REFERENCES discussion(id)
+                )
+            """)
+
             cursor.execute("SELECT * FROM schema_version")
             row = cursor.fetchone()
 
@@ -178,6 +209,16 @@ class DiscussionsDB:
             conn.execute(query, params)
             conn.commit()
     
+    def add_generation_telemetry(self, record:dict):
+        """
+        Stores the measures of a generation (see api/telemetry.py)
+        """
+        columns = ["message_id", "binding", "model", "personality", "status", "prompt_tokens", "generated_tokens", "queue_wait", "prompt_processing_time", "ttft", "decode_tokens_per_second", "total_time", "created_at"]
+        return self.insert(
+            f"INSERT INTO generation_telemetry ({', '.join(columns)}) VALUES ({', '.join(['?']*len(columns))})",
+            tuple(record[c] for c in columns)
+        )
+
     def load_last_discussion(self):
         last_discussion_id = self.select("SELECT id FROM discussion ORDER BY id DESC LIMIT 1", fetch_all=False)
         if last_discussion_id is None:
@@ -510,6 +551,9 @@ class Discussion:
     def delete_discussion(self):
         """Deletes the discussion
         """
+        self.discussions_db.delete(
+            f"DELETE FROM discussion_summary WHERE discussion_id={self.discussion_id}"
+        )
         self.discussions_db.delete(
             f"DELETE FROM message WHERE discussion_id={self.discussion_id}"
         )
@@ -538,6 +582,37 @@ class Discussion:
 
         return self.messages
 
+    def get_summary(self, before_message_id=None):
+        """Gets the most recent summary of the messages preceding a message
+
+        Args:
+            before_message_id (int, optional): The summary only covers messages older than this one. Defaults to None (any summary).
+
+        Returns:
+            tuple: (id of the last summarized message, summary) or None
+        """
+        if before_message_id is None:
+            return self.discussions_db.select(
+                "SELECT last_message_id, content FROM discussion_summary WHERE discussion_id=? ORDER BY last_message_id DESC LIMIT 1",
+                (self.discussion_id,), False
+            )
+        return self.discussions_db.select(
+            "SELECT last_message_id, content FROM discussion_summary WHERE discussion_id=? AND last_message_id<? ORDER BY last_message_id DESC LIMIT 1",
+            (self.discussion_id, before_message_id), False
+        )
+
+    def add_summary(self, last_message_id, content):
+        """Stores the summary of the messages of the discussion up to last_message_id
+
+        Args:
+            last_message_id (int): The id of the last summarized message
+            content (str): The summary
+        """
+        return self.discussions_db.insert(
+            "INSERT INTO discussion_summary (discussion_id, last_message_id, content, created_at) VALUES (?, ?, ?, ?)",
+            (self.discussion_id, last_message_id, content, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+
     def select_message(self, message_id):
         for message in self.messages:
             if message.id == message_id:
@@ -594,5 +669,7 @@ class Discussion:
         """
         # Retrieve current rank value for message_id
         self.discussions_db.delete("DELETE FROM message WHERE id=?", (message_id,))
+        # Summaries covering the message are outdated
+        self.discussions_db.delete("DELETE FROM discussion_summary WHERE discussion_id=? AND last_message_id>=?", (self.discussion_id, message_id))
 
 # ========================================================================================================================
@@ -0,0 +1,180 @@
+######
+# Project       : lollms-webui
+# File          : emit_queue.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Outbound queues of the socket.io events, one per client, so that a slow
+# client never blocks a generation, and rate limits of the client requests.
+######
+from lollms.helpers import trace_exception
+from collections import deque
+import threading
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def coalesce_update(previous, update):
+    """
+    Appends the chunk of update to the update_message payload previous (json dictionary or compact array).
+    The merged update keeps the seq of the last chunk and gets the seq of its first chunk in first_seq
+    (the sixth element of compact arrays), so clients know that the updates in between are included.
+    """
+    if isinstance(previous, list):
+        if len(previous)<6:
+            previous.append(previous[1])
+        previous[1] = update[1]
+        previous[3] += update[3]
+        previous[4] = update[4]
+    else:
+        previous.setdefault("first_seq", previous["seq"])
+        previous["seq"] = update["seq"]
+        previous["content"] += update["content"]
+        previous["metadata"] = update["metadata"]
+        previous["finished_generating_at"] = update["finished_generating_at"]
+    return previous
+
+
+class EmitQueue:
+    """
+    Events waiting to be sent to one room. A streaming delta (an update_message chunk) arriving when max_size events
+    are waiting is merged into the last waiting delta of its message instead of being queued. Other events are always queued.
+    """
+    def __init__(self, room, max_size=256):
+        self.room           = room
+        self.max_size       = max_size
+        self.events         = deque()
+        self.condition      = threading.Condition()
+        self.closed         = False
+        self.sent           = 0
+        self.coalesced      = 0
+        self.max_depth      = 0
+
+    def put(self, event, data, delta_key=None):
+        """
+        delta_key identifies the message of a streaming delta, None for the other events
+        """
+        with self.condition:
+            if delta_key is not None and len(self.events)>=self.max_size:
+                for queued in reversed(self.events):
+                    if queued[2] == delta_key:
+                        coalesce_update(queued[1], data)
+                        self.coalesced += 1
+                        return
+                    if queued[2] is None and self._message_id(queued[1]) == delta_key:
+                        # An event of the message that is not a delta is waiting after its last delta
+                        break
+            self.events.append((event, data, delta_key))
+            self.max_depth = max(self.max_depth, len(self.events))
+            self.condition.notify()
+
+    @staticmethod
+    def _message_id(data):
+        if isinstance(data, list):
+            return data[0]
+        if isinstance(data, dict):
+            return data.get("id")
+        return None
+
+    def get(self, timeout):
+        """
+        Returns the next event, None if there was none for timeout seconds or the queue was closed
+        """
+        with self.condition:
+            if len(self.events)==0 and not self.closed:
+                self.condition.wait(timeout)
+            if len(self.events)==0:
+                return None
+            return self.events.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def get_status(self):
+        return {"depth": len(self.events), "max_depth": self.max_depth, "sent": self.sent, "coalesced": self.coalesced}
+
+
+class EmitQueues:
+    """
+    One EmitQueue per room, each drained by its own sender task started with start_task.
+    A sender task stops and drops its queue after idle_timeout seconds without events.
+    """
+    def __init__(self, emit, start_task, max_size=256, idle_timeout=30):
+        self.emit           = emit
+        self.start_task     = start_task
+        self.max_size       = max_size
+        self.idle_timeout   = idle_timeout
+        self.queues         = {}
+        self.lock           = threading.Lock()
+
+    def put(self, event, data, room, delta_key=None):
+        with self.lock:
+            queue = self.queues.get(room)
+            if queue is None:
+                queue = EmitQueue(room, self.max_size)
+                self.queues[room] = queue
+                self.start_task(self.send, queue)
+            queue.put(event, data, delta_key)
+
+    def send(self, queue:EmitQueue):
+        while True:
+            item = queue.get(self.idle_timeout)
+            if item is None:
+                with self.lock:
+                    # Events may have been queued since get returned
+                    if len(queue.events)>0:
+                        continue
+                    if self.queues.get(queue.room) is queue:
+                        del self.queues[queue.room]
+                    return
+            event, data, _ = item
+            try:
+                if data is None:
+                    self.emit(event, room=queue.room)
+                else:
+                    self.emit(event, data, room=queue.room)
+                queue.sent += 1
+            except Exception as ex:
+                trace_exception(ex)
+
+    def close(self, room):
+        with self.lock:
+            queue = self.queues.pop(room, None)
+        if queue is not None:
+            queue.close()
+
+    def get_status(self):
+        with self.lock:
+            return {str(room): queue.get_status() for room, queue in self.queues.items()}
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and bursts of capacity requests
+    """
+    def __init__(self, rate, capacity):
+        self.rate       = rate
+        self.capacity   = capacity
+        self.tokens     = capacity
+        self.updated_at = time.monotonic()
+        self.lock       = threading.Lock()
+
+    def consume(self, tokens=1):
+        """
+        Returns True and takes tokens if they are available, False otherwise
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens+(now-self.updated_at)*self.rate)
+            self.updated_at = now
+            if self.tokens>=tokens:
+                self.tokens -= tokens
+                return True
+            return False
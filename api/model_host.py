@@ -0,0 +1,209 @@
+######
+# Project       : lollms-webui
+# File          : model_host.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Runs the binding and the model in a separate process so that generation
+# does not compete with the web server threads for the GIL.
+######
+from lollms.types import MSG_TYPE
+from lollms.helpers import ASCIIColors, trace_exception
+import multiprocessing as mp
+import itertools
+import threading
+import queue
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def build_binding_model(config, lollms_paths):
+    """
+    Default model factory of the model host: builds the configured binding and its model
+    """
+    from lollms.binding import BindingBuilder
+    binding = BindingBuilder().build_binding(config, lollms_paths)
+    return binding.build_model()
+
+
+def run_model_host(connection, model_factory, args=()):
+    """
+    Entry point of the model host process.
+
+    Messages received from the proxy:
+        ("generate", request_id, prompt, n_predict, gpt_params)
+        ("tokenize", request_id, text)
+        ("detokenize", request_id, tokens)
+        ("cancel", request_id)
+        ("stop",)
+
+    Messages sent back:
+        ("ready", infos) or ("error", None, message) once the model is built
+        ("chunk", request_id, chunk, message_type)
+        ("result", request_id, value)
+        ("error", request_id, message)
+    """
+    try:
+        model = model_factory(*args)
+    except Exception as ex:
+        trace_exception(ex)
+        connection.send(("error", None, str(ex)))
+        return
+
+    send_lock = threading.Lock()
+    model_lock = threading.Lock()
+    canceled = set()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    def generate(request_id, prompt, n_predict, gpt_params):
+        def callback(chunk, message_type=MSG_TYPE.MSG_TYPE_CHUNK, *args, **kwargs):
+            if request_id in canceled:
+                return False
+            send(("chunk", request_id, chunk, message_type.value))
+            return True
+        try:
+            with model_lock:
+                if request_id in canceled:
+                    output = ""
+                else:
+                    output = model.generate(prompt, n_predict=n_predict, callback=callback, **gpt_params)
+            send(("result", request_id, output))
+        except Exception as ex:
+            trace_exception(ex)
+            send(("error", request_id, str(ex)))
+        finally:
+            canceled.discard(request_id)
+
+    send(("ready", {"model": type(model).__name__}))
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        command = message[0]
+        if command == "stop":
+            break
+        elif command == "cancel":
+            canceled.add(message[1])
+        elif command == "generate":
+            threading.Thread(target=generate, args=message[1:], daemon=True).start()
+        elif command in ["tokenize", "detokenize"]:
+            try:
+                send(("result", message[1], getattr(model, command)(message[2])))
+            except Exception as ex:
+                send(("error", message[1], str(ex)))
+    if hasattr(model, "destroy_model"):
+        model.destroy_model()
+
+
+class ModelHostProxy:
+    """
+    Stands for the model in the web server process. generate, tokenize and detokenize are
+    forwarded to the model host process through a pipe and the generated chunks are sent
+    back to the callback of the calling thread.
+    """
+    supports_batch_generation   = False
+    supports_state_cache        = False
+
+    def __init__(self, model_factory=build_binding_model, args=(), start_method="spawn"):
+        context = mp.get_context(start_method)
+        self.connection, host_connection = context.Pipe()
+        self.process = context.Process(target=run_model_host, args=(host_connection, model_factory, args), daemon=True)
+        self.process.start()
+        host_connection.close()
+
+        self._send_lock = threading.Lock()
+        self._requests  = {}
+        self._ids       = itertools.count()
+
+        answer = self.connection.recv()
+        if answer[0] != "ready":
+            self.process.join()
+            raise RuntimeError(f"Model host failed to build the model: {answer[2]}")
+        self.infos = answer[1]
+        ASCIIColors.success(f"Model host started (pid {self.process.pid})")
+
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _send(self, message):
+        with self._send_lock:
+            self.connection.send(message)
+
+    def _read(self):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            answers = self._requests.get(message[1])
+            if answers is not None:
+                answers.put(message)
+        for request_id, answers in list(self._requests.items()):
+            answers.put(("error", request_id, "Model host stopped"))
+
+    def _request(self, *message, callback=None):
+        request_id = next(self._ids)
+        answers = queue.Queue()
+        self._requests[request_id] = answers
+        try:
+            self._send((message[0], request_id, *message[1:]))
+            canceled = False
+            while True:
+                answer = answers.get()
+                if answer[0] == "chunk":
+                    if canceled or callback is None:
+                        continue
+                    try:
+                        stop = callback(answer[2], MSG_TYPE(answer[3])) == False
+                    except BaseException:
+                        # The host would keep generating, holding the model, for a caller that is gone
+                        self._send(("cancel", request_id))
+                        self._drain(answers)
+                        raise
+                    if stop:
+                        canceled = True
+                        self._send(("cancel", request_id))
+                elif answer[0] == "result":
+                    return answer[2]
+                else:
+                    raise RuntimeError(answer[2])
+        finally:
+            del self._requests[request_id]
+
+    def _drain(self, answers):
+        """
+        Skips the chunks of a canceled request until its result or error
+        """
+        while answers.get()[0] == "chunk":
+            pass
+
+    def generate(self, prompt, n_predict=128, callback=None, verbose=False, **gpt_params):
+        return self._request("generate", prompt, n_predict, gpt_params, callback=callback)
+
+    def tokenize(self, text):
+        return self._request("tokenize", text)
+
+    def detokenize(self, tokens):
+        return self._request("detokenize", tokens)
+
+    def stop(self, timeout=5):
+        if self.process.is_alive():
+            try:
+                self._send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.connection.close()
+
+    def destroy_model(self):
+        self.stop()
@@ -0,0 +1,175 @@
+######
+# Project       : lollms-webui
+# File          : model_pool.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Keeps several loaded models in memory so that switching between them
+# does not require reloading them.
+######
+from lollms.helpers import ASCIIColors, trace_exception
+from api.model_host import ModelHostProxy
+from collections import OrderedDict
+from pathlib import Path
+import threading
+import psutil
+import gc
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def model_file_size(binding):
+    """
+    Size on disk of the model of the binding, used as an estimation of the memory it will take
+    """
+    try:
+        path = Path(binding.get_model_path())
+    except Exception:
+        return 0
+    if path.is_file():
+        return path.stat().st_size
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return 0
+
+
+def model_memory(binding, model, rss_before=None):
+    """
+    Estimates the memory used by a loaded model: the resident memory of its model host process,
+    or the growth of the resident memory of this process during the loading.
+    Memory mapped models are only counted when read, so the model file size is used as a lower bound.
+    """
+    if isinstance(model, ModelHostProxy):
+        try:
+            return psutil.Process(model.process.pid).memory_info().rss
+        except psutil.Error:
+            return model_file_size(binding)
+    measured = 0
+    if rss_before is not None:
+        measured = psutil.Process().memory_info().rss - rss_before
+    return max(measured, model_file_size(binding))
+
+
+class ModelPool:
+    """
+    LRU pool of loaded (binding, model) pairs keyed by (binding name, model name).
+    Each pair has its own binding instance since bindings usually hold the model they built.
+    Least recently used pairs are destroyed when the estimated memory of the pool goes above max_memory.
+
+    in_use_lock is the lock held by the generations: models are only destroyed while holding it,
+    so that a model switch waits for the generations using the model it unloads.
+    Pinned models (the draft model of the speculative decoding) count in the memory but are only unloaded by remove.
+    """
+    def __init__(self, max_memory=0, in_use_lock=None):
+        self.max_memory     = max_memory
+        self.memory         = 0
+        self.in_use_lock    = in_use_lock if in_use_lock is not None else threading.Lock()
+
+        self._lock      = threading.RLock()
+        self._entries   = OrderedDict()
+        self._pinned    = set()
+
+    def get(self, binding_name, model_name):
+        """
+        Returns:
+            tuple: (binding, model) if resident, None otherwise
+        """
+        with self._lock:
+            entry = self._entries.get((binding_name, model_name))
+            if entry is None:
+                return None
+            self._entries.move_to_end((binding_name, model_name))
+            return entry["binding"], entry["model"]
+
+    def owns(self, binding):
+        """
+        Tells if binding is used by a resident model
+        """
+        with self._lock:
+            return any(entry["binding"] is binding for entry in self._entries.values())
+
+    def pin(self, binding_name, model_name):
+        """
+        Keeps the model out of the evictions
+        """
+        with self._lock:
+            self._pinned.add((binding_name, model_name))
+
+    def unpin(self, binding_name, model_name):
+        with self._lock:
+            self._pinned.discard((binding_name, model_name))
+
+    def add(self, binding_name, model_name, binding, model, size, keep=()):
+        with self._lock:
+            if (binding_name, model_name) in self._entries:
+                self._destroy((binding_name, model_name))
+            self._entries[(binding_name, model_name)] = {"binding": binding, "model": model, "size": size}
+            self.memory += size
+            ASCIIColors.info(f"Model pool: {binding_name}/{model_name} uses {size/(1024**2):.0f} MB")
+            self.evict(keep=[(binding_name, model_name), *keep])
+
+    def load(self, binding_name, model_name, build, keep=()):
+        """
+        Returns the resident model or builds it with build() -> (binding, model)
+        after making room for it in the pool, without unloading the models of keep.
+        """
+        resident = self.get(binding_name, model_name)
+        if resident is not None:
+            ASCIIColors.success(f"Model pool: {binding_name}/{model_name} is already loaded")
+            return resident
+        rss_before = psutil.Process().memory_info().rss
+        binding, model = build()
+        self.add(binding_name, model_name, binding, model, model_memory(binding, model, rss_before), keep)
+        return binding, model
+
+    def evict(self, reserve=0, keep=()):
+        """
+        Destroys the least recently used models until reserve bytes fit in the memory budget
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if self.memory+reserve<=self.max_memory:
+                    break
+                if key not in keep and key not in self._pinned:
+                    self._destroy(key)
+
+    def remove(self, binding_name, model_name=None):
+        """
+        Destroys the resident models of a binding, or one of them if model_name is given
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0]==binding_name and (model_name is None or key[1]==model_name):
+                    self._destroy(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._destroy(key)
+
+    def _destroy(self, key):
+        entry = self._entries.pop(key)
+        self.memory -= entry["size"]
+        ASCIIColors.info(f"Model pool: unloading {key[0]}/{key[1]}")
+        # Waits for the running generation
+        with self.in_use_lock:
+            try:
+                if isinstance(entry["model"], ModelHostProxy):
+                    entry["model"].stop()
+                entry["binding"].destroy_model()
+            except Exception as ex:
+                trace_exception(ex)
+        del entry
+        gc.collect()
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "max_memory":   self.max_memory,
+                "memory":       self.memory,
+                "models":       [{"binding_name":k[0], "model_name":k[1], "size":e["size"]} for k,e in self._entries.items()]
+            }
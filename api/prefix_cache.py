@@ -0,0 +1,130 @@
+######
+# Project       : lollms-webui
+# File          : prefix_cache.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Keeps the evaluation state of the model after the personality conditioning
+# and the discussion history so that only the new text needs to be evaluated.
+######
+from lollms.helpers import ASCIIColors
+from collections import OrderedDict
+import threading
+import hashlib
+import sys
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def supports_state_cache(model):
+    """
+    A binding supports the prefix state cache by setting supports_state_cache to True and implementing:
+
+        reset_state()               : forgets everything evaluated so far
+        eval_prompt(text)           : evaluates text on top of the current state without sampling
+        save_state()                : returns a copy of the current state (bytes or an object with nbytes)
+        load_state(state)           : restores a state returned by save_state
+        generate(prompt, ..., keep_state=True) : generates from the current state, prompt being the text that follows it
+    """
+    return model is not None and getattr(model, "supports_state_cache", False)
+
+
+def state_size(state):
+    if hasattr(state, "nbytes"):
+        return int(state.nbytes)
+    try:
+        return len(state)
+    except TypeError:
+        return sys.getsizeof(state)
+
+
+class PrefixStateCache:
+    """
+    LRU cache of model states keyed by (binding, model, personality) and by the hash of the
+    text that was evaluated to produce them. The total size of the stored states never goes
+    above max_memory bytes.
+    """
+    def __init__(self, max_memory=1024*1024*1024):
+        self.max_memory = max_memory
+        self.memory     = 0
+        self.hits       = 0
+        self.misses     = 0
+
+        self._lock      = threading.Lock()
+        self._entries   = OrderedDict()
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, namespace, prompt):
+        """
+        Finds the longest cached prefix of prompt.
+
+        Returns:
+            tuple: (prefix length, state) or None
+        """
+        with self._lock:
+            candidates = sorted([k for k in self._entries.keys() if k[0]==namespace and k[1]<=len(prompt)], key=lambda k: k[1], reverse=True)
+            for key in candidates:
+                if key[2]==self.hash_text(prompt[:key[1]]):
+                    self._entries.move_to_end(key)
+                    return key[1], self._entries[key][0]
+        return None
+
+    def put(self, namespace, prefix, state):
+        size = state_size(state)
+        if size>self.max_memory:
+            return
+        key = (namespace, len(prefix), self.hash_text(prefix))
+        with self._lock:
+            if key in self._entries:
+                self.memory -= self._entries.pop(key)[1]
+            self._entries[key] = (state, size)
+            self.memory += size
+            while self.memory>self.max_memory:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.memory -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+
+    def get_stats(self):
+        return {
+            "entries":      len(self._entries),
+            "memory":       self.memory,
+            "max_memory":   self.max_memory,
+            "hits":         self.hits,
+            "misses":       self.misses,
+        }
+
+    def generate(self, model, namespace, prefix, prompt, n_predict=128, callback=None, **gpt_params):
+        """
+        Generates the answer to prompt, restoring the state of the longest cached prefix
+        and caching the state reached after prefix. The caller must have exclusive access to the model.
+        """
+        if not prompt.startswith(prefix):
+            prefix = ""
+        entry = self.lookup(namespace, prompt)
+        if entry is None:
+            self.misses += 1
+            model.reset_state()
+            evaluated = 0
+        else:
+            self.hits += 1
+            evaluated, state = entry
+            model.load_state(state)
+            ASCIIColors.info(f"Prefix cache hit: reusing {evaluated}/{len(prompt)} characters of evaluated prompt")
+
+        if len(prefix)>evaluated:
+            model.eval_prompt(prompt[evaluated:len(prefix)])
+            self.put(namespace, prefix, model.save_state())
+            evaluated = len(prefix)
+
+        return model.generate(prompt[evaluated:], n_predict=n_predict, callback=callback, keep_state=True, **gpt_params)
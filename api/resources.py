@@ -0,0 +1,159 @@
+######
+# Project       : lollms-webui
+# File          : resources.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Samples the usage of the system resources in the background and keeps
+# the last samples, so that the endpoints polled by the ui don't measure them.
+######
+from lollms.helpers import trace_exception
+from collections import deque
+from pathlib import Path
+import subprocess
+import psutil
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+RESOURCES = ["ram", "cpu", "disk", "process", "vram"]
+
+
+def query_gpus():
+    """
+    Returns the (total vram, used vram, name) of each nvidia gpu, None if nvidia-smi is missing or fails
+    """
+    try:
+        output = subprocess.check_output(['nvidia-smi', '--query-gpu=memory.total,memory.used,gpu_name', '--format=csv,nounits,noheader'])
+    except (subprocess.CalledProcessError, FileNotFoundError, PermissionError):
+        return None
+    gpus = []
+    for line in output.decode().strip().split('\n'):
+        gpu = line.split(',')
+        gpus.append((int(gpu[0])*1024*1024, int(gpu[1])*1024*1024, gpu[2].strip()))
+    return gpus
+
+
+class ResourceSampler:
+    """
+    Samples the RAM, CPU, disk, process and VRAM usage every interval seconds and keeps the last history_size samples.
+    The format of each resource is the one of its endpoint (/ram_usage, /disk_usage, /vram_usage).
+
+    models_path is a function returning the models folder of the current binding (its disk is sampled too),
+    and on_sample is called with each new sample. GPUs are looked for once: without nvidia-smi the VRAM is no longer queried.
+    """
+    def __init__(self, models_path=None, interval=2, history_size=300, on_sample=None, sleep=time.sleep, gpu_query=query_gpus):
+        self.models_path    = models_path
+        self.interval       = interval
+        self.on_sample      = on_sample
+        self.sleep          = sleep
+        self.gpu_query      = gpu_query
+        self.gpu_available  = None
+        self.samples        = deque(maxlen=max(1, history_size))
+        self.process        = psutil.Process()
+        self.running        = False
+        # The first call only starts the measure
+        psutil.cpu_percent(interval=None)
+
+    def sample_vram(self):
+        gpus = self.gpu_query() if self.gpu_available is not False else None
+        if gpus is None:
+            if self.gpu_available is None:
+                print("No nvidia gpu found, the VRAM won't be sampled")
+            self.gpu_available = False
+            return {"nb_gpus": 0}
+        self.gpu_available = True
+        vram = {"nb_gpus": len(gpus)}
+        for i, (total, used, name) in enumerate(gpus):
+            vram[f"gpu_{i}_total_vram"] = total
+            vram[f"gpu_{i}_used_vram"] = used
+            vram[f"gpu_{i}_model"] = name
+        return vram
+
+    def sample_disk(self):
+        drive_disk_usage = psutil.disk_usage(Path.cwd().anchor)
+        disk = {
+            "total_space":drive_disk_usage.total,
+            "available_space":drive_disk_usage.free,
+            "usage":drive_disk_usage.used,
+            "percent_usage":drive_disk_usage.percent,
+
+            "binding_disk_total_space": None,
+            "binding_disk_available_space": None,
+            "binding_models_usage": None,
+            "binding_models_percent_usage": None,
+        }
+        try:
+            models_folder_disk_usage = psutil.disk_usage(str(self.models_path()))
+            disk["binding_disk_total_space"] = models_folder_disk_usage.total
+            disk["binding_disk_available_space"] = drive_disk_usage.free
+            disk["binding_models_usage"] = models_folder_disk_usage.used
+            disk["binding_models_percent_usage"] = models_folder_disk_usage.percent
+        except Exception:
+            pass
+        return disk
+
+    def sample(self):
+        """
+        Measures the resources, adds the sample to the history and returns it
+        """
+        ram = psutil.virtual_memory()
+        memory_info = self.process.memory_info()
+        sample = {
+            "time": time.time(),
+            "ram": {
+                "total_space":ram.total,
+                "available_space":ram.free,
+
+                "percent_usage":ram.percent,
+                "ram_usage": ram.used
+            },
+            "cpu": {
+                "percent_usage": psutil.cpu_percent(interval=None),
+                "nb_cpus": psutil.cpu_count()
+            },
+            "disk": self.sample_disk(),
+            "process": {
+                "rss": memory_info.rss,
+                "vms": memory_info.vms,
+                "nb_threads": self.process.num_threads()
+            },
+            "vram": self.sample_vram()
+        }
+        self.samples.append(sample)
+        return sample
+
+    def latest(self, resource=None):
+        """
+        Returns the last sample, or its resource, measured now if there is none yet
+        """
+        sample = self.samples[-1] if len(self.samples)>0 else self.sample()
+        return sample if resource is None else sample[resource]
+
+    def history(self, n, resource=None):
+        """
+        Returns the last n samples, with only the time and the fields of resource if given
+        """
+        samples = list(self.samples)[-n:] if n>0 else []
+        if resource is None:
+            return samples
+        return [{"time": sample["time"], **sample[resource]} for sample in samples]
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                sample = self.sample()
+                if self.on_sample is not None:
+                    self.on_sample(sample)
+            except Exception as ex:
+                trace_exception(ex)
+            self.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,56 @@
+######
+# Project       : lollms-webui
+# File          : response_cache.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Keeps the json answers of the read-heavy endpoints until the configuration
+# changes, and answers the clients that already have them with 304 Not Modified.
+######
+from flask import request, json, Response
+import threading
+import hashlib
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+class ResponseCache:
+    """
+    Json responses kept by key with an ETag made of the hash of their content.
+
+    A response is built again when the version of the cache changes (bump is called after each change
+    of the configuration, the mounted personalities or the binding) or when the version given with it changes
+    (for example the version of a catalog or the modification time of a folder).
+    """
+    def __init__(self):
+        self.version    = 0
+        self._entries   = {}
+        self._lock      = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def respond(self, key, build, version=None):
+        """
+        Returns the response of key, built with build() if it is missing or outdated, or 304 if the client has it
+        """
+        version = (self.version, version)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0]!=version:
+            # The version is read before building, so a change during the build only makes the next request build again
+            body = (json.dumps(build())+"\n").encode("utf-8")
+            entry = (version, body, hashlib.sha1(body).hexdigest()[:20])
+            with self._lock:
+                self._entries[key] = entry
+        response = Response(entry[1], mimetype="application/json")
+        response.set_etag(entry[2])
+        # Kept by the browser but revalidated on each use
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
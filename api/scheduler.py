@@ -0,0 +1,249 @@
+######
+# Project       : lollms-webui
+# File          : scheduler.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Fair scheduling of the generation requests sent to the shared model.
+######
+from lollms.helpers import ASCIIColors, trace_exception
+from datetime import datetime
+import threading
+import itertools
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+# Lower values are served first
+PRIORITY_INTERACTIVE    = 0
+PRIORITY_BACKGROUND     = 10
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag of one generation request.
+
+    The generation callback returns False as soon as the token is canceled, which stops the
+    binding at the next produced token. Bindings that set supports_cancel_token to True also
+    receive it as the cancel_token argument of generate so they can check it inside their own loop.
+    """
+    def __init__(self):
+        self._event         = threading.Event()
+        self.canceled_at    = None
+
+    def cancel(self):
+        if not self._event.is_set():
+            self.canceled_at = time.perf_counter()
+            self._event.set()
+
+    @property
+    def canceled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class GenerationJob:
+    def __init__(self, job_id, client_id, target, args=(), kwargs=None, priority=PRIORITY_INTERACTIVE, binding_name="", cancel_token:CancellationToken=None, exclusive=False):
+        self.id             = job_id
+        self.client_id      = client_id
+        self.target         = target
+        self.args           = args
+        self.kwargs         = kwargs if kwargs is not None else {}
+        self.priority       = priority
+        self.binding_name   = binding_name
+        self.cancel_token   = cancel_token if cancel_token is not None else CancellationToken()
+        # Exclusive jobs of a client never run at the same time
+        self.exclusive      = exclusive
+
+        # Virtual start tag used to interleave clients that share the same priority
+        self.tag            = 0
+        self.status         = "queued"
+        self.position       = -1
+        self.thread         = None
+        self.done           = threading.Event()
+
+        self.enqueued_at    = datetime.now()
+        self.started_at     = None
+        self.finished_at    = None
+
+    def sort_key(self):
+        return (self.priority, self.tag, self.id)
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def to_json(self):
+        return {
+            "id":           self.id,
+            "client_id":    self.client_id,
+            "priority":     self.priority,
+            "binding":      self.binding_name,
+            "status":       self.status,
+            "position":     self.position,
+            "enqueued_at":  self.enqueued_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class GenerationScheduler:
+    """
+    Bounded queue of generation jobs.
+
+    Jobs are served by priority, then by a virtual start tag that gives every client
+    its turn (a client posting several requests in a row does not starve the others).
+    Each binding has its own maximum number of jobs running at the same time, and a client
+    runs one exclusive job at a time (the jobs using the state of its connection).
+    """
+    def __init__(self, max_queue_size=32, max_concurrency=1, bindings_max_concurrency=None, on_queue_update=None):
+        self.max_queue_size             = max_queue_size
+        self.max_concurrency            = max_concurrency
+        self.bindings_max_concurrency   = dict(bindings_max_concurrency) if bindings_max_concurrency else {}
+        self.on_queue_update            = on_queue_update
+
+        self._lock          = threading.RLock()
+        self._ids           = itertools.count(1)
+        self._pending       = []
+        self._running       = {}
+        self._running_count = {}
+        self._client_tags   = {}
+        self._virtual_time  = 0
+
+    # ----------------------------------------------------- Configuration
+    def get_max_concurrency(self, binding_name):
+        return max(1, int(self.bindings_max_concurrency.get(binding_name, self.max_concurrency)))
+
+    def set_max_concurrency(self, max_concurrency, binding_name=None):
+        with self._lock:
+            if binding_name is None:
+                self.max_concurrency = max_concurrency
+            else:
+                self.bindings_max_concurrency[binding_name] = max_concurrency
+            self._dispatch()
+
+    # ----------------------------------------------------- Queue management
+    def submit(self, client_id, target, args=(), kwargs=None, priority=PRIORITY_INTERACTIVE, binding_name="", cancel_token:CancellationToken=None, exclusive=False):
+        """
+        Queues a job. Returns the job, or None if the queue is full.
+        An exclusive job waits for the end of the running exclusive job of the same client.
+        """
+        with self._lock:
+            if len(self._pending)>=self.max_queue_size:
+                ASCIIColors.warning(f"Generation queue is full ({self.max_queue_size} requests)")
+                return None
+            job = GenerationJob(next(self._ids), client_id, target, args, kwargs, priority, binding_name, cancel_token, exclusive)
+            job.tag = max(self._virtual_time, self._client_tags.get(client_id, 0)) + 1
+            self._client_tags[client_id] = job.tag
+            self._pending.append(job)
+            self._dispatch()
+        return job
+
+    def cancel(self, client_id=None, job_id=None, queued=True, running=True):
+        """
+        Cancels the jobs of a client (or a single job, or every job if both are None).
+        Queued jobs are removed from the queue, running jobs have their cancellation token set
+        and leave as soon as the binding returns.
+
+        Returns:
+            list: The canceled jobs
+        """
+        def selected(job):
+            return (job_id is None or job.id==job_id) and (client_id is None or job.client_id==client_id)
+
+        with self._lock:
+            canceled = [j for j in self._pending if selected(j)] if queued else []
+            for job in canceled:
+                self._pending.remove(job)
+                job.cancel_token.cancel()
+                job.status = "canceled"
+                job.position = -1
+                job.finished_at = datetime.now()
+                job.done.set()
+            if len(canceled)>0:
+                self._forget_idle_clients()
+                self._notify_positions()
+            if running:
+                for job in self._running.values():
+                    if selected(job):
+                        job.cancel_token.cancel()
+                        canceled.append(job)
+        return canceled
+
+    def running_jobs(self, client_id=None):
+        with self._lock:
+            return [j for j in self._running.values() if client_id is None or j.client_id==client_id]
+
+    def queued_jobs(self, client_id=None):
+        with self._lock:
+            return [j for j in sorted(self._pending, key=GenerationJob.sort_key) if client_id is None or j.client_id==client_id]
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "max_queue_size":   self.max_queue_size,
+                "max_concurrency":  self.max_concurrency,
+                "queued":           [j.to_json() for j in sorted(self._pending, key=GenerationJob.sort_key)],
+                "running":          [j.to_json() for j in self._running.values()],
+            }
+
+    # ----------------------------------------------------- Internals
+    def _dispatch(self):
+        started = False
+        busy_clients = {j.client_id for j in self._running.values() if j.exclusive}
+        for job in sorted(self._pending, key=GenerationJob.sort_key):
+            if self._running_count.get(job.binding_name, 0)>=self.get_max_concurrency(job.binding_name):
+                continue
+            if job.exclusive and job.client_id in busy_clients:
+                continue
+            if job.exclusive:
+                busy_clients.add(job.client_id)
+            self._pending.remove(job)
+            self._running[job.id] = job
+            self._running_count[job.binding_name] = self._running_count.get(job.binding_name, 0) + 1
+            self._virtual_time = max(self._virtual_time, job.tag)
+            job.status = "running"
+            job.position = 0
+            job.started_at = datetime.now()
+            job.thread = threading.Thread(target=self._run, args=(job,))
+            job.thread.start()
+            started = True
+        if started or len(self._pending)>0:
+            self._notify_positions()
+
+    def _run(self, job:GenerationJob):
+        try:
+            job.target(*job.args, **job.kwargs)
+        except Exception as ex:
+            ASCIIColors.error(f"Generation job {job.id} failed")
+            trace_exception(ex)
+        finally:
+            with self._lock:
+                del self._running[job.id]
+                self._running_count[job.binding_name] -= 1
+                job.status = "canceled" if job.cancel_token.canceled else "finished"
+                job.position = -1
+                job.finished_at = datetime.now()
+                self._forget_idle_clients()
+                self._dispatch()
+            job.done.set()
+
+    def _forget_idle_clients(self):
+        busy = {j.client_id for j in self._pending} | {j.client_id for j in self._running.values()}
+        for client_id in list(self._client_tags.keys()):
+            if client_id not in busy:
+                del self._client_tags[client_id]
+
+    def _notify_positions(self):
+        for i, job in enumerate(sorted(self._pending, key=GenerationJob.sort_key)):
+            if job.position != i+1:
+                job.position = i+1
+                if self.on_queue_update is not None:
+                    try:
+                        self.on_queue_update(job, len(self._pending))
+                    except Exception as ex:
+                        trace_exception(ex)
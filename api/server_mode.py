@@ -0,0 +1,140 @@
+######
+# Project       : lollms-webui
+# File          : server_mode.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Keeps the event loop of the gevent and eventlet server modes responsive
+# by running the calls that block in native code in real threads.
+######
+from collections import deque
+import sys
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+SERVER_MODES = ["threading", "gevent", "eventlet"]
+
+
+def get_patched_mode():
+    """
+    Returns the library that monkey patched the standard library, threading if none did
+    """
+    if "gevent" in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            return "gevent"
+    if "eventlet" in sys.modules:
+        import eventlet.patcher
+        if eventlet.patcher.is_monkey_patched("thread"):
+            return "eventlet"
+    return "threading"
+
+
+def start_native_thread(target, *args):
+    """
+    Starts target in an operating system thread, even when threads are patched into green threads
+    """
+    mode = get_patched_mode()
+    if mode == "gevent":
+        from gevent import monkey
+        start_new_thread = monkey.get_original("_thread", "start_new_thread")
+    elif mode == "eventlet":
+        import eventlet.patcher
+        start_new_thread = eventlet.patcher.original("_thread").start_new_thread
+    else:
+        import _thread
+        start_new_thread = _thread.start_new_thread
+    start_new_thread(target, args)
+
+
+def run_native(function, *args, callback=None, callback_key=None, poll_interval=0.005, **kwargs):
+    """
+    Calls function in a native thread and waits for its result in the calling green thread, which lets the event loop run.
+    When callback is given, function receives a callback that queues its arguments, and callback is called
+    with them from the calling green thread, so that it can emit events safely. Once callback returns False for a key
+    (callback_key(*args), a single key by default), the native callback returns False for it.
+    """
+    pending = deque()
+    stopped = set()
+    state = {}
+
+    def native_callback(*callback_args):
+        key = callback_key(*callback_args) if callback_key is not None else None
+        if key in stopped:
+            return False
+        pending.append(callback_args)
+        return True
+
+    def run():
+        try:
+            if callback is not None:
+                state["result"] = function(*args, callback=native_callback, **kwargs)
+            else:
+                state["result"] = function(*args, **kwargs)
+        except BaseException as ex:
+            state["error"] = ex
+        finally:
+            state["done"] = True
+
+    start_native_thread(run)
+    while True:
+        done = state.get("done", False)
+        while len(pending)>0:
+            callback_args = pending.popleft()
+            key = callback_key(*callback_args) if callback_key is not None else None
+            if key not in stopped and callback(*callback_args) == False:
+                stopped.add(key)
+        if done:
+            break
+        # Patched sleep: yields to the event loop
+        time.sleep(poll_interval)
+    if "error" in state:
+        raise state["error"]
+    return state["result"]
+
+
+class NativeThreadModel:
+    """
+    Stands for the model when the server runs on green threads. Green threads only switch on I/O,
+    so a generation blocking in native code would freeze every connection: the heavy methods
+    of the model run in native threads through run_native, everything else is forwarded as is.
+    """
+    NATIVE_METHODS = [
+                        "generate", "generate_batch", "verify_tokens", "predict_tokens",
+                        # Used by the prefix cache to evaluate the prefixes and restore their states
+                        "eval_prompt", "save_state", "load_state", "reset_state",
+                        "tokenize", "detokenize"
+                    ]
+
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        attribute = getattr(self.model, name)
+        if name not in self.NATIVE_METHODS or not callable(attribute):
+            return attribute
+        def call(*args, callback=None, **kwargs):
+            return run_native(
+                        attribute,
+                        *args,
+                        callback        = callback,
+                        # Batched generations stop each sequence separately
+                        callback_key    = (lambda index, *_: index) if name == "generate_batch" else None,
+                        **kwargs
+                    )
+        return call
+
+
+def wrap_model(model):
+    """
+    Returns model as it is in threading mode, and a NativeThreadModel in the gevent and eventlet modes
+    """
+    if model is None or isinstance(model, NativeThreadModel) or get_patched_mode() == "threading":
+        return model
+    return NativeThreadModel(model)
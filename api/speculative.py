@@ -0,0 +1,108 @@
+######
+# Project       : lollms-webui
+# File          : speculative.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Speculative decoding: a small draft model proposes tokens that the main
+# model verifies in one pass.
+######
+from lollms.types import MSG_TYPE
+from lollms.helpers import ASCIIColors
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def supports_verification(model):
+    """
+    The main model supports speculative decoding by setting supports_speculative_verification to True and implementing:
+
+        tokenize(text) / detokenize(tokens)
+        verify_tokens(tokens:list, draft:list, **gpt_params) -> list
+            returns the len(draft)+1 tokens the model picks after tokens+draft[:i] for i in 0..len(draft),
+            computed in a single evaluation of the draft tokens
+        eos_token_id (optional) : generation stops when the model picks it
+    """
+    return model is not None and getattr(model, "supports_speculative_verification", False) and hasattr(model, "verify_tokens")
+
+
+def supports_drafting(model):
+    """
+    The draft model must share the tokenizer of the main model and implement:
+
+        predict_tokens(tokens:list, n:int, **gpt_params) -> list
+            returns up to n tokens following tokens
+    """
+    return model is not None and hasattr(model, "predict_tokens")
+
+
+class SpeculativeDecoder:
+    """
+    Generates with the main model, n_draft_tokens at a time: the draft model proposes them,
+    the main model verifies them in one pass and the longest agreeing prefix is kept together
+    with the token the main model picked at the first disagreement.
+    The output is the one the main model would produce alone with the same sampling.
+    """
+    def __init__(self, draft_model, n_draft_tokens=4):
+        self.draft_model    = draft_model
+        self.n_draft_tokens = n_draft_tokens
+        self.last_stats     = None
+
+    def generate(self, model, prompt, n_predict=128, callback=None, **gpt_params):
+        start = time.perf_counter()
+        tokens = model.tokenize(prompt)
+        eos_token_id = getattr(model, "eos_token_id", None)
+        generated = []
+        output = ""
+        proposed = 0
+        accepted = 0
+        passes = 0
+        verification_time = 0
+        stopped = False
+
+        while len(generated)<n_predict and not stopped:
+            n = min(self.n_draft_tokens, n_predict-len(generated)-1)
+            draft = self.draft_model.predict_tokens(tokens+generated, n, **gpt_params) if n>0 else []
+            verification_start = time.perf_counter()
+            verified = model.verify_tokens(tokens+generated, draft, **gpt_params)
+            verification_time += time.perf_counter()-verification_start
+            passes += 1
+
+            n_accepted = 0
+            while n_accepted<len(draft) and draft[n_accepted]==verified[n_accepted]:
+                n_accepted += 1
+            proposed += len(draft)
+            accepted += n_accepted
+
+            for token in draft[:n_accepted]+[verified[n_accepted]]:
+                if token == eos_token_id:
+                    stopped = True
+                    break
+                generated.append(token)
+                text = model.detokenize(generated)
+                chunk = text[len(output):]
+                output = text
+                if callback is not None and callback(chunk, MSG_TYPE.MSG_TYPE_CHUNK) == False:
+                    stopped = True
+                    break
+
+        total_time = time.perf_counter()-start
+        # Without draft, the main model would run one pass per generated token
+        single_pass_time = verification_time/passes if passes>0 else 0
+        self.last_stats = {
+            "generated_tokens":         len(generated),
+            "proposed_tokens":          proposed,
+            "accepted_tokens":          accepted,
+            "acceptance_rate":          accepted/proposed if proposed>0 else 0,
+            "main_model_passes":        passes,
+            "tokens_per_pass":          len(generated)/passes if passes>0 else 0,
+            "total_time":               total_time,
+            "estimated_speedup":        len(generated)*single_pass_time/total_time if total_time>0 else 0
+        }
+        ASCIIColors.info(f"Speculative decoding: acceptance rate {self.last_stats['acceptance_rate']*100:.0f}%, {self.last_stats['tokens_per_pass']:.2f} tokens per pass, estimated speedup x{self.last_stats['estimated_speedup']:.2f}")
+        return output
@@ -0,0 +1,178 @@
+######
+# Project       : lollms-webui
+# File          : static_files.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Serves the files of the web ui and of the zoos with validators and cache headers,
+# and the precompressed variants of the files when the browser accepts them.
+#
+#   python -m api.static_files web/dist
+######
+from collections import OrderedDict
+from werkzeug.security import safe_join
+from werkzeug.exceptions import NotFound
+from flask import request, send_file
+from pathlib import Path
+import mimetypes
+import threading
+import argparse
+import gzip
+import os
+import re
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+# Files built with a hash of their content in their name (index-c75baf49.js): they never change
+HASHED_FILE = re.compile(r"[.-][0-9a-fA-F]{8,}\.[^./]+$")
+# Content-Encoding and extension of the precompressed variants, by order of preference
+PRECOMPRESSED_VARIANTS = [("br", ".br"), ("gzip", ".gz")]
+COMPRESSIBLE_EXTENSIONS = [".js", ".css", ".html", ".svg", ".json", ".txt", ".map", ".ttf", ".ico", ".wasm"]
+
+
+def accepted_encodings(header):
+    """
+    Returns the encodings of an Accept-Encoding header that are not refused with q=0
+    """
+    encodings = set()
+    for part in (header or "").split(","):
+        fields = part.strip().split(";")
+        encoding = fields[0].strip().lower()
+        q = 1.0
+        for field in fields[1:]:
+            name, _, value = field.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if encoding and q>0:
+            encodings.add(encoding)
+    return encodings
+
+
+class StaticFiles:
+    """
+    Serves files with an ETag made of their modification time and size, so that browsers revalidate
+    them with If-None-Match and get a 304, and with Cache-Control immutable for the hashed files of the built web ui.
+    The resolved paths, their validators and their precompressed variants are cached until the file changes.
+    """
+    def __init__(self, immutable_max_age=31536000, cache_size=4096):
+        self.immutable_max_age  = immutable_max_age
+        self.cache_size         = cache_size
+        self._entries           = OrderedDict()
+        self._lock              = threading.Lock()
+
+    def _resolve(self, root, filename):
+        key = (root, filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        path = entry["path"] if entry is not None else safe_join(root, filename)
+        if path is None:
+            raise NotFound()
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            stat = None
+        if stat is None or not os.path.isfile(path):
+            with self._lock:
+                self._entries.pop(key, None)
+            raise NotFound()
+        if entry is None or entry["mtime"]!=stat.st_mtime_ns or entry["size"]!=stat.st_size:
+            # New or modified file
+            mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            variants = {}
+            for encoding, extension in PRECOMPRESSED_VARIANTS:
+                try:
+                    if os.stat(path+extension).st_mtime_ns>=stat.st_mtime_ns:
+                        variants[encoding] = path+extension
+                except FileNotFoundError:
+                    pass
+            entry = {
+                "path":         path,
+                "mtime":        stat.st_mtime_ns,
+                "size":         stat.st_size,
+                "etag":         f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+                "mimetype":     mimetype,
+                "variants":     variants,
+                "hashed":       HASHED_FILE.search(filename) is not None
+            }
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries)>self.cache_size:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def serve(self, root, filename, immutable=False):
+        """
+        Returns the response serving filename from the root folder, 404 if it doesn't exist or is outside of root.
+        With immutable, the files with a content hash in their name are cached without revalidation:
+        only pass it for folders of built files, any other file may have a hash-like name and still change.
+        """
+        entry = self._resolve(str(root), filename)
+        path, etag, encoding = entry["path"], entry["etag"], None
+        if len(entry["variants"])>0:
+            accepted = accepted_encodings(request.headers.get("Accept-Encoding"))
+            for candidate, _ in PRECOMPRESSED_VARIANTS:
+                if candidate in accepted and candidate in entry["variants"]:
+                    encoding = candidate
+                    path = entry["variants"][candidate]
+                    # Each representation has its own validator
+                    etag = f"{etag}-{candidate}"
+                    break
+        response = send_file(path, mimetype=entry["mimetype"], etag=etag, last_modified=entry["mtime"]/1e9, conditional=True)
+        if encoding is not None and response.status_code!=304:
+            response.headers["Content-Encoding"] = encoding
+        if len(entry["variants"])>0:
+            response.vary.add("Accept-Encoding")
+        if immutable and entry["hashed"]:
+            response.headers["Cache-Control"] = f"public, max-age={self.immutable_max_age}, immutable"
+        else:
+            # Cached but revalidated with the ETag on each use
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+def precompress(directory, extensions=COMPRESSIBLE_EXTENSIONS, min_size=1024):
+    """
+    Writes the .gz variant, and the .br variant when brotli is installed, of the compressible files of directory
+    that are missing or older than the file. Returns the number of variants written.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    written = 0
+    for path in Path(directory).rglob("*"):
+        if not path.is_file() or path.suffix.lower() not in extensions or path.stat().st_size<min_size:
+            continue
+        data = None
+        for encoding, extension in PRECOMPRESSED_VARIANTS:
+            if encoding == "br" and brotli is None:
+                continue
+            variant = path.with_name(path.name+extension)
+            if variant.exists() and variant.stat().st_mtime_ns>=path.stat().st_mtime_ns:
+                continue
+            if data is None:
+                data = path.read_bytes()
+            compressed = brotli.compress(data, quality=11) if encoding == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed)>=len(data):
+                # Not worth it
+                continue
+            variant.write_bytes(compressed)
+            written += 1
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes the precompressed variants of the static files")
+    parser.add_argument("directory", type=str, nargs="?", default="web/dist", help="Folder of the files to compress")
+    args = parser.parse_args()
+    print(f"{precompress(args.directory)} precompressed files written")
@@ -0,0 +1,128 @@
+######
+# Project       : lollms-webui
+# File          : streaming.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Payloads of the events streaming the generated messages to the clients.
+######
+from lollms.types import MSG_TYPE
+from collections import deque
+from datetime import datetime
+import threading
+import json
+import zlib
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+# json    : update_message carries a dictionary repeating every field of the message
+# compact : update_message carries an array of the fields that change, in the order of COMPACT_UPDATE_FIELDS
+STREAM_PROTOCOLS = ["json", "compact"]
+COMPACT_UPDATE_FIELDS = ["id", "seq", "message_type", "content", "metadata"]
+# Message types whose content replaces the content of the message, chunks are appended to it
+FULL_MESSAGE_TYPES = [MSG_TYPE.MSG_TYPE_FULL.value, MSG_TYPE.MSG_TYPE_FULL_INVISIBLE_TO_AI.value, MSG_TYPE.MSG_TYPE_FULL_INVISIBLE_TO_USER.value]
+
+
+def negotiate_protocol(requested):
+    """
+    Returns the first supported protocol of requested (a protocol name or a list by order of preference), json otherwise
+    """
+    if requested is None:
+        return "json"
+    if isinstance(requested, str):
+        requested = [requested]
+    for protocol in requested:
+        if protocol in STREAM_PROTOCOLS:
+            return protocol
+    return "json"
+
+
+def compact_update(message_id, seq, message_type, content, metadata=None):
+    return [message_id, seq, message_type, content, metadata]
+
+
+def update_payload(protocol, sender, discussion_id, message_id, seq, message_type, content, metadata=None):
+    """
+    Returns the payload of update_message in protocol
+    """
+    if protocol == "compact":
+        # Only the fields that change, the others are known from new_message
+        return compact_update(message_id, seq, message_type, content, metadata)
+    return {
+        "sender":                   sender,
+        'id':                       message_id, 
+        'seq':                      seq,
+        'content':                  content,
+        'discussion_id':            discussion_id,
+        'message_type':             message_type,
+        'finished_generating_at':   datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'metadata':                 json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata
+    }
+
+
+def text_checksum(text):
+    """
+    CRC32 of the UTF-8 encoded text, sent with close_message so that clients can check the content they assembled
+    """
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class MessageStream:
+    """
+    State of a message being streamed. Each update_message of the message gets the next sequence number,
+    starting at 1 after new_message, so that clients can detect missed updates and ask for a resync.
+
+    The last replay_size updates are kept so that a client reconnecting with the same session
+    can get the ones it missed. The stream is sent to the room of the session, in the protocol
+    of the connection that started it.
+    """
+    def __init__(self, message_id, content="", session=None, protocol="json", sender=None, discussion_id=None, replay_size=0):
+        self.message_id     = message_id
+        self.seq            = 0
+        self.content        = content
+        self.session        = session
+        self.protocol       = protocol
+        self.sender         = sender
+        self.discussion_id  = discussion_id
+        self.close_payload  = None
+        # Held while an update is numbered and sent, so that replayed and live updates stay in order
+        self.lock           = threading.RLock()
+        self._updates       = deque(maxlen=replay_size) if replay_size>0 else None
+
+    def apply(self, chunk, message_type, metadata=None):
+        """
+        Returns the sequence number of the update
+        """
+        self.seq += 1
+        if message_type == MSG_TYPE.MSG_TYPE_CHUNK.value:
+            self.content += chunk
+        elif message_type in FULL_MESSAGE_TYPES:
+            self.content = chunk
+        if self._updates is not None:
+            self._updates.append((self.seq, message_type, chunk, metadata))
+        return self.seq
+
+    def replay(self, after_seq):
+        """
+        Returns the updates (seq, message_type, content, metadata) following after_seq,
+        None when some of them are no longer in the replay buffer
+        """
+        if after_seq>=self.seq:
+            return []
+        if self._updates is None or len(self._updates)==0 or self._updates[0][0]>after_seq+1:
+            return None
+        return [update for update in self._updates if update[0]>after_seq]
+
+    def get_state(self):
+        return {
+            "id":       self.message_id,
+            "seq":      self.seq,
+            "content":  self.content,
+            "checksum": text_checksum(self.content),
+            "length":   len(self.content)
+        }
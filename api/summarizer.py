@@ -0,0 +1,66 @@
+######
+# Project       : lollms-webui
+# File          : summarizer.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Compacts long discussions by folding their oldest messages into a
+# summary that stands for them in the prompts.
+######
+from lollms.types import MSG_TYPE
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def is_visible_to_ai(message):
+    return message.message_type<=MSG_TYPE.MSG_TYPE_FULL_INVISIBLE_TO_USER.value and message.message_type!=MSG_TYPE.MSG_TYPE_FULL_INVISIBLE_TO_AI.value
+
+
+class DiscussionSummarizer:
+    """
+    Once the messages following the last summary of a discussion take more than threshold tokens,
+    all of them but the most recent keep_tokens tokens are folded, with the previous summary,
+    into a new summary. Prompts then start with the summary instead of these messages.
+    """
+    def __init__(self, tokenize, threshold, keep_tokens, separator="!@>"):
+        self.tokenize       = tokenize
+        self.threshold      = threshold
+        self.keep_tokens    = keep_tokens
+        self.separator      = separator
+
+    def format_message(self, message):
+        return "\n"+self.separator+message.sender.replace(":","")+": "+message.content.strip()
+
+    def format_summary(self, summary):
+        return "\n"+self.separator+"summary of the previous messages: "+summary.strip()
+
+    def select(self, messages, last_summarized_id=None):
+        """
+        Returns the messages to fold into a new summary, empty when the discussion is short enough
+        """
+        pending = [m for m in messages if (last_summarized_id is None or m.id>last_summarized_id) and is_visible_to_ai(m)]
+        sizes = [len(self.tokenize(self.format_message(m))) for m in pending]
+        if sum(sizes)<=self.threshold:
+            return []
+        kept = 0
+        n_folded = len(pending)
+        while n_folded>0 and kept+sizes[n_folded-1]<=self.keep_tokens:
+            n_folded -= 1
+            kept += sizes[n_folded]
+        # The message being answered is never folded
+        return pending[:min(n_folded, len(pending)-1)]
+
+    def build_prompt(self, messages, previous_summary=None):
+        """
+        Returns the prompt asking the model to summarize messages, continuing previous_summary
+        """
+        prompt = self.separator+"instruction: Write a concise summary of the following discussion. Keep the facts, names, decisions and open questions needed to continue it.\n"
+        if previous_summary:
+            prompt += self.format_summary(previous_summary)
+        prompt += "".join(self.format_message(m) for m in messages)
+        prompt += "\n"+self.separator+"summary:"
+        return prompt
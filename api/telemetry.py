@@ -0,0 +1,133 @@
+######
+# Project       : lollms-webui
+# File          : telemetry.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Measures the performance of each generation and aggregates it.
+######
+from lollms.types import MSG_TYPE
+from lollms.helpers import trace_exception
+from collections import deque
+from datetime import datetime
+import threading
+import time
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def percentile(values:list, p:float):
+    """
+    Linear interpolation between the closest ranks of sorted values
+    """
+    if len(values)==0:
+        return None
+    values = sorted(values)
+    rank = (len(values)-1)*p/100
+    low = int(rank)
+    high = min(low+1, len(values)-1)
+    return values[low]+(values[high]-values[low])*(rank-low)
+
+
+class GenerationTrace:
+    """
+    Timings of one generation. Times are in seconds:
+
+        queue_wait              : from the request to the start of its processing
+        prompt_processing_time  : from the call to the model to the first token
+        ttft                    : from the request to the first token
+        total_time              : from the request to the end of the generation
+    """
+    def __init__(self, binding_name, model_name, personality, queued_at=None):
+        self.started_at         = time.perf_counter()
+        self.queued_at          = queued_at if queued_at is not None else self.started_at
+        self.binding_name       = binding_name
+        self.model_name         = model_name
+        self.personality        = personality
+        self.prompt_tokens      = 0
+        self.generated_tokens   = 0
+        self.generation_at      = None
+        self.first_token_at     = None
+        self.last_token_at      = None
+
+    def prompt_ready(self, prompt_tokens):
+        self.prompt_tokens = prompt_tokens
+
+    def generation_started(self):
+        self.generation_at = time.perf_counter()
+
+    def wrap(self, callback):
+        """
+        Returns a callback that times the chunks before passing them to callback
+        """
+        def timed_callback(chunk, message_type:MSG_TYPE=MSG_TYPE.MSG_TYPE_CHUNK, *args, **kwargs):
+            if message_type == MSG_TYPE.MSG_TYPE_CHUNK:
+                now = time.perf_counter()
+                if self.first_token_at is None:
+                    self.first_token_at = now
+                self.last_token_at = now
+                self.generated_tokens += 1
+            return callback(chunk, message_type, *args, **kwargs)
+        return timed_callback
+
+    def finish(self, status="finished", message_id=None):
+        finished_at = time.perf_counter()
+        generation_at = self.generation_at if self.generation_at is not None else finished_at
+        decode_time = self.last_token_at-self.first_token_at if self.first_token_at is not None else 0
+        return {
+            "created_at":               datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "message_id":               message_id,
+            "binding":                  self.binding_name,
+            "model":                    self.model_name,
+            "personality":              self.personality,
+            "status":                   status,
+            "prompt_tokens":            self.prompt_tokens,
+            "generated_tokens":         self.generated_tokens,
+            "queue_wait":               self.started_at-self.queued_at,
+            "prompt_processing_time":   self.first_token_at-generation_at if self.first_token_at is not None else None,
+            "ttft":                     self.first_token_at-self.queued_at if self.first_token_at is not None else None,
+            "decode_tokens_per_second": (self.generated_tokens-1)/decode_time if decode_time>0 else None,
+            "total_time":               finished_at-self.queued_at
+        }
+
+
+class GenerationTelemetry:
+    """
+    Keeps the last max_records generation records in memory and writes them to db when given
+    """
+    METRICS = ["prompt_tokens", "generated_tokens", "queue_wait", "prompt_processing_time", "ttft", "decode_tokens_per_second", "total_time"]
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self, max_records=1000, db=None):
+        self.db         = db
+        self._lock      = threading.Lock()
+        self._records   = deque(maxlen=max_records)
+
+    def add(self, record:dict):
+        with self._lock:
+            self._records.append(record)
+        if self.db is not None:
+            try:
+                self.db.add_generation_telemetry(record)
+            except Exception as ex:
+                trace_exception(ex)
+
+    def get_records(self, binding_name=None, model_name=None, count=None):
+        with self._lock:
+            records = [r for r in self._records if (binding_name is None or r["binding"]==binding_name) and (model_name is None or r["model"]==model_name)]
+        return records[-count:] if count else records
+
+    def get_stats(self, binding_name=None, model_name=None):
+        records = self.get_records(binding_name, model_name)
+        stats = {"count": len(records)}
+        for metric in self.METRICS:
+            values = [r[metric] for r in records if r[metric] is not None]
+            stats[metric] = {
+                "mean": sum(values)/len(values) if len(values)>0 else None,
+                **{f"p{p}": percentile(values, p) for p in self.PERCENTILES}
+            }
+        return stats
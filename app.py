@@ -20,6 +20,25 @@ main_repo = "https://github.com/ParisNeo/lollms-webui.git"
 import os
 import sys
 
+# The gevent and eventlet server modes need the standard library patched before anything else is imported
+def get_server_mode_argument(argv):
+    for i, arg in enumerate(argv):
+        if arg == "--server_mode" and i+1<len(argv):
+            return argv[i+1]
+        if arg.startswith("--server_mode="):
+            return arg.split("=", 1)[1]
+    return None
+
+server_mode = get_server_mode_argument(sys.argv) if __name__ == "__main__" else None
+if server_mode == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+elif server_mode == "eventlet":
+    import eventlet
+    eventlet.monkey_patch()
+else:
+    server_mode = "threading"
+
 def run_update_script(args=None):
     update_script = "update_script.py"
 
@@ -62,7 +81,8 @@ try:
         jsonify,
         render_template,
         request,
-        send_from_directory
+        send_from_directory,
+        Response
     )
 
     from flask_socketio import SocketIO
@@ -78,6 +98,14 @@ try:
     
     from api.config import load_config
     from api import LoLLMsAPPI
+    from api.scheduler import CancellationToken, PRIORITY_INTERACTIVE
+    from api.batch_runner import BatchRunner
+    from api.batching import supports_batching
+    from api.server_mode import SERVER_MODES
+    from api.static_files import StaticFiles, precompress
+    from api.resources import ResourceSampler
+    from api.catalog import mtime as catalog_mtime, PersonalityCatalog, BindingCatalog, ModelCatalog, filter_catalog, paginate, BINDING_FIELDS, MODEL_FIELDS
+    import queue
     import shutil
     import socket
 
@@ -99,8 +127,7 @@ log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
 app = Flask("Lollms-WebUI", static_url_path="/static", static_folder="static")
-#  async_mode='gevent', ping_timeout=1200, ping_interval=120, 
-socketio = SocketIO(app,  cors_allowed_origins="*", async_mode='threading',engineio_options={'websocket_compression': False, 'websocket_ping_interval': 20, 'websocket_ping_timeout': 120, 'websocket_max_queue': 100})
+socketio = SocketIO(app,  cors_allowed_origins="*", async_mode=server_mode,engineio_options={'websocket_compression': False, 'websocket_ping_interval': 20, 'websocket_ping_timeout': 120, 'websocket_max_queue': 100})
 
 app.config['SECRET_KEY'] = 'secret!'
 # Set the logging level to WARNING or higher
@@ -184,7 +211,38 @@ class LoLLMsWebUI(LoLLMsAPPI):
         super().__init__(config, _socketio, config_file_path, lollms_paths)
 
         self.app = _app
-        self.cancel_gen = False
+        self.batch_runner = None
+
+        # Folders served by the serve_* endpoints, resolved once
+        self.static_files = StaticFiles()
+        self.web_dist_path = Path(__file__).resolve().parent/"web"/"dist"
+        self.images_path = Path(__file__).resolve().parent/"images"
+        self.help_path = Path(__file__).resolve().parent/"help"
+        for folder in [self.help_path, lollms_paths.personal_path/"outputs", lollms_paths.personal_path/"data", lollms_paths.personal_path/"uploads"]:
+            folder.mkdir(exist_ok=True, parents=True)
+        if self.config["static_precompress"]:
+            precompress(self.web_dist_path)
+
+        # Indexes of the personalities, parsed again only when they change
+        self.personalities_catalog = PersonalityCatalog(
+                                        lollms_paths.personalities_zoo_path,
+                                        lollms_paths.personal_configuration_path,
+                                        lollms_paths.personal_path/"cache"/"personalities_catalog.json"
+                                    )
+        self.personal_personalities_catalog = PersonalityCatalog(lollms_paths.personal_personalities_path)
+        self.bindings_catalog = BindingCatalog(lollms_paths.bindings_zoo_path, lollms_paths.personal_configuration_path)
+        self.models_catalog = ModelCatalog(lollms_paths.personal_models_path)
+
+        # Usage of the resources, sampled in the background and pushed to the clients
+        self.resource_sampler = ResourceSampler(
+                                        models_path     = lambda: self.lollms_paths.personal_models_path/self.config["binding_name"],
+                                        interval        = self.config["resources_sampling_interval"],
+                                        history_size    = self.config["resources_history_size"],
+                                        on_sample       = self.emit_resources_usage,
+                                        sleep           = self.socketio.sleep
+                                    )
+        if self.config["resources_sampling_interval"]>0:
+            self.socketio.start_background_task(self.resource_sampler.run)
 
         app.template_folder = "web/dist"
 
@@ -235,7 +293,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
         self.add_endpoint("/upload_avatar", "upload_avatar", self.upload_avatar, methods=["POST"])
         
         
-        self.add_endpoint("/list_mounted_personalities", "list_mounted_personalities", self.list_mounted_personalities, methods=["POST"])
+        self.add_endpoint("/list_mounted_personalities", "list_mounted_personalities", self.list_mounted_personalities, methods=["GET", "POST"])
 
         self.add_endpoint("/mount_personality", "mount_personality", self.p_mount_personality, methods=["POST"])
         self.add_endpoint("/unmount_personality", "unmount_personality", self.p_unmount_personality, methods=["POST"])        
@@ -259,6 +317,21 @@ class LoLLMsWebUI(LoLLMsAPPI):
         self.add_endpoint(
             "/vram_usage", "vram_usage", self.vram_usage, methods=["GET"]
         )
+        self.add_endpoint(
+            "/get_resources_usage", "get_resources_usage", self.get_resources_usage, methods=["GET"]
+        )
+        self.add_endpoint(
+            "/get_model_pool", "get_model_pool", self.get_model_pool, methods=["GET"]
+        )
+        self.add_endpoint(
+            "/get_emit_queues", "get_emit_queues", self.get_emit_queues, methods=["GET"]
+        )
+        self.add_endpoint(
+            "/get_speculative_decoding_stats", "get_speculative_decoding_stats", self.get_speculative_decoding_stats, methods=["GET"]
+        )
+        self.add_endpoint(
+            "/get_generation_telemetry", "get_generation_telemetry", self.get_generation_telemetry, methods=["GET"]
+        )
 
 
         self.add_endpoint(
@@ -378,6 +451,23 @@ class LoLLMsWebUI(LoLLMsAPPI):
         self.add_endpoint(
             "/get_generation_status", "get_generation_status", self.get_generation_status, methods=["GET"]
         )
+
+        self.add_endpoint(
+            "/generate_completion", "generate_completion", self.generate_completion, methods=["POST"]
+        )
+        self.add_endpoint(
+            "/start_batch_generation", "start_batch_generation", self.start_batch_generation, methods=["POST"]
+        )
+        self.add_endpoint(
+            "/get_batch_generation_status", "get_batch_generation_status", self.get_batch_generation_status, methods=["GET"]
+        )
+        self.add_endpoint(
+            "/cancel_batch_generation", "cancel_batch_generation", self.cancel_batch_generation, methods=["POST"]
+        )
+
+        self.add_endpoint(
+            "/ready", "ready", self.ready, methods=["GET"]
+        )
         
         self.add_endpoint(
             "/update_setting", "update_setting", self.update_setting, methods=["POST"]
@@ -448,126 +538,39 @@ class LoLLMsWebUI(LoLLMsAPPI):
         return jsonify({"personality":self.personality.as_dict()})
     
     def get_all_personalities(self):
-        personalities_folder = self.lollms_paths.personalities_zoo_path
-        personalities = {}
-        for language_folder in personalities_folder.iterdir():
-            lang = language_folder.stem
-            if language_folder.is_dir() and not language_folder.stem.startswith('.'):
-                personalities[language_folder.name] = {}
-                for category_folder in  language_folder.iterdir():
-                    cat = category_folder.stem
-                    if category_folder.is_dir() and not category_folder.stem.startswith('.'):
-                        personalities[language_folder.name][category_folder.name] = []
-                        for personality_folder in category_folder.iterdir():
-                            pers = personality_folder.stem
-                            if personality_folder.is_dir() and not personality_folder.stem.startswith('.'):
-                                personality_info = {"folder":personality_folder.stem}
-                                config_path = personality_folder / 'config.yaml'
-                                if not config_path.exists():
-                                    """
-                                    try:
-                                        shutil.rmtree(str(config_path.parent))
-                                        ASCIIColors.warning(f"Deleted useless personality: {config_path.parent}")
-                                    except Exception as ex:
-                                        ASCIIColors.warning(f"Couldn't delete personality ({ex})")
-                                    """
-                                    continue                                    
-                                try:
-                                    scripts_path = personality_folder / 'scripts'
-                                    personality_info['has_scripts'] = scripts_path.is_dir()
-                                    with open(config_path) as config_file:
-                                        config_data = yaml.load(config_file, Loader=yaml.FullLoader)
-                                        personality_info['name'] = config_data.get('name',"No Name")
-                                        personality_info['description'] = config_data.get('personality_description',"")
-                                        personality_info['author'] = config_data.get('author', 'ParisNeo')
-                                        personality_info['version'] = config_data.get('version', '1.0.0')
-                                        personality_info['installed'] = (self.lollms_paths.personal_configuration_path/f"personality_{personality_folder.stem}.yaml").exists() or personality_info['has_scripts']
-                                        personality_info['help'] = config_data.get('help', '')
-                                        personality_info['commands'] = config_data.get('commands', '')
-                                    real_assets_path = personality_folder/ 'assets'
-                                    assets_path = Path("personalities") / lang / cat / pers / 'assets'
-                                    gif_logo_path = assets_path / 'logo.gif'
-                                    webp_logo_path = assets_path / 'logo.webp'
-                                    png_logo_path = assets_path / 'logo.png'
-                                    jpg_logo_path = assets_path / 'logo.jpg'
-                                    jpeg_logo_path = assets_path / 'logo.jpeg'
-                                    bmp_logo_path = assets_path / 'logo.bmp'
-
-                                    gif_logo_path_ = real_assets_path / 'logo.gif'
-                                    webp_logo_path_ = real_assets_path / 'logo.webp'
-                                    png_logo_path_ = real_assets_path / 'logo.png'
-                                    jpg_logo_path_ = real_assets_path / 'logo.jpg'
-                                    jpeg_logo_path_ = real_assets_path / 'logo.jpeg'
-                                    bmp_logo_path_ = real_assets_path / 'logo.bmp'
-
-                                    personality_info['has_logo'] = png_logo_path.is_file() or gif_logo_path.is_file()
-                                    
-                                    if gif_logo_path_.exists():
-                                        personality_info['avatar'] = str(gif_logo_path).replace("\\","/")
-                                    elif webp_logo_path_.exists():
-                                        personality_info['avatar'] = str(webp_logo_path).replace("\\","/")
-                                    elif png_logo_path_.exists():
-                                        personality_info['avatar'] = str(png_logo_path).replace("\\","/")
-                                    elif jpg_logo_path_.exists():
-                                        personality_info['avatar'] = str(jpg_logo_path).replace("\\","/")
-                                    elif jpeg_logo_path_.exists():
-                                        personality_info['avatar'] = str(jpeg_logo_path).replace("\\","/")
-                                    elif bmp_logo_path_.exists():
-                                        personality_info['avatar'] = str(bmp_logo_path).replace("\\","/")
-                                    else:
-                                        personality_info['avatar'] = ""
-                                    personalities[language_folder.name][category_folder.name].append(personality_info)
-                                except Exception as ex:
-                                    print(f"Couldn't load personality from {personality_folder} [{ex}]")
-        return json.dumps(personalities)
+        return json.dumps(self.personalities_catalog.as_dict())
     
     def get_personality(self):
         lang = request.args.get('language')
         category = request.args.get('category')
         name = request.args.get('name')
         if category!="personal":
-            personality_folder = self.lollms_paths.personalities_zoo_path/f"{lang}"/f"{category}"/f"{name}"
+            catalog = self.personalities_catalog
         else:
-            personality_folder = self.lollms_paths.personal_personalities_path/f"{lang}"/f"{category}"/f"{name}"
-        personality_path = personality_folder/f"config.yaml"
-        personality_info = {}
-        with open(personality_path) as config_file:
-            config_data = yaml.load(config_file, Loader=yaml.FullLoader)
-            personality_info['name'] = config_data.get('name',"unnamed")
-            personality_info['description'] = config_data.get('personality_description',"")
-            personality_info['author'] = config_data.get('creator', 'ParisNeo')
-            personality_info['version'] = config_data.get('version', '1.0.0')
-        scripts_path = personality_folder / 'scripts'
-        personality_info['has_scripts'] = scripts_path.is_dir()
-        assets_path = personality_folder / 'assets'
-        gif_logo_path = assets_path / 'logo.gif'
-        webp_logo_path = assets_path / 'logo.webp'
-        png_logo_path = assets_path / 'logo.png'
-        jpg_logo_path = assets_path / 'logo.jpg'
-        jpeg_logo_path = assets_path / 'logo.jpeg'
-        bmp_logo_path = assets_path / 'logo.bmp'
-        
-        personality_info['has_logo'] = png_logo_path.is_file() or gif_logo_path.is_file()
-        
-        if gif_logo_path.exists():
-            personality_info['avatar'] = str(gif_logo_path).replace("\\","/")
-        elif webp_logo_path.exists():
-            personality_info['avatar'] = str(webp_logo_path).replace("\\","/")
-        elif png_logo_path.exists():
-            personality_info['avatar'] = str(png_logo_path).replace("\\","/")
-        elif jpg_logo_path.exists():
-            personality_info['avatar'] = str(jpg_logo_path).replace("\\","/")
-        elif jpeg_logo_path.exists():
-            personality_info['avatar'] = str(jpeg_logo_path).replace("\\","/")
-        elif bmp_logo_path.exists():
-            personality_info['avatar'] = str(bmp_logo_path).replace("\\","/")
-        else:
-            personality_info['avatar'] = ""
+            catalog = self.personal_personalities_catalog
+        infos = catalog.get(lang, category, name)
+        if infos is None:
+            return jsonify({"status": False, "error":f"Personality not found @ {lang}/{category}/{name}"})
+        personality_info = {
+            'name':         infos["name"] if infos["name"]!="No Name" else "unnamed",
+            'description':  infos["description"],
+            'author':       infos["creator"],
+            'version':      infos["version"],
+            'has_scripts':  infos["has_scripts"],
+            'has_logo':     infos["has_logo"],
+            'avatar':       str(catalog.zoo_path/lang/category/name/"assets"/infos["logo"]).replace("\\","/") if infos["logo"] is not None else ""
+        }
         return json.dumps(personality_info)
         
     # Settings (data: {"setting_name":<the setting name>,"setting_value":<the setting value>})
     def update_setting(self):
-        data = request.get_json()
+        try:
+            return self.set_setting(request.get_json())
+        finally:
+            # After the change, so that no answer built with the previous value is kept
+            self.response_cache.bump()
+
+    def set_setting(self, data):
         setting_name = data['setting_name']
 
         if setting_name== "temperature":
@@ -588,7 +591,18 @@ class LoLLMsWebUI(LoLLMsAPPI):
             self.config["n_threads"]=int(data['setting_value'])
         elif setting_name== "ctx_size":
             self.config["ctx_size"]=int(data['setting_value'])
+        elif setting_name== "max_concurrent_generations":
+            self.config["max_concurrent_generations"]=int(data['setting_value'])
+            self.generation_scheduler.set_max_concurrency(self.config["max_concurrent_generations"])
 
+        elif setting_name== "model_pool_max_memory_mb":
+            self.config["model_pool_max_memory_mb"]=int(data['setting_value'])
+            self.model_pool.max_memory = self.config["model_pool_max_memory_mb"]*1024*1024
+            self.model_pool.evict(keep=[(self.config["binding_name"], self.config["model_name"])])
+
+        elif setting_name in ["speculative_decoding", "speculative_draft_binding", "speculative_draft_model"]:
+            self.config[setting_name]=data['setting_value']
+            self.load_speculative_decoder()
 
         elif setting_name== "language":
             self.config["language"]=data['setting_value']
@@ -616,8 +630,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
             self.config["model_name"]=data['setting_value']
             if self.config["model_name"] is not None:
                 try:
-                    self.model = self.binding.build_model()
-                    self.rebuild_personalities(reload_all=True)
+                    self.activate_model()
                 except Exception as ex:
                     # Catch the exception and get the traceback as a list of strings
                     traceback_lines = traceback.format_exception(type(ex), ex, ex.__traceback__)
@@ -636,15 +649,13 @@ class LoLLMsWebUI(LoLLMsAPPI):
                 print(f"New binding selected : {data['setting_value']}")
                 self.config["binding_name"]=data['setting_value']
                 try:
-                    if self.binding:
-                        self.binding.destroy_model()
-
+                    # The previous models stay loaded as long as they fit in the model pool
                     self.binding = None
                     self.model = None
                     for per in self.mounted_personalities:
                         per.model = None
-                    gc.collect()
-                    self.binding = BindingBuilder().build_binding(self.config, self.lollms_paths)
+                    self.model_pool.evict()
+                    self.build_binding()
                     self.model = None
                     self.config.save_config()
                 except Exception as ex:
@@ -680,93 +691,102 @@ class LoLLMsWebUI(LoLLMsAPPI):
     
 
     
+    def emit_resources_usage(self, sample):
+        # Connection 0 is the http client
+        if len(self.connections)>1:
+            self.socketio.emit('resources_usage', sample)
+
+    def resource_usage_response(self, resource):
+        """
+        Returns the last sample of resource, with the last n samples in history when the history=n query parameter is given
+        """
+        if self.config["resources_sampling_interval"]<=0:
+            # No sampler running
+            self.resource_sampler.sample()
+        result = dict(self.resource_sampler.latest(resource))
+        history = int(request.args.get('history', 0))
+        if history>0:
+            result["history"] = self.resource_sampler.history(history, resource)
+        return jsonify(result)
+
     def ram_usage(self):
         """
         Returns the RAM usage in bytes.
         """
-        ram = psutil.virtual_memory()
-        return jsonify({
-            "total_space":ram.total,
-            "available_space":ram.free,
+        return self.resource_usage_response("ram")
 
-            "percent_usage":ram.percent,
-            "ram_usage": ram.used
-            })
+    def get_resources_usage(self):
+        """
+        Returns the last sample of every resource (ram, cpu, disk, process, vram), and the last n samples with history=n
+        """
+        if self.config["resources_sampling_interval"]<=0:
+            self.resource_sampler.sample()
+        result = {"sample": self.resource_sampler.latest()}
+        history = int(request.args.get('history', 0))
+        if history>0:
+            result["history"] = self.resource_sampler.history(history)
+        return jsonify(result)
+
+    def get_model_pool(self):
+        """
+        Returns the models kept loaded in the model pool and their estimated memory usage in bytes.
+        """
+        return jsonify(self.model_pool.get_status())
+
+    def get_emit_queues(self):
+        """
+        Returns the outbound event queues by room: events waiting (depth), largest depth, events sent and chunks merged.
+        """
+        return jsonify(self.emit_queues.get_status())
+
+    def get_speculative_decoding_stats(self):
+        """
+        Returns the acceptance rate and estimated speedup of the last speculative generation.
+        """
+        if self.speculative_decoder is None or self.speculative_decoder.last_stats is None:
+            return jsonify({"status":False})
+        return jsonify({"status":True, **self.speculative_decoder.last_stats})
+
+    def get_generation_telemetry(self):
+        """
+        Returns the percentiles of the generation measures, optionally filtered by binding and model.
+        history=n adds the last n records.
+        """
+        binding_name = request.args.get('binding')
+        model_name = request.args.get('model')
+        history = int(request.args.get('history', 0))
+        result = {"stats": self.telemetry.get_stats(binding_name, model_name)}
+        if history>0:
+            result["records"] = self.telemetry.get_records(binding_name, model_name, history)
+        return jsonify(result)
 
     def vram_usage(self) -> Optional[dict]:
-        try:
-            output = subprocess.check_output(['nvidia-smi', '--query-gpu=memory.total,memory.used,gpu_name', '--format=csv,nounits,noheader'])
-            lines = output.decode().strip().split('\n')
-            vram_info = [line.split(',') for line in lines]
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return {
-            "nb_gpus": 0
-            }
-        
-        ram_usage = {
-            "nb_gpus": len(vram_info)
-        }
-        
-        if vram_info is not None:
-            for i, gpu in enumerate(vram_info):
-                ram_usage[f"gpu_{i}_total_vram"] = int(gpu[0])*1024*1024
-                ram_usage[f"gpu_{i}_used_vram"] = int(gpu[1])*1024*1024
-                ram_usage[f"gpu_{i}_model"] = gpu[2].strip()
-        else:
-            # Set all VRAM-related entries to None
-            ram_usage["gpu_0_total_vram"] = None
-            ram_usage["gpu_0_used_vram"] = None
-            ram_usage["gpu_0_model"] = None
-        
-        return jsonify(ram_usage)
+        return self.resource_usage_response("vram")
 
     def disk_usage(self):
-        current_drive = Path.cwd().anchor
-        drive_disk_usage = psutil.disk_usage(current_drive)
-        try:
-            models_folder_disk_usage = psutil.disk_usage(str(self.lollms_paths.personal_models_path/f'{self.config["binding_name"]}'))
-            return jsonify( {
-                "total_space":drive_disk_usage.total,
-                "available_space":drive_disk_usage.free,
-                "usage":drive_disk_usage.used,
-                "percent_usage":drive_disk_usage.percent,
-
-                "binding_disk_total_space":models_folder_disk_usage.total,
-                "binding_disk_available_space":drive_disk_usage.free,
-                "binding_models_usage": models_folder_disk_usage.used,
-                "binding_models_percent_usage": models_folder_disk_usage.percent,
-                })
-        except Exception as ex:
-            return jsonify({
-                "total_space":drive_disk_usage.total,
-                "available_space":drive_disk_usage.free,
-                "percent_usage":drive_disk_usage.percent,
-
-                "binding_disk_total_space": None,
-                "binding_disk_available_space": None,
-                "binding_models_usage": None,
-                "binding_models_percent_usage": None,
-                })
+        return self.resource_usage_response("disk")
+
+    def catalog_response(self, entries, fields):
+        """
+        Filters the entries of a catalog with the name, type, license and installed query parameters,
+        and returns the page selected by offset and limit with the number of matching entries in X-Total-Count
+        """
+        installed = request.args.get("installed")
+        entries = filter_catalog(
+                        entries,
+                        name        = request.args.get("name"),
+                        type        = request.args.get("type"),
+                        license     = request.args.get("license"),
+                        installed   = installed.lower() in ["1", "true", "yes"] if installed is not None else None,
+                        fields      = fields
+                    )
+        limit = request.args.get("limit")
+        response = jsonify(paginate(entries, int(request.args.get("offset", 0)), int(limit) if limit is not None else None))
+        response.headers["X-Total-Count"] = str(len(entries))
+        return response
 
     def list_bindings(self):
-        bindings_dir = self.lollms_paths.bindings_zoo_path  # replace with the actual path to the models folder
-        bindings=[]
-        for f in bindings_dir.iterdir():
-            card = f/"binding_card.yaml"
-            if card.exists():
-                try:
-                    bnd = load_config(card)
-                    bnd["folder"]=f.stem
-                    icon_path = Path(f"bindings/{f.name}/logo.png")
-                    installed = (self.lollms_paths.personal_configuration_path/f"binding_{f.stem}.yaml").exists()
-                    bnd["installed"]=installed
-                    if Path(self.lollms_paths.bindings_zoo_path/f"{f.name}/logo.png").exists():
-                        bnd["icon"]=str(icon_path)
-
-                    bindings.append(bnd)
-                except Exception as ex:
-                    print(f"Couldn't load backend card : {f}\n\t{ex}")
-        return jsonify(bindings)
+        return self.catalog_response(self.bindings_catalog.list(), BINDING_FIELDS)
 
     def list_extensions(self):
         return jsonify([])
@@ -775,25 +795,24 @@ class LoLLMsWebUI(LoLLMsAPPI):
 
     def list_models(self):
         if self.binding is not None:
-            models = self.binding.list_models(self.config)
             ASCIIColors.yellow("Listing models")
-            return jsonify(models)
+            # The models of the binding are the files of its models folder
+            models_folder = self.lollms_paths.personal_models_path/self.config["binding_name"]
+            return self.response_cache.respond("list_models", lambda: self.binding.list_models(self.config), (id(self.binding), catalog_mtime(models_folder)))
         else:
             return jsonify([])
     
 
     def list_personalities_languages(self):
-        personalities_languages_dir = self.lollms_paths.personalities_zoo_path  # replace with the actual path to the models folder
-        personalities_languages = [f.stem for f in personalities_languages_dir.iterdir() if f.is_dir() and not f.name.startswith(".")]
-        return jsonify(personalities_languages)
+        self.personalities_catalog.refresh()
+        return self.response_cache.respond("list_personalities_languages", self.personalities_catalog.languages, self.personalities_catalog.version)
 
     def list_personalities_categories(self):
         language = request.args.get('language')
         if language is None:
             language = 'english'
-        personalities_categories_dir = self.lollms_paths.personalities_zoo_path/f'{language}'  # replace with the actual path to the models folder
-        personalities_categories = [f.stem for f in personalities_categories_dir.iterdir() if f.is_dir() and not f.name.startswith(".")]
-        return jsonify(personalities_categories)
+        self.personalities_catalog.refresh()
+        return self.response_cache.respond(("list_personalities_categories", language), lambda: self.personalities_catalog.categories(language), self.personalities_catalog.version)
     
     def list_personalities(self):
         language = request.args.get('language')
@@ -802,14 +821,11 @@ class LoLLMsWebUI(LoLLMsAPPI):
         category = request.args.get('category')
         if not category:
             return jsonify([])
-            
-        try:
-            personalities_dir = self.lollms_paths.personalities_zoo_path/f'{language}/{category}'  # replace with the actual path to the models folder
-            personalities = [f.stem for f in personalities_dir.iterdir() if f.is_dir() and not f.name.startswith(".")]
-        except Exception as ex:
-            personalities=[]
-            ASCIIColors.error(f"No personalities found. Using default one {ex}")
-        return jsonify(personalities)
+        self.personalities_catalog.refresh()
+        personalities = self.personalities_catalog.personalities(language, category)
+        if len(personalities)==0:
+            ASCIIColors.error(f"No personalities found in {language}/{category}")
+        return self.response_cache.respond(("list_personalities", language, category), lambda: personalities, self.personalities_catalog.version)
 
     def list_languages(self):
         lanuguages= [
@@ -821,7 +837,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
         { "value": "nl-XX", "label": "Dutch" },
         { "value": "zh-CN", "label": "中國人" }
         ]
-        return jsonify(lanuguages)
+        return self.response_cache.respond("list_languages", lambda: lanuguages)
 
 
     def list_discussions(self):
@@ -857,71 +873,31 @@ class LoLLMsWebUI(LoLLMsAPPI):
         return render_template("index.html")
     
     def serve_static(self, filename):
-        root_dir = os.getcwd()
-        path = os.path.join(root_dir, 'web/dist/')+"/".join(filename.split("/")[:-1])                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.web_dist_path, filename, immutable=True)
 
-    
     def serve_images(self, filename):
-        root_dir = os.getcwd()
-        path = os.path.join(root_dir, 'images/')+"/".join(filename.split("/")[:-1])
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.images_path, filename)
     
     def serve_bindings(self, filename):
-        path = str(self.lollms_paths.bindings_zoo_path/("/".join(filename.split("/")[:-1])))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.lollms_paths.bindings_zoo_path, filename)
 
     def serve_user_infos(self, filename):
-        path = str(self.lollms_paths.personal_user_infos_path/("/".join(filename.split("/")[:-1])))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
-
-
+        return self.static_files.serve(self.lollms_paths.personal_user_infos_path, filename)
 
     def serve_personalities(self, filename):
-        path = str(self.lollms_paths.personalities_zoo_path/("/".join(filename.split("/")[:-1])))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.lollms_paths.personalities_zoo_path, filename)
 
     def serve_outputs(self, filename):
-        root_dir = self.lollms_paths.personal_path / "outputs"
-        root_dir.mkdir(exist_ok=True, parents=True)
-        path = str(root_dir/"/".join(filename.split("/")[:-1]))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.lollms_paths.personal_path/"outputs", filename)
 
     def serve_help(self, filename):
-        root_dir = Path(__file__).parent/f"help"
-        root_dir.mkdir(exist_ok=True, parents=True)
-        path = str(root_dir/"/".join(filename.split("/")[:-1]))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.help_path, filename)
 
     def serve_data(self, filename):
-        root_dir = self.lollms_paths.personal_path / "data"
-        root_dir.mkdir(exist_ok=True, parents=True)
-        path = str(root_dir/"/".join(filename.split("/")[:-1]))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.lollms_paths.personal_path/"data", filename)
 
     def serve_uploads(self, filename):
-        root_dir = self.lollms_paths.personal_path / "uploads"
-        root_dir.mkdir(exist_ok=True, parents=True)
-
-        path = str(root_dir/"/".join(filename.split("/")[:-1]))
-                            
-        fn = filename.split("/")[-1]
-        return send_from_directory(path, fn)
+        return self.static_files.serve(self.lollms_paths.personal_path/"uploads", filename)
 
 
 
@@ -935,10 +911,159 @@ class LoLLMsWebUI(LoLLMsAPPI):
             
     def get_generation_status(self):
         return jsonify({"status":not self.is_ready}) 
+
+    def ready(self):
+        """
+        Returns the loading status of the binding and the model, with a 503 code until they are loaded or when loading failed.
+        """
+        return jsonify(self.loading_status), 200 if self.model_loaded.is_set() and self.loading_status["status"]!="failed" else 503
     
+    def generate_completion(self):
+        """
+        Stateless completion: answers a prompt with a mounted personality through the generation scheduler,
+        without creating discussions or messages. Streams Server-Sent Events (format "sse", the default)
+        or one JSON object per line (format "json"), or returns the whole answer when stream is false.
+        """
+        data = request.get_json()
+        if data is None or "prompt" not in data:
+            return jsonify({"status":False, "error":"No prompt provided"}), 400
+        personality = self.personality
+        if data.get("personality"):
+            personality = self.find_mounted_personality(data["personality"])
+            if personality is None:
+                return jsonify({"status":False, "error":f"Personality {data['personality']} is not mounted"}), 400
+        parameters = {k:data[k] for k in ["n_predict", "temperature", "top_k", "top_p", "repeat_penalty", "repeat_last_n", "seed"] if k in data}
+        stream = data.get("stream", True)
+        sse = data.get("format", "sse") == "sse"
+
+        events = queue.Queue()
+        cancel_token = CancellationToken()
+        def run_completion():
+            try:
+                text = self.complete(data["prompt"], callback=lambda chunk: events.put(("chunk", chunk)), personality=personality, cancel_token=cancel_token, **parameters)
+                events.put(("done", text))
+            except Exception as ex:
+                trace_exception(ex)
+                events.put(("error", str(ex)))
+
+        job = self.generation_scheduler.submit(
+                                        f"http:{request.remote_addr}",
+                                        run_completion,
+                                        priority        = PRIORITY_INTERACTIVE,
+                                        binding_name    = self.config["binding_name"],
+                                        cancel_token    = cancel_token
+                                    )
+        if job is None:
+            return jsonify({"status":False, "error":"Too many generation requests are waiting. Please try again later."}), 503
+
+        def next_event():
+            while True:
+                try:
+                    return events.get(timeout=0.5)
+                except queue.Empty:
+                    # Canceled before being run
+                    if job.done.is_set() and events.empty():
+                        return ("error", "Generation canceled")
+
+        if not stream:
+            while True:
+                kind, value = next_event()
+                if kind == "done":
+                    return jsonify({"status":True, "text":value})
+                elif kind == "error":
+                    return jsonify({"status":False, "error":value}), 500
+
+        def format_event(event, content):
+            if sse:
+                return f"event: {event}\ndata: {json.dumps(content)}\n\n"
+            return json.dumps({"event":event, **content})+"\n"
+
+        def generate_events():
+            finished = False
+            try:
+                while not finished:
+                    kind, value = next_event()
+                    if kind == "chunk":
+                        yield format_event("chunk", {"chunk":value})
+                    else:
+                        finished = True
+                        yield format_event(kind, {"text":value} if kind=="done" else {"error":value})
+            finally:
+                # The client went away before the end of the generation
+                if not finished:
+                    self.generation_scheduler.cancel(job_id=job.id)
+
+        return Response(generate_events(), mimetype="text/event-stream" if sse else "application/x-ndjson")
+
+    def create_batch_runner(self, input_path, output_path, personality_name=None, parameters=None):
+        """
+        Builds a batch runner answering the prompts of input_path with a mounted personality (the active one by default).
+        Relative paths are taken from the batches folder of the personal folder.
+        """
+        batches_folder = self.lollms_paths.personal_path/"batches"
+        input_path = Path(input_path) if Path(input_path).is_absolute() else batches_folder/input_path
+        output_path = Path(output_path) if Path(output_path).is_absolute() else batches_folder/output_path
+        if not input_path.exists():
+            raise FileNotFoundError(f"Input file {input_path} not found")
+        personality = self.personality
+        if personality_name:
+            personality = self.find_mounted_personality(personality_name)
+            if personality is None:
+                raise ValueError(f"Personality {personality_name} is not mounted")
+        return BatchRunner(
+                    self.generation_scheduler,
+                    self.complete,
+                    input_path,
+                    output_path,
+                    personality     = personality,
+                    parameters      = parameters,
+                    max_in_flight   = self.config["max_batch_size"] if supports_batching(self.model) else 1,
+                    binding_name    = self.config["binding_name"],
+                    name            = input_path.stem
+                )
+
+    def start_batch_generation(self):
+        data = request.get_json()
+        if self.batch_runner is not None and self.batch_runner.status=="running":
+            return jsonify({"status":False, "error":"A batch generation is already running"})
+        try:
+            self.batch_runner = self.create_batch_runner(
+                                    data["input_path"],
+                                    data["output_path"],
+                                    data.get("personality"),
+                                    {k:data[k] for k in BatchRunner.PARAMETERS if k in data}
+                                )
+        except Exception as ex:
+            return jsonify({"status":False, "error":str(ex)})
+        self.socketio.start_background_task(self.batch_runner.run)
+        return jsonify({"status":True})
+
+    def get_batch_generation_status(self):
+        if self.batch_runner is None:
+            return jsonify({"status":"idle"})
+        return jsonify(self.batch_runner.get_status())
+
+    def cancel_batch_generation(self):
+        if self.batch_runner is not None:
+            self.batch_runner.cancel()
+        return jsonify({"status":True})
+
     def stop_gen(self):
-        self.cancel_gen = True
-        return jsonify({"status": True})    
+        """
+        Stops the running generations of the caller, given by ?client_id=<socket id>
+        or ?session=<session id> (every connection of the session).
+        Other clients, background summaries and batch runs are not affected.
+        """
+        if request.args.get("session"):
+            client_ids = self.get_session_clients(request.args["session"])
+        elif request.args.get("client_id"):
+            client_ids = [request.args["client_id"]]
+        else:
+            return jsonify({"status": False, "error": "No client_id or session provided"}), 400
+        canceled = []
+        for client_id in client_ids:
+            canceled += self.generation_scheduler.cancel(client_id=client_id, queued=False)
+        return jsonify({"status": True, "canceled": len(canceled)})    
     
 
     def switch_personal_path(self):
@@ -964,13 +1089,14 @@ class LoLLMsWebUI(LoLLMsAPPI):
         path = Path(data["path"])
         if path.exists():
             self.config.reference_model(path)
+            self.response_cache.bump()
             return jsonify({"status": True})         
         else:        
             return jsonify({"status": False, "error":"Model not found"})         
 
     def list_mounted_personalities(self):
         ASCIIColors.yellow("- Listing mounted personalities")
-        return jsonify({"status": True,
+        return self.response_cache.respond("list_mounted_personalities", lambda: {"status": True,
                         "personalities":self.config["personalities"],
                         "active_personality_id":self.config["active_personality_id"]
                         })         
@@ -1029,7 +1155,9 @@ class LoLLMsWebUI(LoLLMsAPPI):
             except Exception as ex:
                 ASCIIColors.error(f"Personality file not found or is corrupted ({data['name']}).\nReturned the following exception:{ex}\nPlease verify that the personality you have selected exists or select another personality. Some updates may lead to change in personality name or category, so check the personality selection in settings to be sure.")
                 ASCIIColors.info("Trying to force reinstall")
-                return jsonify({"status":False, 'error':str(e)})
+                return jsonify({"status":False, 'error':str(ex)})
+            finally:
+                self.response_cache.bump()
 
         except Exception as e:
             return jsonify({"status":False, 'error':str(e)})
@@ -1044,13 +1172,14 @@ class LoLLMsWebUI(LoLLMsAPPI):
         ASCIIColors.info(f"- Reinstalling binding {data['name']}...")
         try:
             ASCIIColors.info("Unmounting binding and model")
+            self.model_pool.remove(self.config["binding_name"])
             self.binding = None
             self.model = None
             for per in self.mounted_personalities:
                 per.model = None
             gc.collect()
             ASCIIColors.info("Reinstalling binding")
-            self.binding =  BindingBuilder().build_binding(self.config, self.lollms_paths, InstallOption.FORCE_INSTALL)
+            self.build_binding(InstallOption.FORCE_INSTALL)
             ASCIIColors.success("Binding reinstalled successfully")
 
             ASCIIColors.info("Please select a model")
@@ -1183,18 +1312,19 @@ class LoLLMsWebUI(LoLLMsAPPI):
         ASCIIColors.info(f"- Reloading binding {data['name']}...")
         try:
             ASCIIColors.info("Unmounting binding and model")
+            self.model_pool.remove(self.config["binding_name"])
             self.binding = None
             self.model = None
             for personality in self.mounted_personalities:
                 personality.model = None
             gc.collect()
             ASCIIColors.info("Reloading binding")
-            self.binding =  BindingBuilder().build_binding(self.config, self.lollms_paths)
+            self.build_binding()
             ASCIIColors.info("Binding loaded successfully")
 
             try:
                 ASCIIColors.info("Reloading model")
-                self.model = self.binding.build_model()
+                self.activate_model()
                 ASCIIColors.info("Model reloaded successfully")
             except Exception as ex:
                 print(f"Couldn't build model: [{ex}]")
@@ -1225,7 +1355,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
         package_path = f"{language}/{category}/{name}"
         package_full_path = self.lollms_paths.personalities_zoo_path/package_path
         config_file = package_full_path / "config.yaml"
-        if config_file.exists():
+        if self.personalities_catalog.get(language, category, name) is not None:
             self.config["personalities"].append(package_path)
             self.mounted_personalities = self.rebuild_personalities()
             self.personality = self.mounted_personalities[self.config["active_personality_id"]]
@@ -1344,13 +1474,14 @@ class LoLLMsWebUI(LoLLMsAPPI):
                             entry["value"] = [entry["value"]]
                 self.binding.binding_config.update_template(data)
                 self.binding.binding_config.config.save_config()
+                self.model_pool.remove(self.config["binding_name"])
                 self.binding = None
                 self.model = None
                 for per in self.mounted_personalities:
                     per.model = None
                 gc.collect()
-                self.binding= BindingBuilder().build_binding(self.config, self.lollms_paths)
-                self.model = self.binding.build_model()
+                self.build_binding()
+                self.activate_model()
                 return jsonify({'status':True})
             else:
                 return jsonify({'status':False})        
@@ -1459,6 +1590,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
         self.connections[client_id]["current_discussion"] = Discussion(discussion_id, self.db)
         self.connections[client_id]["current_discussion"].delete_discussion()
         self.connections[client_id]["current_discussion"] = None
+        self.delete_context_index(discussion_id)
         return jsonify({'status':True})
 
     def edit_message(self):
@@ -1514,12 +1646,14 @@ class LoLLMsWebUI(LoLLMsAPPI):
             print("New binding selected")
             
             self.config['binding_name'] = binding
+            self.response_cache.bump()
             try:
                 binding_ =self.process.load_binding(config["binding_name"],True)
                 models = binding_.list_models(self.config)
                 if len(models)>0:      
                     self.binding = binding_
                     self.config['model_name'] = models[0]
+                    self.response_cache.bump()
                     # Build chatbot
                     return jsonify(self.process.set_config(self.config))
                 else:
@@ -1535,6 +1669,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
         if self.config['model_name']!= model:
             print("set_model: New model selected")            
             self.config['model_name'] = model
+            self.response_cache.bump()
             # Build chatbot            
             return jsonify(self.process.set_config(self.config))
 
@@ -1549,47 +1684,8 @@ class LoLLMsWebUI(LoLLMsAPPI):
         """
         if self.binding is None:
             return jsonify([])
-        model_list = self.binding.get_available_models()
-
-        models = []
         ASCIIColors.yellow("Recovering available models")
-        for model in model_list:
-            try:
-                filename = model.get('filename',"")
-                server = model.get('server',"")
-                variants = model.get('variants',[])
-                image_url = model.get("icon", '/images/default_model.png')
-                license = model.get("license", 'unknown')
-                owner = model.get("owner", 'unknown')
-                owner_link = model.get("owner_link", 'https://github.com/ParisNeo')
-                filesize = int(model.get('filesize',0))
-                description = model.get('description',"")
-                model_type = model.get("model_type","")
-                if server.endswith("/"):
-                    path = f'{server}{filename}'
-                else:
-                    path = f'{server}/{filename}'
-                local_path = lollms_paths.personal_models_path/f'{self.config["binding_name"]}/{filename}'
-                is_installed = local_path.exists() or model_type.lower()=="api"
-                models.append({
-                    'title': filename,
-                    'variants': variants,
-                    'icon': image_url,  # Replace with the path to the model icon
-                    'license': license,
-                    'owner': owner,
-                    'owner_link': owner_link,
-                    'description': description,
-                    'isInstalled': is_installed,
-                    'path': path,
-                    'filesize': filesize,
-                    'model_type': model_type
-                })
-            except Exception as ex:
-                print("#################################")
-                print(ex)
-                print("#################################")
-                print(f"Problem with model : {model}")
-        return jsonify(models)
+        return self.catalog_response(self.models_catalog.list(self.binding, self.config["binding_name"]), MODEL_FIELDS)
 
 
     def train(self):
@@ -1619,7 +1715,7 @@ class LoLLMsWebUI(LoLLMsAPPI):
         return jsonify({'message': 'Training started'})
     
     def get_config(self):
-        return jsonify(self.config.to_dict())
+        return self.response_cache.respond("get_config", self.config.to_dict)
     
     def get_current_personality_path_infos(self):
         if self.personality is None:
@@ -1752,6 +1848,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--db_path", type=str, default=None, help="Database path"
     )
+    parser.add_argument(
+        "--server_mode", type=str, default=None, choices=SERVER_MODES, help="Serves with the threading development server, or with gevent or eventlet for many concurrent clients"
+    )
+    parser.add_argument(
+        "--batch_input", type=str, default=None, help="Answers the prompts of this JSONL file then exits instead of starting the server"
+    )
+    parser.add_argument(
+        "--batch_output", type=str, default=None, help="JSONL file receiving the batch answers (resumed if it exists)"
+    )
+    parser.add_argument(
+        "--batch_personality", type=str, default=None, help="Mounted personality answering the batch (language/category/name)"
+    )
     args = parser.parse_args()
 
     # Configuration loading part
@@ -1759,9 +1867,16 @@ if __name__ == "__main__":
     
     # Override values in config with command-line arguments
     for arg_name, arg_value in vars(args).items():
-        if arg_value is not None:
+        if arg_value is not None and not arg_name.startswith("batch_"):
             config[arg_name] = arg_value
 
+    if config["server_mode"]!=server_mode:
+        if args.batch_input is None and config["server_mode"] in SERVER_MODES:
+            # The standard library must be patched before the imports: restart in the configured mode
+            ASCIIColors.info(f"Restarting in {config['server_mode']} server mode")
+            os.execv(sys.executable, [sys.executable]+sys.argv+["--server_mode", config["server_mode"]])
+        config["server_mode"] = server_mode
+
     # Copy user
     # Assuming the current file's directory contains the 'assets' subfolder
     current_file_dir = Path(__file__).parent
@@ -1785,6 +1900,13 @@ if __name__ == "__main__":
     
     bot = LoLLMsWebUI(args, app, socketio, config, config.file_path, lollms_paths)
 
+    if args.batch_input is not None:
+        batch_input = Path(args.batch_input).resolve()
+        batch_output = Path(args.batch_output).resolve() if args.batch_output is not None else batch_input.with_suffix(".answers.jsonl")
+        bot.batch_runner = bot.create_batch_runner(batch_input, batch_output, args.batch_personality)
+        bot.batch_runner.run()
+        sys.exit(0)
+
     # chong Define custom WebSocketHandler with error handling 
     class CustomWebSocketHandler(WebSocketHandler):
         def handle_error(self, environ, start_response, e):
@@ -1810,6 +1932,6 @@ if __name__ == "__main__":
     else:
         print(f"Please open your browser and go to {url} to view the ui")
     
+    ASCIIColors.info(f"Server mode: {server_mode}")
+    # Flask-SocketIO picks the gevent (with gevent-websocket) or eventlet server matching its async mode
     socketio.run(app, host=config["host"], port=config["port"])
-    # http_server = WSGIServer((config["host"], config["port"]), app, handler_class=WebSocketHandler)
-    # http_server.serve_forever()
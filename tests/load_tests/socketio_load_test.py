@@ -0,0 +1,125 @@
+######
+# Project       : lollms-webui
+# File          : socketio_load_test.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Opens many concurrent socket.io clients on the server and measures how many
+# can connect and the latency of an acknowledged event while they are all connected.
+#
+# Against a running server:
+#   python tests/load_tests/socketio_load_test.py --url http://localhost:9600 --clients 100
+# Comparing the server modes (each one is started on --port):
+#   python tests/load_tests/socketio_load_test.py --modes threading gevent eventlet --clients 100
+######
+from pathlib import Path
+import subprocess
+import threading
+import argparse
+import time
+import sys
+
+import requests
+import socketio
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from api.telemetry import percentile
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def run_client(url, n_pings, interval, start_barrier, results):
+    client = socketio.Client(reconnection=False)
+    connected = threading.Event()
+    client.on("connected", lambda *args: connected.set())
+    try:
+        start_barrier.wait()
+        start = time.perf_counter()
+        client.connect(url, wait_timeout=30)
+        if not connected.wait(30):
+            raise TimeoutError("no connected event")
+        results["connect"].append(time.perf_counter()-start)
+        for _ in range(n_pings):
+            start = time.perf_counter()
+            client.call("server_ping", {}, timeout=30)
+            results["ping"].append(time.perf_counter()-start)
+            time.sleep(interval)
+    except Exception as ex:
+        results["errors"].append(str(ex))
+    finally:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+
+def run_load_test(url, n_clients, n_pings, interval):
+    results = {"connect": [], "ping": [], "errors": []}
+    start_barrier = threading.Barrier(n_clients)
+    threads = [threading.Thread(target=run_client, args=(url, n_pings, interval, start_barrier, results), daemon=True) for _ in range(n_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter()-start
+    return {
+        "clients":          n_clients,
+        "connected":        len(results["connect"]),
+        "errors":           len(results["errors"]),
+        "connect_p50_ms":   1000*(percentile(results["connect"], 50) or 0),
+        "connect_p99_ms":   1000*(percentile(results["connect"], 99) or 0),
+        "ping_p50_ms":      1000*(percentile(results["ping"], 50) or 0),
+        "ping_p90_ms":      1000*(percentile(results["ping"], 90) or 0),
+        "ping_p99_ms":      1000*(percentile(results["ping"], 99) or 0),
+        "pings_per_second": len(results["ping"])/duration
+    }
+
+
+def start_server(mode, port, timeout=300):
+    root = Path(__file__).resolve().parents[2]
+    process = subprocess.Popen([sys.executable, "app.py", "--server_mode", mode, "--port", str(port)], cwd=root, stdout=subprocess.DEVNULL)
+    url = f"http://localhost:{port}"
+    deadline = time.time()+timeout
+    while time.time()<deadline:
+        try:
+            # Any answer means that the server is listening, even while the model loads
+            requests.get(url+"/ready", timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(1)
+    process.terminate()
+    raise TimeoutError(f"The server didn't start in {mode} mode")
+
+
+def print_report(name, report):
+    print(f"{name:>10}: {report['connected']}/{report['clients']} connected, {report['errors']} errors, "
+          f"connect p50 {report['connect_p50_ms']:.1f} ms p99 {report['connect_p99_ms']:.1f} ms, "
+          f"ping p50 {report['ping_p50_ms']:.1f} ms p90 {report['ping_p90_ms']:.1f} ms p99 {report['ping_p99_ms']:.1f} ms, "
+          f"{report['pings_per_second']:.0f} pings/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Socket.io load test of the lollms web ui server")
+    parser.add_argument("--url", type=str, default="http://localhost:9600", help="Server to test when --modes is not given")
+    parser.add_argument("--modes", type=str, nargs="*", default=None, help="Server modes to start and compare (threading, gevent, eventlet)")
+    parser.add_argument("--port", type=int, default=9650, help="Port of the servers started for --modes")
+    parser.add_argument("--clients", type=int, default=50, help="Number of concurrent clients")
+    parser.add_argument("--pings", type=int, default=20, help="Number of acknowledged events sent by each client")
+    parser.add_argument("--interval", type=float, default=0.1, help="Time between the events of a client in seconds")
+    args = parser.parse_args()
+
+    if args.modes:
+        for mode in args.modes:
+            process, url = start_server(mode, args.port)
+            try:
+                print_report(mode, run_load_test(url, args.clients, args.pings, args.interval))
+            finally:
+                process.terminate()
+                process.wait()
+    else:
+        print_report(args.url, run_load_test(args.url, args.clients, args.pings, args.interval))
@@ -0,0 +1,64 @@
+######
+# Project       : lollms-webui
+# File          : stream_protocol_benchmark.py
+# Author        : ParisNeo with the help of the community
+# Supported by Nomic-AI
+# license       : Apache 2.0
+# Description   :
+# Measures the bytes sent per token and the server time spent building and
+# encoding each update_message event with the streaming protocols.
+#
+#   python tests/load_tests/stream_protocol_benchmark.py --tokens 20000
+######
+from pathlib import Path
+from datetime import datetime
+import argparse
+import json
+import time
+import sys
+
+from socketio import packet
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from api.streaming import compact_update
+
+__author__ = "parisneo"
+__github__ = "https://github.com/ParisNeo/lollms-webui"
+__copyright__ = "Copyright 2023, "
+__license__ = "Apache 2.0"
+
+
+def json_update(message_id, seq, message_type, chunk, metadata):
+    return {
+        "sender":                   "lollms",
+        'id':                       message_id,
+        'seq':                      seq,
+        'content':                  chunk,
+        'discussion_id':            12,
+        'message_type':             message_type,
+        'finished_generating_at':   datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'metadata':                 json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata
+    }
+
+
+def measure(build, n_tokens, metadata):
+    chunks = [f" token{i%100}" for i in range(n_tokens)]
+    n_bytes = 0
+    start = time.perf_counter()
+    for seq, chunk in enumerate(chunks):
+        encoded = packet.Packet(packet.EVENT, data=["update_message", build(1234, seq+1, 0, chunk, metadata)], namespace="/").encode()
+        n_bytes += sum(len(part) if isinstance(part, bytes) else len(part.encode("utf-8")) for part in (encoded if isinstance(encoded, list) else [encoded]))
+    elapsed = time.perf_counter()-start
+    return n_bytes/n_tokens, 1e6*elapsed/n_tokens
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the streaming protocols of update_message")
+    parser.add_argument("--tokens", type=int, default=20000, help="Number of simulated tokens")
+    args = parser.parse_args()
+
+    for metadata in [None, {}]:
+        print(f"metadata {metadata}")
+        for name, build in [("json", json_update), ("compact", compact_update)]:
+            bytes_per_token, us_per_event = measure(build, args.tokens, metadata)
+            print(f"  {name:>8}: {bytes_per_token:.1f} bytes/token, {us_per_event:.1f} us/event")
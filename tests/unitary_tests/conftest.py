@@ -0,0 +1,124 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from api import LoLLMsAPPI
+from api.db import DiscussionsDB
+
+
+CONFIG_PATH = Path(__file__).resolve().parents[2]/"configs"/"config.yaml"
+
+
+class Config(dict):
+    """The default configuration with the attribute access of LOLLMSConfig"""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self):
+        return dict(self)
+
+
+class FakeSocketIO:
+    """Records the emitted events and runs the background tasks in threads"""
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def emit(self, event, data=None, room=None, **kwargs):
+        with self.lock:
+            self.events.append((time.perf_counter(), event, data, room))
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def start_background_task(self, target, *args, **kwargs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, event):
+        with self.lock:
+            return [(at, data) for at, name, data, _ in self.events if name == event]
+
+
+class FakePersonality:
+    def __init__(self, name, temperature=0.7, processor=None):
+        self.name                       = name
+        self.language                   = "english"
+        self.category                   = "test"
+        self.personality_folder_name    = name
+        self.processor                  = processor
+        self.personality_conditioning   = f"You are {name}."
+        self.user_message_prefix        = "user"
+        self.ai_message_prefix          = f"{name}:"
+        self.model_n_predicts           = 1024
+        self.model_temperature          = temperature
+        self.model_top_k                = 50
+        self.model_top_p                = 0.95
+        self.model_repeat_penalty       = 1.3
+        self.model_repeat_last_n        = 40
+
+    def detect_antiprompt(self, text):
+        return None
+
+
+def make_appi(tmp_path, cls=LoLLMsAPPI, **settings):
+    """
+    Returns a LoLLMsAPPI (or a subclass) with the state used by the generations, without binding, model nor personality:
+    the tests set the ones they need. The events are emitted directly to a FakeSocketIO.
+    """
+    with open(CONFIG_PATH) as f:
+        config = Config(yaml.safe_load(f))
+    config.update({"emit_queue_size": 0, "discussion_summary": False, "context_retrieval": False, "completion_cache_max_size_mb": 0, "prefix_cache_max_memory_mb": 0})
+    config.update(settings)
+
+    appi = object.__new__(cls)
+    # Set by LollmsApplication.__init__, which loads the binding and the model
+    appi.config = config
+    appi.model = None
+    appi.binding = None
+    appi.personality = None
+    appi.mounted_personalities = []
+    appi.socketio = FakeSocketIO()
+    appi.init_model_state(config)
+    appi.model_loaded.set()
+    appi.loading_status = {"status":"ready", "step":"ready", "progress":100, "error":None}
+    appi.db = DiscussionsDB(tmp_path/"database.db")
+    appi.db.create_tables()
+    appi.db.add_missing_columns()
+    appi.init_generation_state()
+    return appi
+
+
+def connect(appi, client_id="client"):
+    connection = appi.new_connection()
+    connection["current_discussion"] = appi.db.create_discussion()
+    appi.connections[client_id] = connection
+    return connection
+
+
+@pytest.fixture
+def appi(tmp_path):
+    return make_appi(tmp_path)
+
+
+def make_webui(tmp_path, **settings):
+    """
+    Returns a LoLLMsWebUI built like make_appi. Its serve(*endpoints) returns a Flask test client of these endpoints.
+    """
+    from flask import Flask
+    from app import LoLLMsWebUI
+    webui = make_appi(tmp_path, cls=LoLLMsWebUI, **settings)
+    webui.app = Flask("test")
+    def serve(*endpoints, methods=("GET", "POST")):
+        for endpoint in endpoints:
+            webui.app.add_url_rule(f"/{endpoint}", endpoint, getattr(webui, endpoint), methods=list(methods))
+        return webui.app.test_client()
+    webui.serve = serve
+    return webui
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+
+from api.batch_runner import BatchRunner
+from api.scheduler import GenerationScheduler, PRIORITY_BACKGROUND
+
+
+def write_prompts(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"p{i}", "prompt": f"prompt {i}", "temperature": 0.1})+"\n")
+
+
+def read_answers(path):
+    with open(path) as f:
+        return [json.loads(l) for l in f]
+
+
+def test_answers_and_resumes(tmp_path):
+    write_prompts(tmp_path/"prompts.jsonl", 5)
+    with open(tmp_path/"prompts.jsonl", "a") as f:
+        f.write("not json\n")
+    calls = []
+    def complete(prompt, personality=None, cancel_token=None, **parameters):
+        calls.append((prompt, parameters))
+        return prompt.upper()
+
+    # A previous run answered the first two prompts and was stopped while writing the third
+    with open(tmp_path/"answers.jsonl", "w") as f:
+        f.write(json.dumps({"line": 0, "id": "p0", "prompt": "prompt 0", "text": "PROMPT 0"})+"\n")
+        f.write(json.dumps({"line": 1, "id": "p1", "prompt": "prompt 1", "text": "PROMPT 1"})+"\n")
+        f.write('{"line": 2, "id": "p2", "pro')
+
+    runner = BatchRunner(GenerationScheduler(), complete, tmp_path/"prompts.jsonl", tmp_path/"answers.jsonl", parameters={"n_predict": 10})
+    runner.run()
+
+    answers = read_answers(tmp_path/"answers.jsonl")
+    assert [a["line"] for a in answers] == [0, 1, 2, 3, 4, 5]
+    assert answers[2] == {"line": 2, "id": "p2", "prompt": "prompt 2", "text": "PROMPT 2"}
+    assert "error" in answers[5]
+    assert calls[0] == ("prompt 2", {"n_predict": 10, "temperature": 0.1})
+    assert runner.get_status()["skipped"] == 2
+    assert runner.get_status()["done"] == 3 and runner.get_status()["errors"] == 1
+
+
+def test_interactive_requests_go_first(tmp_path):
+    write_prompts(tmp_path/"prompts.jsonl", 3)
+    order = []
+    gate = threading.Event()
+    scheduler = GenerationScheduler(max_concurrency=1)
+
+    # An interactive generation is running when the batch starts
+    running = scheduler.submit("user", lambda: gate.wait(5) and order.append("running"))
+    def complete(prompt, personality=None, cancel_token=None, **parameters):
+        order.append(prompt)
+        return ""
+    runner = BatchRunner(scheduler, complete, tmp_path/"prompts.jsonl", tmp_path/"answers.jsonl", max_in_flight=2)
+    thread = threading.Thread(target=runner.run)
+    thread.start()
+    while len(scheduler.queued_jobs()) < 2:
+        time.sleep(0.01)
+    assert all(job.priority == PRIORITY_BACKGROUND for job in scheduler.queued_jobs())
+    interactive = scheduler.submit("user", lambda: order.append("interactive"))
+    gate.set()
+    thread.join(5)
+    assert running.wait(5) and interactive.wait(5)
+    assert order[:2] == ["running", "interactive"]
+    assert sorted(order[2:]) == ["prompt 0", "prompt 1", "prompt 2"]
+
+
+def test_cancel(tmp_path):
+    write_prompts(tmp_path/"prompts.jsonl", 20)
+    runner = None
+    def complete(prompt, personality=None, cancel_token=None, **parameters):
+        if prompt == "prompt 2":
+            runner.cancel()
+        return prompt
+    runner = BatchRunner(GenerationScheduler(), complete, tmp_path/"prompts.jsonl", tmp_path/"answers.jsonl")
+    runner.run()
+    assert runner.status == "canceled"
+    assert len(read_answers(tmp_path/"answers.jsonl")) == 2
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from lollms.types import MSG_TYPE
+from api.batching import BatchedGenerator, BatchRequest
+
+
+STEP_DURATION = 0.005
+
+
+class FakeBatchBinding:
+    """Each decoding step costs the same time whatever the number of sequences it decodes"""
+    supports_batch_generation = True
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        return self.generate_batch([prompt], n_predict, lambda i, chunk, msg_type: callback(chunk, msg_type) if callback else True)[0]
+
+    def generate_batch(self, prompts, n_predict=128, callback=None, **gpt_params):
+        self.batch_sizes.append(len(prompts))
+        outputs = ["" for _ in prompts]
+        active = set(range(len(prompts)))
+        for step in range(n_predict):
+            if not active:
+                break
+            time.sleep(STEP_DURATION)
+            for i in list(active):
+                chunk = f"{prompts[i]}:{step} "
+                outputs[i] += chunk
+                if callback is not None and not callback(i, chunk, MSG_TYPE.MSG_TYPE_CHUNK):
+                    active.discard(i)
+        return outputs
+
+
+class FakeSerialBinding(FakeBatchBinding):
+    supports_batch_generation = False
+
+
+def run_clients(generator, model, n_clients, n_predict, stop_after=None):
+    received = {i: [] for i in range(n_clients)}
+
+    def client(i):
+        def callback(chunk, msg_type):
+            received[i].append(chunk)
+            return stop_after is None or stop_after.get(i) is None or len(received[i])<stop_after[i]
+        generator.generate(model, f"p{i}", n_predict=n_predict, callback=callback, temperature=0.1)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, received
+
+
+def test_chunks_are_routed_to_their_client():
+    model = FakeBatchBinding()
+    _, received = run_clients(BatchedGenerator(batch_window=0.05, max_batch_size=4), model, 4, 10, stop_after={1: 3})
+    assert model.batch_sizes == [4]
+    for i, chunks in received.items():
+        assert all(c.startswith(f"p{i}:") for c in chunks)
+    assert len(received[0]) == 10
+    assert len(received[1]) == 3
+
+
+def test_batched_throughput():
+    n_clients, n_predict = 8, 20
+    serial_time, _ = run_clients(BatchedGenerator(batch_window=0.05, max_batch_size=8), FakeSerialBinding(), n_clients, n_predict)
+    batched_time, _ = run_clients(BatchedGenerator(batch_window=0.05, max_batch_size=8), FakeBatchBinding(), n_clients, n_predict)
+    n_tokens = n_clients*n_predict
+    print(f"\nserialized: {n_tokens/serial_time:.1f} tokens/s, batched: {n_tokens/batched_time:.1f} tokens/s")
+    assert batched_time*3 < serial_time
+
+
+def test_generate_many_groups_the_requests_by_parameters():
+    model = FakeBatchBinding()
+    requests = [BatchRequest(f"p{i}", 3, None, gpt_params={"temperature": 0.1 if i%2 else 0.9}) for i in range(4)]
+    outputs = BatchedGenerator(max_batch_size=8).generate_many(model, requests)
+    assert model.batch_sizes == [2, 2]
+    assert outputs == [f"p{i}:0 p{i}:1 p{i}:2 " for i in range(4)]
+
+
+def test_generate_many_sends_the_parameters_of_each_sequence():
+    model = FakeBatchBinding()
+    model.supports_sequence_parameters = True
+    sent = []
+    generate_batch = model.generate_batch
+    def record(prompts, n_predict=128, callback=None, sequence_parameters=None, **gpt_params):
+        sent.append((sequence_parameters, gpt_params))
+        return generate_batch(prompts, n_predict, callback)
+    model.generate_batch = record
+    requests = [BatchRequest(f"p{i}", 2+i, None, gpt_params={"temperature": 0.1*i, "top_k": 40}) for i in range(3)]
+    BatchedGenerator(max_batch_size=8).generate_many(model, requests)
+    assert model.batch_sizes == [3]
+    assert sent == [([{"n_predict": 2+i, "temperature": 0.1*i, "top_k": 40} for i in range(3)], {"top_k": 40})]
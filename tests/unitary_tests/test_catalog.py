@@ -0,0 +1,88 @@
+import os
+
+from api.catalog import PersonalityCatalog, BindingCatalog, ModelCatalog, filter_catalog, paginate, MODEL_FIELDS
+
+
+def add_personality(zoo, path, name, logo=None):
+    folder = zoo/path
+    (folder/"assets").mkdir(parents=True)
+    (folder/"config.yaml").write_text(f"name: {name}\nauthor: me\n")
+    if logo is not None:
+        (folder/"assets"/logo).write_bytes(b"")
+    return folder
+
+
+def test_personality_catalog_tree_and_infos(tmp_path):
+    zoo = tmp_path/"zoo"
+    add_personality(zoo, "english/generic/lollms", "LoLLMs", "logo.png")
+    add_personality(zoo, "english/art/painter", "Painter")
+    (zoo/"english"/"art"/"no_config").mkdir()
+    catalog = PersonalityCatalog(zoo, tmp_path/"configs")
+    assert catalog.languages() == ["english"]
+    assert catalog.categories("english") == ["art", "generic"]
+    assert catalog.personalities("english", "art") == ["painter"]
+    personalities = catalog.as_dict()
+    lollms = personalities["english"]["generic"][0]
+    assert lollms["name"] == "LoLLMs" and lollms["author"] == "me" and lollms["has_logo"]
+    assert lollms["avatar"] == "personalities/english/generic/lollms/assets/logo.png"
+    assert not lollms["installed"]
+    assert catalog.get("english", "art", "no_config") is None
+
+
+def test_personality_catalog_reparses_modified_personalities_only(tmp_path):
+    zoo = tmp_path/"zoo"
+    folder = add_personality(zoo, "english/generic/lollms", "LoLLMs")
+    add_personality(zoo, "english/generic/other", "Other")
+    cache_file = tmp_path/"cache"/"catalog.json"
+    catalog = PersonalityCatalog(zoo, cache_file=cache_file)
+    catalog.refresh()
+    assert cache_file.exists()
+
+    parsed = []
+    restarted = PersonalityCatalog(zoo, cache_file=cache_file)
+    original_parse = restarted._parse
+    restarted._parse = lambda *args: parsed.append(args) or original_parse(*args)
+    restarted.refresh()
+    assert parsed == []
+
+    (folder/"config.yaml").write_text("name: Renamed\n")
+    stat = os.stat(folder/"config.yaml")
+    os.utime(folder/"config.yaml", ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+    restarted.refresh(force=True)
+    assert parsed == [("english", "generic", "lollms")]
+    assert restarted.get("english", "generic", "lollms")["name"] == "Renamed"
+
+
+def test_binding_catalog_and_filters(tmp_path):
+    zoo = tmp_path/"bindings_zoo"
+    for folder, name, license in [("c_transformers", "C Transformers", "MIT"), ("open_ai", "OpenAI", "Apache 2.0")]:
+        (zoo/folder).mkdir(parents=True)
+        (zoo/folder/"binding_card.yaml").write_text(f"name: {name}\nlicense: {license}\n")
+    (tmp_path/"configs").mkdir()
+    (tmp_path/"configs"/"binding_open_ai.yaml").write_text("")
+    bindings = BindingCatalog(zoo, tmp_path/"configs").list()
+    assert [binding["folder"] for binding in bindings] == ["c_transformers", "open_ai"]
+    assert [binding["folder"] for binding in filter_catalog(bindings, installed=True)] == ["open_ai"]
+    assert [binding["folder"] for binding in filter_catalog(bindings, name="transf", license="mit")] == ["c_transformers"]
+    assert paginate(list(range(10)), 8, 5) == [8, 9]
+
+
+def test_model_catalog_is_kept_until_the_binding_changes(tmp_path):
+    class Binding:
+        calls = 0
+        def get_available_models(self):
+            Binding.calls += 1
+            return [{"filename": "a.bin", "server": "https://host/", "license": "MIT"}, {"filename": "b.bin", "server": "https://host"}]
+
+    (tmp_path/"models"/"binding").mkdir(parents=True)
+    catalog = ModelCatalog(tmp_path/"models")
+    binding = Binding()
+    models = catalog.list(binding, "binding")
+    assert [model["path"] for model in models] == ["https://host/a.bin", "https://host/b.bin"]
+    assert not any(model["isInstalled"] for model in models)
+    (tmp_path/"models"/"binding"/"b.bin").write_bytes(b"")
+    models = catalog.list(binding, "binding")
+    assert Binding.calls == 1
+    assert [model["title"] for model in filter_catalog(models, installed=True, fields=MODEL_FIELDS)] == ["b.bin"]
+    catalog.list(Binding(), "binding")
+    assert Binding.calls == 2
@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+
+import pytest
+from lollms.types import MSG_TYPE
+
+from conftest import FakePersonality, make_webui
+
+
+class FakeModel:
+    """Answers with the words "w0 w1 ...", one chunk per word"""
+    supports_batch_generation = False
+
+    def __init__(self, n_words=5, delay=0, error=None):
+        self.n_words = n_words
+        self.delay = delay
+        self.error = error
+        self.prompts = []
+        self.parameters = []
+        self.generated = 0
+
+    def tokenize(self, text):
+        return text.split(" ")
+
+    def detokenize(self, tokens):
+        return " ".join(tokens)
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        self.prompts.append(prompt)
+        self.parameters.append({"n_predict": n_predict, **gpt_params})
+        if self.error is not None:
+            raise Exception(self.error)
+        output = ""
+        for i in range(min(self.n_words, n_predict)):
+            time.sleep(self.delay)
+            self.generated += 1
+            output += f"w{i} "
+            if callback is not None and not callback(f"w{i} ", MSG_TYPE.MSG_TYPE_CHUNK):
+                break
+        return output
+
+
+@pytest.fixture
+def webui(tmp_path):
+    webui = make_webui(tmp_path)
+    webui.model = FakeModel()
+    webui.personality = FakePersonality("alice", temperature=0.3)
+    webui.mounted_personalities = [webui.personality, FakePersonality("bob", temperature=0.8)]
+    return webui
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = block.split("\n")
+        assert lines[0].startswith("event: ") and lines[1].startswith("data: ")
+        events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return events
+
+
+def test_build_prompt_is_conditioned_by_the_personality(webui):
+    bob = webui.mounted_personalities[1]
+    full_prompt, conditioning, tokens = webui.build_prompt("Hello there", bob)
+    assert conditioning == "You are bob."
+    assert full_prompt == "You are bob.\n!@>user: Hello there\nbob:"
+    assert tokens == webui.model.tokenize(full_prompt)
+
+
+def test_build_prompt_crops_long_prompts(webui):
+    webui.config["ctx_size"] = 40
+    full_prompt, conditioning, tokens = webui.build_prompt(" ".join(["word"]*100))
+    assert full_prompt.startswith(conditioning)
+    assert full_prompt.endswith("alice:")
+    assert len(tokens) <= 3*40//4 + 1
+
+
+def test_complete_uses_the_personality_and_overridden_parameters(webui):
+    chunks = []
+    text = webui.complete("Hi", callback=chunks.append, personality=webui.mounted_personalities[1], n_predict=3, top_k=7)
+    assert text == "w0 w1 w2 "
+    assert chunks == ["w0 ", "w1 ", "w2 "]
+    assert webui.model.prompts[0].startswith("You are bob.")
+    assert webui.model.parameters[0]["temperature"] == 0.8
+    assert webui.model.parameters[0]["top_k"] == 7
+
+
+def test_sse_stream(webui):
+    client = webui.serve("generate_completion", methods=["POST"])
+    response = client.post("/generate_completion", json={"prompt": "Hi"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = parse_sse(response.get_data(as_text=True))
+    assert events == [("chunk", {"chunk": f"w{i} "}) for i in range(5)] + [("done", {"text": "w0 w1 w2 w3 w4 "})]
+
+
+def test_json_lines_stream(webui):
+    client = webui.serve("generate_completion", methods=["POST"])
+    response = client.post("/generate_completion", json={"prompt": "Hi", "format": "json", "n_predict": 2})
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).strip().split("\n")]
+    assert lines == [{"event": "chunk", "chunk": "w0 "}, {"event": "chunk", "chunk": "w1 "}, {"event": "done", "text": "w0 w1 "}]
+
+
+def test_whole_answer_without_stream(webui):
+    client = webui.serve("generate_completion", methods=["POST"])
+    response = client.post("/generate_completion", json={"prompt": "Hi", "stream": False, "personality": "english/test/bob"})
+    assert response.status_code == 200
+    assert response.get_json() == {"status": True, "text": "w0 w1 w2 w3 w4 "}
+    assert webui.model.prompts[0] == "You are bob.\n!@>user: Hi\nbob:"
+
+
+def test_bad_requests(webui):
+    client = webui.serve("generate_completion", methods=["POST"])
+    assert client.post("/generate_completion", json={"stream": False}).status_code == 400
+    response = client.post("/generate_completion", json={"prompt": "Hi", "personality": "english/test/nobody"})
+    assert response.status_code == 400
+    assert "not mounted" in response.get_json()["error"]
+    assert webui.model.prompts == []
+
+
+def test_generation_errors(webui):
+    webui.model = FakeModel(error="out of memory")
+    client = webui.serve("generate_completion", methods=["POST"])
+    response = client.post("/generate_completion", json={"prompt": "Hi", "stream": False})
+    assert response.status_code == 500
+    assert response.get_json() == {"status": False, "error": "out of memory"}
+    events = parse_sse(client.post("/generate_completion", json={"prompt": "Hi"}).get_data(as_text=True))
+    assert events == [("error", {"error": "out of memory"})]
+
+
+def test_client_disconnection_cancels_the_generation(webui):
+    webui.model = FakeModel(n_words=500, delay=0.01)
+    client = webui.serve("generate_completion", methods=["POST"])
+    response = client.post("/generate_completion", json={"prompt": "Hi"}, buffered=False)
+    body = iter(response.response)
+    assert next(body).startswith(b"event: chunk")
+    # The client goes away
+    response.close()
+    deadline = time.perf_counter()+2
+    while len(webui.generation_scheduler.running_jobs())>0 and time.perf_counter()<deadline:
+        time.sleep(0.01)
+    assert webui.generation_scheduler.running_jobs() == []
+    assert webui.model.generated < 500
+
+
+def test_canceled_before_running(webui):
+    # The only generation slot is taken
+    release = threading.Event()
+    webui.generation_scheduler.submit("other", release.wait, args=(5,), binding_name=webui.config["binding_name"])
+    client = webui.serve("generate_completion", methods=["POST"])
+    answer = {}
+    thread = threading.Thread(target=lambda: answer.update(response=client.post("/generate_completion", json={"prompt": "Hi", "stream": False})))
+    thread.start()
+    deadline = time.perf_counter()+2
+    while len(webui.generation_scheduler.queued_jobs())==0 and time.perf_counter()<deadline:
+        time.sleep(0.01)
+    webui.generation_scheduler.cancel(queued=True, running=False)
+    release.set()
+    thread.join(3)
+    assert answer["response"].status_code == 500
+    assert answer["response"].get_json()["error"] == "Generation canceled"
+    assert webui.model.prompts == []
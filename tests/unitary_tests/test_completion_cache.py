@@ -0,0 +1,51 @@
+from lollms.types import MSG_TYPE
+from api.completion_cache import CompletionCache
+
+
+GREEDY = {"n_predict": 64, "temperature": 0, "top_k": 50, "top_p": 0.9, "repeat_penalty": 1.1, "repeat_last_n": 40, "seed": 42, "n_threads": 8}
+
+
+def test_only_deterministic_parameters_are_cached():
+    assert CompletionCache.is_deterministic(GREEDY)
+    assert CompletionCache.is_deterministic({**GREEDY, "temperature": 0.7, "top_k": 1})
+    assert not CompletionCache.is_deterministic({**GREEDY, "seed": -1})
+    assert not CompletionCache.is_deterministic({**GREEDY, "temperature": 0.7})
+
+
+def test_key_ignores_threads():
+    key = CompletionCache.make_key("binding", "model", GREEDY, "prompt")
+    assert key == CompletionCache.make_key("binding", "model", {**GREEDY, "n_threads": 2}, "prompt")
+    assert key != CompletionCache.make_key("binding", "other_model", GREEDY, "prompt")
+    assert key != CompletionCache.make_key("binding", "model", GREEDY, "other prompt")
+
+
+def test_record_and_replay(tmp_path):
+    cache = CompletionCache(tmp_path/"completions.db")
+    key = CompletionCache.make_key("binding", "model", GREEDY, "prompt")
+    assert cache.get(key) is None
+
+    chunks = []
+    callback = CompletionCache.record(lambda chunk, message_type: True, chunks)
+    for token in ["Hello", " world", "!"]:
+        callback(token, MSG_TYPE.MSG_TYPE_CHUNK)
+    cache.put(key, chunks)
+
+    received = []
+    output = CompletionCache.replay(cache.get(key), lambda chunk, message_type: received.append((chunk, message_type)) or True)
+    assert output == "Hello world!"
+    assert received == [("Hello", MSG_TYPE.MSG_TYPE_CHUNK), (" world", MSG_TYPE.MSG_TYPE_CHUNK), ("!", MSG_TYPE.MSG_TYPE_CHUNK)]
+
+    # The replay stops when the callback asks to
+    output = CompletionCache.replay(cache.get(key), lambda chunk, message_type: chunk != " world")
+    assert output == "Hello world"
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = CompletionCache(tmp_path/"completions.db", max_size=100)
+    cache.put("a", [["x"*30, MSG_TYPE.MSG_TYPE_CHUNK.value]])
+    cache.put("b", [["x"*30, MSG_TYPE.MSG_TYPE_CHUNK.value]])
+    assert cache.get("a") is not None
+    cache.put("c", [["x"*30, MSG_TYPE.MSG_TYPE_CHUNK.value]])
+    assert cache.get_size() <= 100
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
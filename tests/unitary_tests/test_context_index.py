@@ -0,0 +1,41 @@
+from api.context_index import ContextIndex, select_context
+
+
+def test_search_ranks_relevant_entries_first(tmp_path):
+    index = ContextIndex(tmp_path/"1.npz")
+    index.add("message:1", "My cat is called Felix and he likes fish", 10, version=1)
+    index.add("message:2", "The weather is sunny today", 6, version=1)
+    index.add("document:notes.txt:0", "Felix the cat sleeps all day", 7, store_text=True)
+    scores = index.search("what does my cat Felix like?")
+    assert scores["message:1"] > scores["document:notes.txt:0"] > scores["message:2"]
+    assert set(index.search("cat", ["message:2"])) == {"message:2"}
+
+
+def test_index_is_persisted_and_updated_incrementally(tmp_path):
+    index = ContextIndex(tmp_path/"1.npz")
+    assert index.add("message:1", "hello world", 2, version=1)
+    assert not index.add("message:1", "hello world", 2, version=1)
+    index.add("document:a.txt:0", "an excerpt", 2, store_text=True)
+    index.save()
+
+    loaded = ContextIndex(tmp_path/"1.npz")
+    assert len(loaded) == 2 and loaded.get("document:a.txt:0")["text"] == "an excerpt"
+    assert loaded.search("hello")["message:1"] > 0
+    # Edited message
+    assert loaded.add("message:1", "goodbye moon", 2, version=2)
+    assert len(loaded) == 2
+    assert loaded.search("hello")["message:1"] == 0
+    loaded.remove("document:a.txt:0")
+    assert loaded.keys() == ["message:1"]
+
+
+def test_select_context_keeps_recent_then_relevant():
+    sizes = [10, 10, 10, 10, 10, 10]
+    scores = [0.9, 0.0, 0.5, 0.1, 0.2, 0.3]
+    history, documents = select_context(sizes, scores, [10, 10], [0.7, 0.05], budget=50, recent_budget=20, top_k=8)
+    # The last two messages, then messages 0 and 2 and the first excerpt by relevance
+    assert history == [0, 2, 4, 5]
+    assert documents == [0]
+
+    history, documents = select_context(sizes, scores, [10], [0.7], budget=50, recent_budget=20, top_k=1)
+    assert history == [0, 4, 5] and documents == []
@@ -0,0 +1,47 @@
+import threading
+
+from api.emit_queue import EmitQueue, EmitQueues, TokenBucket
+from api.streaming import update_payload
+
+
+def test_full_queue_coalesces_the_chunks_of_a_message():
+    queue = EmitQueue("session", max_size=2)
+    queue.put("new_message", {"id": 1})
+    for seq, chunk in enumerate(["Hel", "lo", " wor", "ld"]):
+        queue.put("update_message", update_payload("compact", "lollms", 3, 1, seq+1, 0, chunk), delta_key=1)
+    queue.put("update_message", update_payload("json", "lollms", 3, 2, 1, 0, "a"), delta_key=2)
+    queue.put("update_message", update_payload("json", "lollms", 3, 2, 2, 0, "b"), delta_key=2)
+    events = [queue.get(0) for _ in range(len(queue.events))]
+    assert [event[0] for event in events] == ["new_message", "update_message", "update_message"]
+    assert events[1][1] == [1, 4, 0, "Hello world", None, 1]
+    assert events[2][1]["content"] == "ab" and events[2][1]["seq"] == 2 and events[2][1]["first_seq"] == 1
+    assert queue.coalesced == 4
+
+
+def test_chunks_are_not_merged_across_other_events_of_their_message():
+    queue = EmitQueue("session", max_size=1)
+    queue.put("update_message", [1, 1, 0, "a", None], delta_key=1)
+    queue.put("close_message", {"id": 1})
+    queue.put("update_message", [1, 2, 0, "b", None], delta_key=1)
+    assert len(queue.events) == 3
+
+
+def test_sender_task_sends_in_order_and_stops_when_idle():
+    sent = []
+    threads = []
+    def start_task(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        threads.append(thread)
+    queues = EmitQueues(lambda event, data, room: sent.append((event, data, room)), start_task, idle_timeout=0.05)
+    for i in range(10):
+        queues.put("update_message", [1, i+1, 0, "x", None], "session", delta_key=1)
+    threads[0].join(5)
+    assert [data[1] for _, data, _ in sent] == list(range(1, 11))
+    assert queues.get_status() == {}
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=0.001, capacity=2)
+    assert bucket.consume() and bucket.consume()
+    assert not bucket.consume()
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+from lollms.types import MSG_TYPE
+from api.model_host import ModelHostProxy
+
+
+class FakeHostedModel:
+    """Sends the id of the process it runs in, then counts until the callback asks to stop"""
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        output = f"{os.getpid()}"
+        callback(output, MSG_TYPE.MSG_TYPE_CHUNK)
+        for i in range(n_predict):
+            time.sleep(0.001)
+            if not callback(f" {i}", MSG_TYPE.MSG_TYPE_CHUNK):
+                break
+            output += f" {i}"
+        return output
+
+    def tokenize(self, text):
+        return [ord(c) for c in text]
+
+    def detokenize(self, tokens):
+        return "".join(chr(t) for t in tokens)
+
+
+def build_fake_model():
+    return FakeHostedModel()
+
+
+def build_broken_model():
+    raise ValueError("model file not found")
+
+
+@pytest.fixture
+def proxy():
+    proxy = ModelHostProxy(build_fake_model, start_method="fork")
+    yield proxy
+    proxy.stop()
+
+
+def test_generation_runs_in_host_process(proxy):
+    chunks = []
+    output = proxy.generate("prompt", n_predict=3, callback=lambda chunk, message_type: chunks.append(chunk) or True)
+    assert int(chunks[0]) == proxy.process.pid != os.getpid()
+    assert chunks[1:] == [" 0", " 1", " 2"]
+    assert output == "".join(chunks)
+    assert proxy.detokenize(proxy.tokenize("hello")) == "hello"
+
+
+def test_callback_stops_generation(proxy):
+    chunks = []
+    def callback(chunk, message_type):
+        chunks.append(chunk)
+        return len(chunks)<5
+    start = time.perf_counter()
+    proxy.generate("prompt", n_predict=100000, callback=callback)
+    assert time.perf_counter()-start < 5
+    # The host may have sent a few chunks before receiving the cancel request, they are not forwarded
+    assert len(chunks) == 5
+
+
+def test_callback_error_cancels_generation(proxy):
+    def callback(chunk, message_type):
+        raise ConnectionError("client gone")
+    with pytest.raises(ConnectionError):
+        proxy.generate("prompt", n_predict=100000, callback=callback)
+    # The host stopped the generation, which would otherwise hold the model
+    start = time.perf_counter()
+    chunks = []
+    output = proxy.generate("prompt", n_predict=3, callback=lambda chunk, message_type: chunks.append(chunk) or True)
+    assert time.perf_counter()-start < 5
+    assert chunks[1:] == [" 0", " 1", " 2"]
+    assert output == "".join(chunks)
+
+
+def test_build_failure_is_reported():
+    with pytest.raises(RuntimeError, match="model file not found"):
+        ModelHostProxy(build_broken_model, start_method="fork")
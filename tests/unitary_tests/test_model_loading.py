@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+from lollms.types import MSG_TYPE
+
+from conftest import FakePersonality, make_webui
+
+
+class FakeModel:
+    supports_batch_generation = False
+
+    def __init__(self):
+        self.prompts = []
+
+    def tokenize(self, text):
+        return text.split(" ")
+
+    def detokenize(self, tokens):
+        return " ".join(tokens)
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        self.prompts.append(prompt)
+        callback("Hello", MSG_TYPE.MSG_TYPE_CHUNK)
+        return "Hello"
+
+
+class BlockingBinding:
+    """build_model waits for release, then returns the model or raises error"""
+    def __init__(self, error=None):
+        self.error = error
+        self.building = threading.Event()
+        self.release = threading.Event()
+        self.model = FakeModel()
+
+    def get_model_path(self):
+        raise FileNotFoundError()
+
+    def build_model(self):
+        self.building.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise Exception(self.error)
+        return self.model
+
+    def destroy_model(self):
+        pass
+
+
+def start_loading(tmp_path, binding):
+    webui = make_webui(tmp_path, binding_name="fake", model_name="model.bin", model_host_process=False, load_model_in_background=True)
+    webui.lollms_paths = None
+    webui.personality = FakePersonality("alice")
+    webui.mounted_personalities = [webui.personality]
+    webui.load_binding = lambda: binding
+    webui.model_loaded.clear()
+    webui.loading_status = {"status":"loading", "step":"binding", "progress":0, "error":None}
+    webui.socketio.start_background_task(webui.load_binding_and_model)
+    assert binding.building.wait(2)
+    return webui, webui.serve("ready", "generate_completion")
+
+
+def post_in_background(client, url, json):
+    answer = {}
+    thread = threading.Thread(target=lambda: answer.update(response=client.post(url, json=json)))
+    thread.start()
+    return thread, answer
+
+
+def test_requests_wait_for_the_model(tmp_path):
+    binding = BlockingBinding()
+    webui, client = start_loading(tmp_path, binding)
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json() == {"status":"loading", "step":"model", "progress":50, "error":None}
+
+    thread, answer = post_in_background(client, "/generate_completion", {"prompt": "Hi", "stream": False})
+    time.sleep(0.2)
+    # Queued in the scheduler until the model is there
+    assert thread.is_alive()
+    assert len(webui.generation_scheduler.running_jobs()) == 1
+    assert binding.model.prompts == []
+
+    binding.release.set()
+    thread.join(2)
+    assert answer["response"].status_code == 200
+    assert answer["response"].get_json() == {"status": True, "text": "Hello"}
+    assert webui.model is binding.model
+    assert webui.personality.model is binding.model
+
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "ready"
+    assert [data["step"] for _, data in webui.socketio.get("loading_progress")] == ["binding", "model", "ready"]
+
+
+def test_requests_fail_when_loading_fails(tmp_path):
+    binding = BlockingBinding(error="model.bin is corrupted")
+    webui, client = start_loading(tmp_path, binding)
+
+    thread, answer = post_in_background(client, "/generate_completion", {"prompt": "Hi", "stream": False})
+    time.sleep(0.1)
+    binding.release.set()
+    thread.join(2)
+    assert answer["response"].status_code == 500
+    assert answer["response"].get_json() == {"status": False, "error": "The model couldn't be loaded: model.bin is corrupted"}
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json() == {"status":"failed", "step":"failed", "progress":100, "error":"model.bin is corrupted"}
+    assert webui.model is None
+
+    # Later requests get the error instead of waiting
+    start = time.perf_counter()
+    response = client.post("/generate_completion", json={"prompt": "Hi", "stream": False})
+    assert response.status_code == 500
+    assert time.perf_counter()-start < 1
+
+
+def test_missing_binding(tmp_path):
+    webui = make_webui(tmp_path, binding_name="missing")
+    webui.load_binding = lambda: None
+    webui.model_loaded.clear()
+    webui.load_binding_and_model()
+    assert webui.model_loaded.is_set()
+    assert webui.loading_status["status"] == "failed"
+    assert webui.loading_status["error"] == "Couldn't load the binding missing"
@@ -0,0 +1,211 @@
+import threading
+import time
+
+from api.model_pool import ModelPool, model_file_size
+
+
+class FakeBinding:
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.destroyed = False
+
+    def get_model_path(self):
+        return self.model_path
+
+    def build_model(self):
+        return self
+
+    def destroy_model(self):
+        self.destroyed = True
+
+
+def make_builder(tmp_path, name, size, built):
+    def build():
+        path = tmp_path/name
+        path.write_bytes(b"\0"*size)
+        binding = FakeBinding(path)
+        built.append(name)
+        return binding, binding.build_model()
+    return build
+
+
+def test_resident_models_are_not_rebuilt(tmp_path):
+    built = []
+    pool = ModelPool(max_memory=10*1024*1024)
+    binding, model = pool.load("fake", "a.bin", make_builder(tmp_path, "a.bin", 1000, built))
+    pool.load("fake", "b.bin", make_builder(tmp_path, "b.bin", 1000, built))
+    assert pool.load("fake", "a.bin", make_builder(tmp_path, "a.bin", 1000, built)) == (binding, model)
+    assert built == ["a.bin", "b.bin"]
+    assert pool.owns(binding)
+    assert model_file_size(binding) == 1000
+
+
+def test_least_recently_used_models_are_unloaded(tmp_path):
+    built = []
+    pool = ModelPool(max_memory=2500)
+    # Explicit sizes keep the budget checks independent of the memory of the test process
+    pool.add("fake", "a.bin", *make_builder(tmp_path, "a.bin", 1000, built)(), size=1000)
+    pool.add("fake", "b.bin", *make_builder(tmp_path, "b.bin", 1000, built)(), size=1000)
+    binding_a, _ = pool.get("fake", "a.bin")
+    binding_b, _ = pool.get("fake", "b.bin")
+    pool.get("fake", "a.bin")
+    pool.add("other", "c.bin", *make_builder(tmp_path, "c.bin", 1000, built)(), size=1000)
+    assert binding_b.destroyed and not binding_a.destroyed
+    assert pool.get("fake", "b.bin") is None
+    assert [m["model_name"] for m in pool.get_status()["models"]] == ["a.bin", "c.bin"]
+
+    # Making room before loading a model
+    pool.evict(reserve=1000)
+    assert binding_a.destroyed
+    assert pool.memory == 1000
+
+    pool.remove("other")
+    assert pool.get_status()["models"] == []
+
+
+def test_no_budget_keeps_only_the_current_model(tmp_path):
+    built = []
+    pool = ModelPool(max_memory=0)
+    pool.load("fake", "a.bin", make_builder(tmp_path, "a.bin", 1000, built))
+    assert len(pool.get_status()["models"]) == 1
+    pool.load("fake", "b.bin", make_builder(tmp_path, "b.bin", 1000, built))
+    assert [m["model_name"] for m in pool.get_status()["models"]] == ["b.bin"]
+
+
+def test_models_are_not_destroyed_during_a_generation(tmp_path):
+    built = []
+    in_use_lock = threading.Lock()
+    pool = ModelPool(max_memory=1500, in_use_lock=in_use_lock)
+    pool.add("fake", "a.bin", *make_builder(tmp_path, "a.bin", 1000, built)(), size=1000)
+    binding_a, _ = pool.get("fake", "a.bin")
+
+    in_use_lock.acquire()
+    adding = threading.Thread(target=pool.add, args=("fake", "b.bin", *make_builder(tmp_path, "b.bin", 1000, built)()), kwargs={"size":1000})
+    adding.start()
+    time.sleep(0.1)
+    # The generation holding the lock still uses model a
+    assert not binding_a.destroyed
+    in_use_lock.release()
+    adding.join(2)
+    assert binding_a.destroyed
+
+
+class SlowModel:
+    def __init__(self, binding):
+        self.binding = binding
+        self.destroyed_while_generating = False
+        self.started = threading.Event()
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        self.started.set()
+        output = ""
+        for step in range(n_predict):
+            time.sleep(0.01)
+            self.destroyed_while_generating |= self.binding.destroyed
+            output += f"{step} "
+        return output
+
+
+class SlowBinding(FakeBinding):
+    def build_model(self):
+        return SlowModel(self)
+
+
+def test_switching_models_waits_for_the_running_generation(tmp_path, monkeypatch):
+    import api
+    from conftest import make_appi
+
+    class Builder:
+        def build_binding(self, config, lollms_paths):
+            path = tmp_path/config["model_name"]
+            path.write_bytes(b"\0"*1000)
+            return SlowBinding(path)
+    monkeypatch.setattr(api, "BindingBuilder", Builder)
+
+    # Nothing fits in the pool: loading a model unloads the previous one
+    appi = make_appi(tmp_path, binding_name="fake", model_name="a.bin", model_pool_max_memory_mb=0, model_host_process=False)
+    appi.lollms_paths = None
+    model_a = appi.activate_model()
+
+    outputs = []
+    generation = threading.Thread(target=lambda: outputs.append(appi.batched_generator.generate(model_a, "prompt", n_predict=20)))
+    generation.start()
+    assert model_a.started.wait(2)
+
+    appi.config["model_name"] = "b.bin"
+    model_b = appi.activate_model()
+    generation.join(2)
+
+    assert model_b is not model_a and appi.model is model_b
+    assert model_a.binding.destroyed
+    assert not model_a.destroyed_while_generating
+    assert outputs == ["".join(f"{step} " for step in range(20))]
+
+
+class SpeculativeBinding(FakeBinding):
+    """Builds a main model for the models named main*, a draft model otherwise"""
+    def build_model(self):
+        time.sleep(0.1)
+        return MainModel(self) if self.model_path.name.startswith("main") else DraftModel(self)
+
+
+class MainModel:
+    supports_speculative_verification = True
+
+    def __init__(self, binding):
+        self.binding = binding
+
+    def verify_tokens(self, tokens, draft, **gpt_params):
+        return draft+[0]
+
+
+class DraftModel(MainModel):
+    def predict_tokens(self, tokens, n, **gpt_params):
+        return [0]*n
+
+
+def test_draft_models_are_loaded_once_through_the_pool(tmp_path, monkeypatch):
+    import api
+    from conftest import make_appi
+
+    built = []
+    class Builder:
+        def build_binding(self, config, lollms_paths):
+            path = tmp_path/config["model_name"]
+            path.write_bytes(b"\0"*1000)
+            built.append(config["model_name"])
+            return SpeculativeBinding(path)
+    monkeypatch.setattr(api, "BindingBuilder", Builder)
+
+    appi = make_appi(tmp_path, binding_name="fake", model_name="main_a.bin", model_pool_max_memory_mb=0, model_host_process=False,
+                     speculative_decoding=True, speculative_draft_binding=None, speculative_draft_model="draft_a.bin")
+    appi.lollms_paths = None
+    appi.activate_model()
+    draft_a = appi.get_speculative_decoder().draft_model
+    assert built == ["main_a.bin", "draft_a.bin"]
+
+    # Concurrent requests to load the new draft model build it once and unload the previous one
+    appi.config["speculative_draft_model"] = "draft_b.bin"
+    loaders = [threading.Thread(target=appi.load_speculative_decoder) for _ in range(2)]
+    for loader in loaders:
+        loader.start()
+    for loader in loaders:
+        loader.join(2)
+    assert built == ["main_a.bin", "draft_a.bin", "draft_b.bin"]
+    assert draft_a.binding.destroyed
+    draft_b = appi.get_speculative_decoder().draft_model
+    assert isinstance(draft_b, DraftModel)
+
+    # Counted in the pool, but not unloaded to make room for the next model
+    appi.config["model_name"] = "main_b.bin"
+    appi.activate_model()
+    assert sorted(m["model_name"] for m in appi.model_pool.get_status()["models"]) == ["draft_b.bin", "main_b.bin"]
+    assert appi.model_pool.memory >= 2000
+    assert appi.get_speculative_decoder().draft_model is draft_b
+    assert not draft_b.binding.destroyed
+
+    appi.config["speculative_decoding"] = False
+    appi.load_speculative_decoder()
+    assert draft_b.binding.destroyed
+    assert appi.get_speculative_decoder() is None
+    assert [m["model_name"] for m in appi.model_pool.get_status()["models"]] == ["main_b.bin"]
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from lollms.types import MSG_TYPE
+from api.db import Message
+
+from conftest import FakePersonality, connect
+
+
+STEPS = 20
+STEP_DURATION = 0.01
+
+
+class FakeModel:
+    """Each decoding step costs the same time whatever the number of sequences it decodes"""
+    supports_batch_generation = True
+    supports_sequence_parameters = True
+
+    def __init__(self):
+        self.batch_calls = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def tokenize(self, text):
+        return text.split()
+
+    def detokenize(self, tokens):
+        return " ".join(tokens)
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        return self.generate_batch([prompt], n_predict, lambda i, chunk, msg_type: callback(chunk, msg_type))[0]
+
+    def generate_batch(self, prompts, n_predict=128, callback=None, sequence_parameters=None, **gpt_params):
+        with self.lock:
+            self.calls += 1
+            self.batch_calls.append((len(prompts), sequence_parameters, gpt_params))
+        outputs = ["" for _ in prompts]
+        for step in range(STEPS):
+            time.sleep(STEP_DURATION)
+            for i in range(len(prompts)):
+                chunk = f"{i}.{step} "
+                outputs[i] += chunk
+                callback(i, chunk, MSG_TYPE.MSG_TYPE_CHUNK)
+        return outputs
+
+
+class FakeSerialModel(FakeModel):
+    supports_batch_generation = False
+
+
+def ask_personalities(appi, model, personalities):
+    appi.model = model
+    appi.mounted_personalities = personalities
+    connection = connect(appi)
+    discussion = connection["current_discussion"]
+    message = discussion.add_message(MSG_TYPE.MSG_TYPE_FULL.value, 0, "user", "Hello everyone")
+    names = [f"{p.language}/{p.category}/{p.personality_folder_name}" for p in personalities]
+    start = time.perf_counter()
+    assert appi.schedule_personalities_generation(message, "client", names)
+    assert connection["generation_job"].wait(10)
+    return time.perf_counter() - start
+
+
+def test_answers_are_generated_in_one_batch_with_their_parameters(appi):
+    model = FakeModel()
+    personalities = [FakePersonality("alice", 0.1), FakePersonality("bob", 0.5), FakePersonality("carol", 0.9)]
+    ask_personalities(appi, model, personalities)
+
+    assert model.calls == 1
+    size, sequence_parameters, common = model.batch_calls[0]
+    assert size == 3
+    assert [p["temperature"] for p in sequence_parameters] == [0.1, 0.5, 0.9]
+    assert "temperature" not in common and common["top_k"] == 50
+
+    closed = [data for _, data in appi.socketio.get("close_message")]
+    assert sorted(c["sender"] for c in closed) == ["alice", "bob", "carol"]
+    for i, close in enumerate(sorted(closed, key=lambda c: c["id"])):
+        assert close["content"] == "".join(f"{i}.{step} " for step in range(STEPS))
+        assert Message.from_db(appi.db, close["id"]).content == close["content"]
+
+
+def test_answers_are_created_before_and_streamed_concurrently(appi):
+    ask_personalities(appi, FakeModel(), [FakePersonality("alice"), FakePersonality("bob"), FakePersonality("carol")])
+
+    new_messages = appi.socketio.get("new_message")
+    updates = appi.socketio.get("update_message")
+    assert len(new_messages) == 3
+    # Every answer exists before the first chunk is streamed
+    assert max(at for at, _ in new_messages) < min(at for at, _ in updates)
+    # The chunks of the answers alternate instead of following each other
+    first_updates = [data["id"] for _, data in updates[:3]]
+    assert len(set(first_updates)) == 3
+
+
+def test_batched_answers_take_the_time_of_one(tmp_path):
+    from conftest import make_appi
+    personalities = [FakePersonality(name, 0.1*i) for i, name in enumerate(["alice", "bob", "carol", "dave"])]
+
+    batched = ask_personalities(make_appi(tmp_path/"batched"), FakeModel(), personalities)
+    serial = ask_personalities(make_appi(tmp_path/"serial"), FakeSerialModel(), personalities)
+
+    print(f"4 personalities: {batched:.3f}s batched, {serial:.3f}s one after the other")
+    assert serial >= len(personalities)*STEPS*STEP_DURATION
+    assert batched < serial/2
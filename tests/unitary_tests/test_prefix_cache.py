@@ -0,0 +1,85 @@
+from api.prefix_cache import PrefixStateCache
+from api.batching import BatchedGenerator
+
+
+class StubStateBinding:
+    """The state is the evaluated text itself, evaluated characters are counted"""
+    supports_state_cache = True
+
+    def __init__(self):
+        self.state = ""
+        self.evaluated = 0
+
+    def reset_state(self):
+        self.state = ""
+
+    def eval_prompt(self, text):
+        self.state += text
+        self.evaluated += len(text)
+
+    def save_state(self):
+        return self.state.encode("utf-8")
+
+    def load_state(self, state):
+        self.state = state.decode("utf-8")
+
+    def generate(self, prompt, n_predict=128, callback=None, keep_state=False, **gpt_params):
+        if not keep_state:
+            self.reset_state()
+        self.eval_prompt(prompt)
+        if callback is not None:
+            callback("ok", 0)
+        return self.state
+
+
+NAMESPACE = ("stub_binding", "stub_model", "english/generic/lollms")
+CONDITIONING = "You are a helpful assistant.\n"
+
+
+def test_miss_then_hit():
+    model = StubStateBinding()
+    cache = PrefixStateCache(max_memory=1024*1024)
+    generator = BatchedGenerator(prefix_cache=cache)
+
+    first_prompt = CONDITIONING + "\n!@>user: hello\n!@>assistant:"
+    output = generator.generate(model, first_prompt, prefix=CONDITIONING, prefix_namespace=NAMESPACE)
+    assert output == first_prompt
+    assert cache.misses == 1 and cache.hits == 0
+    assert model.evaluated == len(first_prompt)
+
+    history = CONDITIONING + "\n!@>user: hello\n!@>assistant: hi"
+    second_prompt = history + "\n\n!@>user: how are you?\n!@>assistant:"
+    model.evaluated = 0
+    output = generator.generate(model, second_prompt, prefix=history, prefix_namespace=NAMESPACE)
+    assert output == second_prompt
+    assert cache.hits == 1
+    # Only the text following the conditioning was evaluated
+    assert model.evaluated == len(second_prompt) - len(CONDITIONING)
+
+    model.evaluated = 0
+    third_prompt = history + "\n\n!@>user: something else\n!@>assistant:"
+    generator.generate(model, third_prompt, prefix=history, prefix_namespace=NAMESPACE)
+    assert cache.hits == 2
+    assert model.evaluated == len(third_prompt) - len(history)
+
+
+def test_namespaces_are_isolated():
+    model = StubStateBinding()
+    cache = PrefixStateCache(max_memory=1024*1024)
+    generator = BatchedGenerator(prefix_cache=cache)
+    prompt = CONDITIONING + "\n!@>user: hello\n!@>assistant:"
+    generator.generate(model, prompt, prefix=CONDITIONING, prefix_namespace=NAMESPACE)
+    generator.generate(model, prompt, prefix=CONDITIONING, prefix_namespace=("stub_binding", "other_model", "english/generic/lollms"))
+    assert cache.misses == 2 and cache.hits == 0
+
+
+def test_lru_eviction_by_memory():
+    cache = PrefixStateCache(max_memory=100)
+    cache.put(NAMESPACE, "a", b"x"*40)
+    cache.put(NAMESPACE, "b", b"x"*40)
+    assert cache.lookup(NAMESPACE, "a...") is not None
+    cache.put(NAMESPACE, "c", b"x"*40)
+    assert cache.memory == 80
+    assert cache.lookup(NAMESPACE, "b...") is None
+    assert cache.lookup(NAMESPACE, "a...") is not None
+    assert cache.lookup(NAMESPACE, "c...") is not None
@@ -0,0 +1,33 @@
+from api.resources import ResourceSampler
+
+
+def test_absent_gpu_is_detected_once(tmp_path):
+    calls = []
+    sampler = ResourceSampler(models_path=lambda: tmp_path, history_size=3, gpu_query=lambda: calls.append(1))
+    for _ in range(5):
+        sample = sampler.sample()
+    assert calls == [1]
+    assert sample["vram"] == {"nb_gpus": 0}
+    assert sample["disk"]["binding_disk_total_space"] is not None
+    assert sample["process"]["rss"] > 0
+
+
+def test_latest_and_history():
+    sampler = ResourceSampler(history_size=3, gpu_query=lambda: [(8*1024**3, 1024**3, "GPU")])
+    assert sampler.latest("vram")["gpu_0_model"] == "GPU"
+    for _ in range(4):
+        sampler.sample()
+    history = sampler.history(10, "ram")
+    assert len(history) == 3 and "time" in history[0] and "ram_usage" in history[0]
+    assert sampler.latest() is sampler.samples[-1]
+    # No models path: the binding disk is unknown
+    assert sampler.latest("disk")["binding_disk_total_space"] is None
+
+
+def test_run_calls_on_sample():
+    samples = []
+    sampler = ResourceSampler(gpu_query=lambda: None)
+    sampler.on_sample = samples.append
+    sampler.sleep = lambda interval: sampler.stop() if len(samples)>=2 else None
+    sampler.run()
+    assert len(samples) == 2
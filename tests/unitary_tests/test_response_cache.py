@@ -0,0 +1,92 @@
+from flask import Flask
+
+from api.response_cache import ResponseCache
+
+
+def test_etag_and_version():
+    cache = ResponseCache()
+    config = {"temperature": 0.1}
+    builds = []
+    app = Flask(__name__)
+    app.add_url_rule("/get_config", "get_config", lambda: cache.respond("get_config", lambda: builds.append(1) or dict(config)))
+    client = app.test_client()
+
+    response = client.get("/get_config")
+    assert response.json == {"temperature": 0.1}
+    etag = response.headers["ETag"]
+    assert client.get("/get_config", headers={"If-None-Match": etag}).status_code == 304
+    assert len(builds) == 1
+
+    config["temperature"] = 0.5
+    cache.bump()
+    response = client.get("/get_config", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.json == {"temperature": 0.5}
+    assert response.headers["ETag"] != etag and len(builds) == 2
+
+
+def test_same_content_keeps_its_etag():
+    cache = ResponseCache()
+    app = Flask(__name__)
+    with app.test_request_context("/"):
+        etag = cache.respond("key", lambda: [1, 2], version=1).headers["ETag"]
+        assert cache.respond("key", lambda: [1, 2], version=2).headers["ETag"] == etag
+
+
+class FakeBinding:
+    def __init__(self, models):
+        self.models = models
+
+    def list_models(self, config):
+        return self.models
+
+
+def test_settings_invalidate_the_config_etag(tmp_path):
+    from conftest import make_webui
+    webui = make_webui(tmp_path)
+    client = webui.serve("get_config", "update_setting")
+    etag = client.get("/get_config").headers["ETag"]
+
+    response = client.post("/update_setting", json={"setting_name": "temperature", "setting_value": 0.42})
+    assert response.get_json()["status"]
+    response = client.get("/get_config", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["temperature"] == 0.42
+    assert response.headers["ETag"] != etag
+
+
+def test_binding_and_personality_changes_invalidate_the_cache(tmp_path, monkeypatch):
+    import types
+    import api
+    import app
+    from conftest import FakePersonality, make_webui
+
+    bindings = []
+    class Builder:
+        def build_binding(self, config, lollms_paths, installation_option=None):
+            bindings.append(FakeBinding([f"model_{len(bindings)}.bin"]))
+            return bindings[-1]
+    monkeypatch.setattr(api, "BindingBuilder", Builder)
+    monkeypatch.setattr(app, "AIPersonality", lambda path, *args, **kwargs: FakePersonality(path.name), raising=False)
+    monkeypatch.setattr(app, "lollms_paths", types.SimpleNamespace(personalities_zoo_path=tmp_path), raising=False)
+
+    webui = make_webui(tmp_path, binding_name="fake", personalities=["english/test/alice"], active_personality_id=0)
+    webui.lollms_paths = types.SimpleNamespace(personal_models_path=tmp_path)
+    webui.binding = FakeBinding(["model.bin"])
+    webui.binding.binding_config = types.SimpleNamespace(update_template=lambda data: None, config=types.SimpleNamespace(save_config=lambda: None))
+    webui.activate_model = lambda: None
+    webui.mounted_personalities = [FakePersonality("alice")]
+    client = webui.serve("list_models", "reinstall_binding", "set_active_binding_settings", "reinstall_personality")
+
+    response = client.get("/list_models")
+    assert response.json == ["model.bin"]
+    etag = response.headers["ETag"]
+    assert client.post("/reinstall_binding", json={"name": "fake"}).get_json()["status"]
+    response = client.get("/list_models", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json == ["model_0.bin"]
+
+    for endpoint, data in [("set_active_binding_settings", []), ("reinstall_personality", {"name": "english/test/alice"})]:
+        version = webui.response_cache.version
+        webui.binding.binding_config = types.SimpleNamespace(update_template=lambda data: None, config=types.SimpleNamespace(save_config=lambda: None))
+        assert client.post(f"/{endpoint}", json=data).get_json()["status"]
+        assert webui.response_cache.version > version, endpoint
@@ -0,0 +1,165 @@
+import threading
+import time
+
+from lollms.types import MSG_TYPE
+from api.scheduler import GenerationScheduler, CancellationToken, PRIORITY_BACKGROUND
+from api.batching import BatchedGenerator
+
+
+def make_blocking_target(order, gate):
+    def target(name):
+        gate.wait(5)
+        order.append(name)
+    return target
+
+
+def test_clients_are_interleaved():
+    order = []
+    gate = threading.Event()
+    scheduler = GenerationScheduler(max_queue_size=10, max_concurrency=1)
+    target = make_blocking_target(order, gate)
+
+    first = scheduler.submit("a", target, args=("a0",))
+    jobs = [
+        scheduler.submit("a", target, args=("a1",)),
+        scheduler.submit("a", target, args=("a2",)),
+        scheduler.submit("b", target, args=("b1",)),
+    ]
+    gate.set()
+    for job in [first]+jobs:
+        assert job.wait(5)
+    assert order == ["a0", "a1", "b1", "a2"]
+
+
+def test_background_jobs_run_last():
+    order = []
+    gate = threading.Event()
+    scheduler = GenerationScheduler(max_queue_size=10, max_concurrency=1)
+    target = make_blocking_target(order, gate)
+
+    jobs = [
+        scheduler.submit("a", target, args=("running",)),
+        scheduler.submit("batch", target, args=("batch",), priority=PRIORITY_BACKGROUND),
+        scheduler.submit("b", target, args=("interactive",)),
+    ]
+    gate.set()
+    for job in jobs:
+        assert job.wait(5)
+    assert order == ["running", "interactive", "batch"]
+
+
+def test_queue_is_bounded_and_cancelable():
+    positions = []
+    gate = threading.Event()
+    scheduler = GenerationScheduler(max_queue_size=2, max_concurrency=1, on_queue_update=lambda job, size: positions.append((job.id, job.position)))
+    target = make_blocking_target([], gate)
+
+    running = scheduler.submit("a", target, args=("a",))
+    queued_b = scheduler.submit("b", target, args=("b",))
+    queued_c = scheduler.submit("c", target, args=("c",))
+    assert scheduler.submit("d", target, args=("d",)) is None
+    assert (queued_c.id, 2) in positions
+
+    canceled = scheduler.cancel(client_id="b")
+    assert canceled == [queued_b]
+    assert queued_b.status == "canceled"
+    assert (queued_c.id, 1) in positions
+
+    gate.set()
+    assert running.wait(5) and queued_c.wait(5)
+
+
+def test_per_binding_concurrency():
+    gate = threading.Event()
+    scheduler = GenerationScheduler(max_queue_size=10, max_concurrency=1, bindings_max_concurrency={"batched": 2})
+    target = make_blocking_target([], gate)
+
+    jobs = [scheduler.submit(f"client_{i}", target, args=(i,), binding_name="batched") for i in range(3)]
+    assert len(scheduler.running_jobs()) == 2
+    assert len(scheduler.queued_jobs()) == 1
+    gate.set()
+    for job in jobs:
+        assert job.wait(5)
+
+
+class FakeLoopBinding:
+    """Produces a token every millisecond until the callback asks to stop"""
+    def __init__(self):
+        self.started = threading.Event()
+        self.released_at = None
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        self.started.set()
+        for i in range(n_predict):
+            time.sleep(0.001)
+            if not callback(f"{i} ", MSG_TYPE.MSG_TYPE_CHUNK):
+                break
+        self.released_at = time.perf_counter()
+        return ""
+
+
+def test_cancel_latency():
+    model = FakeLoopBinding()
+    generator = BatchedGenerator()
+    scheduler = GenerationScheduler(max_queue_size=10, max_concurrency=1)
+    next_started = []
+
+    def target(cancel_token):
+        generator.generate(model, "prompt", n_predict=100000, callback=lambda chunk, msg_type: not cancel_token.canceled, cancel_token=cancel_token)
+
+    token = CancellationToken()
+    running = scheduler.submit("a", target, kwargs={"cancel_token": token}, cancel_token=token)
+    assert model.started.wait(5)
+    next_job = scheduler.submit("b", lambda: next_started.append(time.perf_counter()))
+
+    scheduler.cancel(client_id="a")
+    assert running.wait(5) and next_job.wait(5)
+    release_latency = model.released_at - token.canceled_at
+    next_latency = next_started[0] - token.canceled_at
+    print(f"\ncancel to model release: {release_latency*1000:.1f} ms, cancel to next request: {next_latency*1000:.1f} ms")
+    assert running.status == "canceled"
+    assert release_latency < 0.05
+    assert next_latency < 0.1
+
+
+def test_exclusive_jobs_of_a_client_run_one_at_a_time():
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+    def target(client):
+        with lock:
+            overlaps.append(running.count(client))
+            running.append(client)
+        time.sleep(0.05)
+        with lock:
+            running.remove(client)
+
+    scheduler = GenerationScheduler(max_queue_size=10, max_concurrency=4)
+    jobs = [scheduler.submit(client, target, args=(client,), exclusive=True) for client in ["a", "a", "b", "a"]]
+    # Not exclusive: runs next to the job of a
+    other = scheduler.submit("a", target, args=("c",))
+    time.sleep(0.02)
+    assert sorted(job.args[0] for job in scheduler.running_jobs()) == ["a", "b", "c"]
+    for job in jobs+[other]:
+        assert job.wait(5)
+    assert overlaps == [0]*5
+
+
+def test_stop_gen_only_stops_the_generations_of_the_caller(tmp_path):
+    from conftest import make_webui
+    webui = make_webui(tmp_path, max_concurrent_generations=4)
+    webui.connections = {"sid1": {"session": "s1"}, "sid2": {"session": "s1"}, "sid3": {"session": "s2"}}
+    tokens = {}
+    def target(client):
+        tokens[client].wait(5)
+    for client in ["sid1", "sid2", "sid3", "summary:1"]:
+        tokens[client] = CancellationToken()
+        webui.generation_scheduler.submit(client, target, args=(client,), cancel_token=tokens[client])
+    client = webui.serve("stop_gen")
+
+    assert client.get("/stop_gen").status_code == 400
+    assert not any(token.canceled for token in tokens.values())
+    assert client.get("/stop_gen?session=s1").get_json() == {"status": True, "canceled": 2}
+    assert client.get("/stop_gen?client_id=sid3").get_json() == {"status": True, "canceled": 1}
+    assert [c for c, token in tokens.items() if token.canceled] == ["sid1", "sid2", "sid3"]
+    tokens["summary:1"].cancel()
@@ -0,0 +1,128 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from api.server_mode import get_patched_mode, run_native, wrap_model
+
+
+# Monkey patching can't be undone, so the green thread scenario runs in its own interpreter
+GEVENT_SCENARIO = """
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from api.server_mode import get_patched_mode, start_native_thread, wrap_model
+
+assert get_patched_mode() == "gevent"
+blocking_sleep = monkey.get_original("time", "sleep")
+
+class Model:
+    supports_batch_generation = True
+    def generate(self, prompt, n_predict=128, callback=None):
+        for i in range(n_predict):
+            blocking_sleep(0.02)
+            if callback is not None and callback(str(i)) == False:
+                break
+        return prompt
+
+ticks = []
+def ticker():
+    while True:
+        ticks.append(1)
+        gevent.sleep(0.01)
+gevent.spawn(ticker)
+
+model = wrap_model(Model())
+assert model.supports_batch_generation
+chunks = []
+assert model.generate("done", n_predict=10, callback=lambda chunk: chunks.append(chunk) or len(chunks)<5) == "done"
+assert chunks == ["0", "1", "2", "3", "4"], chunks
+# The event loop kept running while the model blocked
+assert len(ticks) > 5, ticks
+print("ok")
+"""
+
+PREFIX_CACHE_SCENARIO = """
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from api.prefix_cache import PrefixStateCache
+from api.server_mode import wrap_model
+
+blocking_sleep = monkey.get_original("time", "sleep")
+get_ident = monkey.get_original("_thread", "get_ident")
+loop_thread = get_ident()
+
+class Model:
+    supports_state_cache = True
+    def __init__(self):
+        self.state = ""
+        self.threads = {}
+    def record(self, name):
+        self.threads.setdefault(name, set()).add(get_ident())
+    def reset_state(self):
+        self.record("reset_state")
+        self.state = ""
+    def eval_prompt(self, text):
+        self.record("eval_prompt")
+        blocking_sleep(0.2)
+        self.state += text
+    def save_state(self):
+        self.record("save_state")
+        return self.state.encode("utf-8")
+    def load_state(self, state):
+        self.record("load_state")
+        self.state = state.decode("utf-8")
+    def generate(self, prompt, n_predict=128, callback=None, keep_state=False, **gpt_params):
+        self.record("generate")
+        self.state += prompt
+        return self.state
+
+ticks = []
+def ticker():
+    while True:
+        ticks.append(1)
+        gevent.sleep(0.01)
+gevent.spawn(ticker)
+
+model = Model()
+cache = PrefixStateCache(max_memory=1024*1024)
+prefix = "You are a helpful assistant.\\n"
+assert cache.generate(wrap_model(model), "namespace", prefix, prefix+"Hi") == prefix+"Hi"
+assert cache.generate(wrap_model(model), "namespace", prefix, prefix+"Hello") == prefix+"Hello"
+assert cache.hits == 1
+assert set(model.threads) == {"reset_state", "eval_prompt", "save_state", "load_state", "generate"}, model.threads
+assert all(loop_thread not in threads for threads in model.threads.values()), model.threads
+# The event loop kept running while the prefix was evaluated
+assert len(ticks) > 5, ticks
+print("ok")
+"""
+
+
+def run_scenario(scenario):
+    result = subprocess.run([sys.executable, "-c", scenario], cwd=Path(__file__).resolve().parents[2], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith("ok")
+
+
+def test_run_native_without_patching():
+    class Model:
+        def generate(self, prompt, n_predict=128, callback=None):
+            for chunk in prompt:
+                if callback(chunk) == False:
+                    break
+            return prompt
+
+    assert get_patched_mode() == "threading"
+    model = Model()
+    assert wrap_model(model) is model
+    received = []
+    assert run_native(model.generate, "abc", callback=lambda chunk: received.append(chunk) or chunk != "b") == "abc"
+    assert received == ["a", "b"]
+
+
+def test_native_thread_model_keeps_the_event_loop_running():
+    run_scenario(GEVENT_SCENARIO)
+
+
+def test_prefix_cache_runs_the_model_in_native_threads():
+    run_scenario(PREFIX_CACHE_SCENARIO)
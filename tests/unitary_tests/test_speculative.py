@@ -0,0 +1,98 @@
+import time
+
+from lollms.types import MSG_TYPE
+from api.speculative import SpeculativeDecoder, supports_verification, supports_drafting
+
+VOCABULARY = 26
+PASS_TIME = 0.005
+
+
+def next_token(tokens):
+    return (tokens[-1]*7+3) % VOCABULARY
+
+
+class StubMainModel:
+    """Deterministic model paying PASS_TIME per evaluation pass, whatever the number of evaluated tokens"""
+    supports_speculative_verification = True
+
+    def __init__(self, eos_token_id=None):
+        self.eos_token_id = eos_token_id
+        self.passes = 0
+
+    def tokenize(self, text):
+        return [ord(c) % VOCABULARY for c in text]
+
+    def detokenize(self, tokens):
+        return "".join(chr(ord("a")+t) for t in tokens)
+
+    def generate(self, prompt, n_predict=128, callback=None, **gpt_params):
+        tokens = self.tokenize(prompt)
+        output = ""
+        for _ in range(n_predict):
+            time.sleep(PASS_TIME)
+            self.passes += 1
+            tokens.append(next_token(tokens))
+            output += self.detokenize(tokens[-1:])
+            if callback is not None and not callback(output[-1], MSG_TYPE.MSG_TYPE_CHUNK):
+                break
+        return output
+
+    def verify_tokens(self, tokens, draft, **gpt_params):
+        time.sleep(PASS_TIME)
+        self.passes += 1
+        return [next_token(tokens+draft[:i]) for i in range(len(draft)+1)]
+
+
+class StubDraftModel:
+    """Agrees with the main model except when the context length is a multiple of 4"""
+    def predict_tokens(self, tokens, n, **gpt_params):
+        tokens = list(tokens)
+        draft = []
+        for _ in range(n):
+            token = next_token(tokens)
+            if len(tokens) % 4 == 0:
+                token = (token+1) % VOCABULARY
+            draft.append(token)
+            tokens.append(token)
+        return draft
+
+
+def test_capabilities():
+    assert supports_verification(StubMainModel())
+    assert supports_drafting(StubDraftModel())
+    assert not supports_verification(StubDraftModel())
+
+
+def test_same_output_as_main_model_and_faster():
+    prompt = "hello"
+    start = time.perf_counter()
+    expected = StubMainModel().generate(prompt, n_predict=40)
+    plain_time = time.perf_counter()-start
+
+    model = StubMainModel()
+    decoder = SpeculativeDecoder(StubDraftModel(), n_draft_tokens=4)
+    chunks = []
+    start = time.perf_counter()
+    output = decoder.generate(model, prompt, n_predict=40, callback=lambda chunk, message_type: chunks.append(chunk) or True)
+    speculative_time = time.perf_counter()-start
+
+    stats = decoder.last_stats
+    print(f"\nacceptance rate: {stats['acceptance_rate']*100:.0f}%, tokens per pass: {stats['tokens_per_pass']:.2f}, measured speedup: x{plain_time/speculative_time:.2f}, estimated: x{stats['estimated_speedup']:.2f}")
+    assert output == expected
+    assert "".join(chunks) == expected
+    assert stats["generated_tokens"] == 40
+    assert model.passes == stats["main_model_passes"] < 20
+    assert 0.5 < stats["acceptance_rate"] < 1
+    assert plain_time/speculative_time > 1.5
+
+
+def test_stops_on_eos_and_callback():
+    prompt = "hello"
+    expected = StubMainModel().generate(prompt, n_predict=40)
+    eos = ord(expected[10])-ord("a")
+    output = SpeculativeDecoder(StubDraftModel()).generate(StubMainModel(eos_token_id=eos), prompt, n_predict=40)
+    assert output == expected[:expected.index(expected[10])]
+
+    chunks = []
+    SpeculativeDecoder(StubDraftModel()).generate(StubMainModel(), prompt, n_predict=40, callback=lambda chunk, message_type: chunks.append(chunk) or len(chunks)<5)
+    assert len(chunks) == 5
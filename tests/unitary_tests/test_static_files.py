@@ -0,0 +1,56 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+from api.static_files import StaticFiles, accepted_encodings, precompress
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path/"assets").mkdir()
+    (tmp_path/"assets"/"index-c75baf49.js").write_text("console.log('lollms');"*100)
+    (tmp_path/"index.html").write_text("<html></html>")
+    (tmp_path/"uploads").mkdir()
+    (tmp_path/"uploads"/"report-20230815.txt").write_text("draft")
+    static_files = StaticFiles()
+    app = Flask(__name__)
+    app.add_url_rule("/uploads/<path:filename>", "serve_uploads", lambda filename: static_files.serve(tmp_path/"uploads", filename))
+    app.add_url_rule("/<path:filename>", "serve_static", lambda filename: static_files.serve(tmp_path, filename, immutable=True))
+    with app.test_client() as client:
+        yield client
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate, br;q=0") == {"gzip", "deflate"}
+    assert accepted_encodings(None) == set()
+
+
+def test_etag_and_cache_control(client):
+    response = client.get("/index.html")
+    assert response.status_code == 200 and response.headers["Cache-Control"] == "no-cache"
+    etag = response.headers["ETag"]
+    assert client.get("/index.html", headers={"If-None-Match": etag}).status_code == 304
+    response = client.get("/assets/index-c75baf49.js")
+    assert "immutable" in response.headers["Cache-Control"]
+
+
+def test_only_built_files_are_immutable(client, tmp_path):
+    # Named like a hashed file, but can be replaced
+    response = client.get("/uploads/report-20230815.txt")
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert client.get("/uploads/report-20230815.txt", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_precompressed_variant(client, tmp_path):
+    assert precompress(tmp_path) >= 1
+    response = client.get("/assets/index-c75baf49.js", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype in ["application/javascript", "text/javascript"]
+    assert gzip.decompress(response.data) == (tmp_path/"assets"/"index-c75baf49.js").read_bytes()
+    assert "Content-Encoding" not in client.get("/assets/index-c75baf49.js").headers
+
+
+def test_missing_and_outside_files(client):
+    assert client.get("/missing.js").status_code == 404
+    assert client.get("/../secret.txt").status_code == 404
@@ -0,0 +1,36 @@
+from lollms.types import MSG_TYPE
+from api.streaming import negotiate_protocol, compact_update, COMPACT_UPDATE_FIELDS, MessageStream, text_checksum
+
+
+def test_negotiate_protocol():
+    assert negotiate_protocol(None) == "json"
+    assert negotiate_protocol("compact") == "compact"
+    assert negotiate_protocol(["msgpack", "compact", "json"]) == "compact"
+    assert negotiate_protocol(["unknown"]) == "json"
+
+
+def test_compact_update_follows_the_field_order():
+    update = compact_update(12, 3, 0, "hello", None)
+    assert dict(zip(COMPACT_UPDATE_FIELDS, update)) == {"id": 12, "seq": 3, "message_type": 0, "content": "hello", "metadata": None}
+
+
+def test_message_stream_numbers_updates_and_tracks_the_content():
+    stream = MessageStream(7, "please stand by")
+    assert stream.apply("Hel", MSG_TYPE.MSG_TYPE_FULL.value) == 1
+    assert stream.apply("lo", MSG_TYPE.MSG_TYPE_CHUNK.value) == 2
+    assert stream.apply("step", MSG_TYPE.MSG_TYPE_STEP.value) == 3
+    state = stream.get_state()
+    assert state["content"] == "Hello" and state["seq"] == 3
+    assert state["checksum"] == text_checksum("Hello") and state["length"] == 5
+
+
+def test_message_stream_replays_the_updates_after_a_sequence_number():
+    stream = MessageStream(7, session="abc", replay_size=3)
+    for chunk in ["a", "b", "c", "d"]:
+        stream.apply(chunk, MSG_TYPE.MSG_TYPE_CHUNK.value)
+    assert [update[2] for update in stream.replay(2)] == ["c", "d"]
+    assert stream.replay(4) == []
+    # The first update was evicted from the buffer
+    assert stream.replay(0) is None
+    assert MessageStream(8).replay(0) == []
+    assert stream.content == "abcd"
@@ -0,0 +1,53 @@
+from lollms.types import MSG_TYPE
+from api.db import DiscussionsDB
+from api.summarizer import DiscussionSummarizer
+
+
+def tokenize(text):
+    return text.split()
+
+
+def make_discussion(tmp_path, n_messages):
+    db = DiscussionsDB(tmp_path/"database.db")
+    db.create_tables()
+    db.add_missing_columns()
+    discussion = db.create_discussion()
+    for i in range(n_messages):
+        discussion.add_message(MSG_TYPE.MSG_TYPE_FULL.value, 0, "user" if i%2==0 else "lollms", " ".join(["word"]*9))
+    return discussion
+
+
+def test_short_discussions_are_not_summarized(tmp_path):
+    discussion = make_discussion(tmp_path, 4)
+    summarizer = DiscussionSummarizer(tokenize, threshold=100, keep_tokens=20)
+    assert summarizer.select(discussion.get_messages()) == []
+
+
+def test_oldest_messages_are_folded(tmp_path):
+    discussion = make_discussion(tmp_path, 12)
+    messages = discussion.get_messages()
+    summarizer = DiscussionSummarizer(tokenize, threshold=100, keep_tokens=20)
+    # Each message takes 10 tokens: the last two are kept
+    folded = summarizer.select(messages)
+    assert [m.id for m in folded] == [m.id for m in messages[:10]]
+
+    discussion.add_summary(folded[-1].id, "they said word a lot")
+    last_id, content = discussion.get_summary()
+    assert last_id == folded[-1].id and content == "they said word a lot"
+    assert discussion.get_summary(folded[-1].id) is None
+    # Only the messages following the summary count
+    assert summarizer.select(messages, last_id) == []
+
+    prompt = summarizer.build_prompt(messages[10:], content)
+    assert "summary of the previous messages: they said word a lot" in prompt
+    assert prompt.endswith("!@>summary:")
+
+
+def test_deleting_a_summarized_message_drops_the_summary(tmp_path):
+    discussion = make_discussion(tmp_path, 6)
+    messages = discussion.get_messages()
+    discussion.add_summary(messages[3].id, "summary")
+    discussion.delete_message(messages[4].id)
+    assert discussion.get_summary() is not None
+    discussion.delete_message(messages[2].id)
+    assert discussion.get_summary() is None
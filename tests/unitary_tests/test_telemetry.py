@@ -0,0 +1,53 @@
+import time
+
+from lollms.types import MSG_TYPE
+from api.db import DiscussionsDB
+from api.telemetry import GenerationTrace, GenerationTelemetry, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(101)), 90) == 90
+
+
+def test_trace_measures_a_generation():
+    queued_at = time.perf_counter()
+    time.sleep(0.02)
+    trace = GenerationTrace("binding", "model", "english/generic/lollms", queued_at)
+    trace.prompt_ready(12)
+    trace.generation_started()
+    received = []
+    callback = trace.wrap(lambda chunk, message_type: received.append(chunk) or True)
+    time.sleep(0.02)
+    for i in range(5):
+        callback(f"{i}", MSG_TYPE.MSG_TYPE_CHUNK)
+        time.sleep(0.01)
+    callback("step", MSG_TYPE.MSG_TYPE_STEP)
+    record = trace.finish(message_id=3)
+
+    assert len(received) == 6
+    assert record["prompt_tokens"] == 12 and record["generated_tokens"] == 5
+    assert record["queue_wait"] >= 0.02
+    assert record["prompt_processing_time"] >= 0.02
+    assert record["ttft"] >= record["queue_wait"] + record["prompt_processing_time"]
+    assert 0 < record["decode_tokens_per_second"] <= 100
+    assert record["total_time"] >= record["ttft"]
+
+
+def test_stats_and_db_rows(tmp_path):
+    db = DiscussionsDB(tmp_path/"database.db")
+    db.create_tables()
+    telemetry = GenerationTelemetry(max_records=3, db=db)
+    for i in range(4):
+        trace = GenerationTrace("binding", "model" if i<3 else "other", "english/generic/lollms")
+        telemetry.add(trace.finish(message_id=i))
+
+    assert len(telemetry.get_records()) == 3
+    assert len(telemetry.get_records(model_name="model")) == 2
+    stats = telemetry.get_stats()
+    assert stats["count"] == 3
+    assert stats["ttft"]["p50"] is None
+    assert stats["total_time"]["p99"] >= stats["total_time"]["p50"] >= 0
+    assert db.select("SELECT COUNT(*) FROM generation_telemetry", fetch_all=False)[0] == 4